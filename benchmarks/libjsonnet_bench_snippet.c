@@ -0,0 +1,62 @@
+/*
+Copyright 2015 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+*/
+
+/* Measures the per-call overhead of evaluating a small snippet with a reused VM.
+ *
+ * Usage: libjsonnet_bench_snippet [iterations [snippet]]
+ */
+
+#define _POSIX_C_SOURCE 199309L
+
+#include <stdlib.h>
+#include <stdio.h>
+#include <time.h>
+
+#include <libjsonnet.h>
+
+static double now(void)
+{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+int main(int argc, const char **argv)
+{
+    int iterations = argc > 1 ? atoi(argv[1]) : 1000;
+    const char *snippet = argc > 2 ? argv[2] : "{ a: 1, b: std.length([1, 2, 3]) }";
+    struct JsonnetVm *vm = jsonnet_make();
+    double start, elapsed;
+    int i, error;
+
+    start = now();
+    for (i = 0; i < iterations; ++i) {
+        char *output = jsonnet_evaluate_snippet(vm, "snippet", snippet, &error);
+        if (error) {
+            fprintf(stderr, "%s", output);
+            jsonnet_realloc(vm, output, 0);
+            jsonnet_destroy(vm);
+            return EXIT_FAILURE;
+        }
+        jsonnet_realloc(vm, output, 0);
+    }
+    elapsed = now() - start;
+    jsonnet_destroy(vm);
+
+    printf("%d evaluations in %.3f s: %.1f us per evaluation\n", iterations, elapsed,
+           elapsed / iterations * 1e6);
+    return EXIT_SUCCESS;
+}
@@ -4,6 +4,8 @@ set -e
 set -x
 
 ../jsonnet -S gen_big_object.jsonnet > bench.05.gen.jsonnet
+../jsonnet -S gen_big_local.jsonnet > bench.09.gen.jsonnet
+../jsonnet -S gen_documented_object.jsonnet > bench.10.gen.jsonnet
 
 for i in *.gen.jsonnet; do
 	../jsonnet fmt -i "$i"
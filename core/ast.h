@@ -23,6 +23,7 @@ limitations under the License.
 #include <iostream>
 #include <list>
 #include <map>
+#include <set>
 #include <string>
 #include <vector>
 
@@ -366,13 +367,15 @@ struct Binary : public AST {
 /** Represents built-in functions.
  *
  * There is no parse rule to build this AST.  Instead, it is used to build the std object in the
- * interpreter.
+ * interpreter, and the optimizer replaces references to std functions with it.
  */
 struct BuiltinFunction : public AST {
     std::string name;
     Identifiers params;
-    BuiltinFunction(const LocationRange &lr, const std::string &name, const Identifiers &params)
-        : AST(lr, AST_BUILTIN_FUNCTION, Fodder{}), name(name), params(params)
+    unsigned long builtin;  // The index of the builtin, see jsonnet_builtin_decl.
+    BuiltinFunction(const LocationRange &lr, const std::string &name, const Identifiers &params,
+                    unsigned long builtin)
+        : AST(lr, AST_BUILTIN_FUNCTION, Fodder{}), name(name), params(params), builtin(builtin)
     {
     }
 };
@@ -942,6 +945,7 @@ struct Var : public AST {
  */
 class Allocator {
     std::map<UString, const Identifier *> internedIdentifiers;
+    std::set<std::string> fileNames;
     ASTs allocated;
 
    public:
@@ -974,6 +978,17 @@ class Allocator {
         internedIdentifiers[name] = r;
         return r;
     }
+    /** Returns interned file names, for the locations of the ASTs made by this allocator.
+     *
+     * They are kept as long as the allocator, i.e. as long as the ASTs.  Returns nullptr for the
+     * empty name.
+     */
+    const std::string *makeFileName(const std::string &name)
+    {
+        if (name.empty())
+            return nullptr;
+        return &*fileNames.insert(name).first;
+    }
     ~Allocator()
     {
         for (auto x : allocated) {
@@ -21,20 +21,23 @@ limitations under the License.
 #include "ast.h"
 #include "desugarer.h"
 #include "lexer.h"
+#include "optimizer.h"
 #include "parser.h"
 #include "pass.h"
+#include "static_analysis.h"
 #include "string_utils.h"
 
 static const Fodder EF;  // Empty fodder.
 
 static const LocationRange E;  // Empty.
 
-struct BuiltinDecl {
-    UString name;
-    std::vector<UString> params;
-};
+static unsigned long max_builtin = 75;
+
+unsigned long jsonnet_builtin_count(void)
+{
+    return max_builtin + 1;
+}
 
-static unsigned long max_builtin = 37;
 BuiltinDecl jsonnet_builtin_decl(unsigned long builtin)
 {
     switch (builtin) {
@@ -76,6 +79,46 @@ BuiltinDecl jsonnet_builtin_decl(unsigned long builtin)
         case 35: return {U"parseJson", {U"str"}};
         case 36: return {U"encodeUTF8", {U"str"}};
         case 37: return {U"decodeUTF8", {U"arr"}};
+        case 38: return {U"slice", {U"indexable", U"index", U"end", U"step"}};
+        case 39: return {U"sortImpl", {U"arr", U"keyF"}};
+        case 40: return {U"uniqImpl", {U"arr", U"keyF"}};
+        case 41: return {U"setImpl", {U"arr", U"keyF"}};
+        case 42: return {U"setMemberImpl", {U"x", U"arr", U"keyF"}};
+        case 43: return {U"setUnionImpl", {U"a", U"b", U"keyF"}};
+        case 44: return {U"setInterImpl", {U"a", U"b", U"keyF"}};
+        case 45: return {U"setDiffImpl", {U"a", U"b", U"keyF"}};
+        case 46: return {U"manifestJsonEx", {U"value", U"indent"}};
+        case 47: return {U"manifestYamlDocImpl", {U"value", U"indent_array_in_object"}};
+        case 48:
+            return {U"manifestYamlStreamImpl",
+                    {U"value", U"indent_array_in_object", U"c_document_end"}};
+        case 49: return {U"format", {U"str", U"vals"}};
+        case 50: return {U"startsWith", {U"a", U"b"}};
+        case 51: return {U"endsWith", {U"a", U"b"}};
+        case 52: return {U"lstripChars", {U"str", U"chars"}};
+        case 53: return {U"rstripChars", {U"str", U"chars"}};
+        case 54: return {U"stripChars", {U"str", U"chars"}};
+        case 55: return {U"parseInt", {U"str"}};
+        case 56: return {U"parseOctal", {U"str"}};
+        case 57: return {U"parseHex", {U"str"}};
+        case 58: return {U"escapeStringJson", {U"str_"}};
+        case 59: return {U"escapeStringPython", {U"str"}};
+        case 60: return {U"escapeStringBash", {U"str_"}};
+        case 61: return {U"escapeStringDollars", {U"str_"}};
+        case 62: return {U"base64", {U"input"}};
+        case 63: return {U"base64DecodeBytes", {U"str"}};
+        case 64: return {U"base64Decode", {U"str"}};
+        case 65: return {U"findSubstr", {U"pat", U"str"}};
+        case 66: return {U"split", {U"str", U"c"}};
+        case 67: return {U"map", {U"func", U"arr"}};
+        case 68: return {U"mapWithIndex", {U"func", U"arr"}};
+        case 69: return {U"flatMap", {U"func", U"arr"}};
+        case 70: return {U"foldl", {U"func", U"arr", U"init"}};
+        case 71: return {U"foldr", {U"func", U"arr", U"init"}};
+        case 72: return {U"flattenArrays", {U"arrs"}};
+        case 73: return {U"equals", {U"a", U"b"}};
+        case 74: return {U"mergePatch", {U"target", U"patch"}};
+        case 75: return {U"prune", {U"a"}};
         default:
             std::cerr << "INTERNAL ERROR: Unrecognized builtin function: " << builtin << std::endl;
             std::abort();
@@ -901,12 +944,12 @@ class Desugarer {
         }
     }
 
-    void desugarFile(AST *&ast, std::map<std::string, VmExt> *tlas)
+    /** Build the standard library as a closed expression: local std = (std.jsonnet stuff); std
+     */
+    AST *desugarStd(void)
     {
-        desugar(ast, 0);
-
-        // Now, implement the std library by wrapping in a local construct.
-        Tokens tokens = jsonnet_lex("std.jsonnet", STD_CODE);
+        Tokens tokens = jsonnet_lex(alloc, "std.jsonnet", STD_CODE);
+        jsonnet_strip_fodder(tokens);
         AST *std_ast = jsonnet_parse(alloc, tokens);
         desugar(std_ast, 0);
         auto *std_obj = dynamic_cast<DesugaredObject *>(std_ast);
@@ -923,7 +966,7 @@ class Desugarer {
             for (const auto &p : decl.params)
                 params.push_back(id(p));
             auto name = str(decl.name);
-            auto fn = make<BuiltinFunction>(E, encode_utf8(decl.name), params);
+            auto fn = make<BuiltinFunction>(E, encode_utf8(decl.name), params, c);
             auto field = std::find_if(fields.begin(), fields.end(),
                 [=](const DesugaredObject::Field& f) {
                     return static_cast<LiteralString*>(f.name)->value == decl.name;
@@ -934,8 +977,13 @@ class Desugarer {
                 fields.emplace_back(ObjectField::HIDDEN, name, fn);
             }
         }
-        fields.emplace_back(
-            ObjectField::HIDDEN, str(U"thisFile"), str(decode_utf8(ast->location.file)));
+
+        return make<Local>(E, EF, singleBind(id(U"std"), std_obj), std());
+    }
+
+    void desugarFile(AST *&ast, std::map<std::string, VmExt> *tlas)
+    {
+        desugar(ast, 0);
 
         std::vector<std::string> empty;
         auto line_end_blank = Fodder{{FodderElement::LINE_END, 1, 0, empty}};
@@ -947,13 +995,14 @@ class Desugarer {
         // else
         //     body
         if (tlas != nullptr) {
-            LocationRange tla_loc("Top-level function");
+            LocationRange tla_loc(alloc->makeFileName("Top-level function"));
             ArgParams args;
             for (const auto &pair : *tlas) {
                 AST *expr;
                 if (pair.second.isCode) {
                     // Now, implement the std library by wrapping in a local construct.
-                    Tokens tokens = jsonnet_lex("tla:" + pair.first, pair.second.data.c_str());
+                    Tokens tokens =
+                        jsonnet_lex(alloc, "tla:" + pair.first, pair.second.data.c_str());
                     expr = jsonnet_parse(alloc, tokens);
                     desugar(expr, 0);
                 } else {
@@ -985,11 +1034,32 @@ class Desugarer {
                                               make<Var>(E, line_end, body)));
         }
 
-        // local std = (std.jsonnet stuff); ast
+        // local std = $std + { thisFile:: file }; ast
+        // Where $std is the shared standard library, bound by the interpreter.
+        DesugaredObject::Fields fields;
+        fields.emplace_back(
+            ObjectField::HIDDEN, str(U"thisFile"), str(decode_utf8(ast->location.fileName())));
+        AST *std_obj = make<Binary>(E, EF, var(id(U"$std")), EF, BOP_PLUS,
+                                    make<DesugaredObject>(E, ASTs{}, fields));
         ast = make<Local>(ast->location, EF, singleBind(id(U"std"), std_obj), ast);
     }
 };
 
+const AST *jsonnet_std_ast(void)
+{
+    // The allocator is deliberately never freed, as evaluations on other threads may still be
+    // using the AST while static objects are destroyed at exit.  Initialization of the static
+    // is thread-safe.
+    static const AST *std_ast = [] {
+        Allocator *alloc = new Allocator();
+        AST *r = Desugarer(alloc).desugarStd();
+        jsonnet_static_analysis(r);
+        jsonnet_optimize(alloc, r);
+        return r;
+    }();
+    return std_ast;
+}
+
 void jsonnet_desugar(Allocator *alloc, AST *&ast, std::map<std::string, VmExt> *tlas)
 {
     Desugarer desugarer(alloc);
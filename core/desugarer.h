@@ -19,6 +19,7 @@ limitations under the License.
 
 #include <map>
 #include <string>
+#include <vector>
 
 #include "ast.h"
 #include "vm.h"
@@ -31,4 +32,24 @@ limitations under the License.
  */
 void jsonnet_desugar(Allocator *alloc, AST *&ast, std::map<std::string, VmExt> *tla);
 
+/** A function of the standard library that is implemented by the interpreter. */
+struct BuiltinDecl {
+    UString name;
+    std::vector<UString> params;
+};
+
+/** The number of builtins, which are numbered from 0. */
+unsigned long jsonnet_builtin_count(void);
+
+/** The name and parameters of the given builtin. */
+BuiltinDecl jsonnet_builtin_decl(unsigned long builtin);
+
+/** The standard library, desugared and statically analysed.
+ *
+ * It is built on first use and then shared by every evaluation in the process, so it must not
+ * be modified.  Desugared files refer to it through the free variable $std, which the
+ * interpreter binds.  Its identifiers come from its own allocator, not that of the file.
+ */
+const AST *jsonnet_std_ast(void);
+
 #endif
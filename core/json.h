@@ -17,6 +17,7 @@ limitations under the License.
 #ifndef JSONNET_JSON_H
 #define JSONNET_JSON_H
 
+#include <map>
 #include <memory>
 #include <string>
 #include <vector>
@@ -47,6 +48,10 @@ struct JsonnetJsonValue {
     double number;  // Also used for bool (0.0 and 1.0)
     std::vector<std::unique_ptr<JsonnetJsonValue>> elements;
     std::map<std::string, std::unique_ptr<JsonnetJsonValue>> fields;
+
+    /** Index of fields by position, built on demand by jsonnet_json_object_field. */
+    mutable std::vector<std::map<std::string, std::unique_ptr<JsonnetJsonValue>>::const_iterator>
+        fieldIndex;
 };
 
 #endif
@@ -20,6 +20,7 @@ limitations under the License.
 #include <sstream>
 #include <string>
 
+#include "ast.h"
 #include "lexer.h"
 #include "static_error.h"
 #include "unicode.h"
@@ -420,10 +421,11 @@ static void add_whitespace(Fodder &fodder, const char *s, size_t n)
 }
 */
 
-Tokens jsonnet_lex(const std::string &filename, const char *input)
+Tokens jsonnet_lex(Allocator *alloc, const std::string &filename, const char *input)
 {
     unsigned long line_number = 1;
     const char *line_start = input;
+    const std::string *file = alloc->makeFileName(filename);
 
     Tokens r;
 
@@ -814,17 +816,23 @@ Tokens jsonnet_lex(const std::string &filename, const char *input)
                        data,
                        string_block_indent,
                        string_block_term_indent,
-                       LocationRange(filename, begin, end));
+                       LocationRange(file, begin, end));
         fodder.clear();
         fresh_line = false;
     }
 
     Location begin(line_number, c - line_start + 1);
     Location end(line_number, (c + 1) - line_start + 1);
-    r.emplace_back(Token::END_OF_FILE, fodder, "", "", "", LocationRange(filename, begin, end));
+    r.emplace_back(Token::END_OF_FILE, fodder, "", "", "", LocationRange(file, begin, end));
     return r;
 }
 
+void jsonnet_strip_fodder(Tokens &tokens)
+{
+    for (auto &t : tokens)
+        Fodder().swap(t.fodder);
+}
+
 std::string jsonnet_unlex(const Tokens &tokens)
 {
     std::stringstream ss;
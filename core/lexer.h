@@ -400,7 +400,25 @@ static inline std::ostream &operator<<(std::ostream &o, const Token &v)
 /** IF the given identifier is a keyword, return its kind, otherwise return IDENTIFIER. */
 Token::Kind lex_get_keyword_kind(const std::string &identifier);
 
-Tokens jsonnet_lex(const std::string &filename, const char *input);
+class Allocator;
+
+/** Lex a file.
+ *
+ * \param alloc Allocator that interns the file name, so it must outlive the tokens and the ASTs
+ * parsed from them.
+ * \param filename The name of the file, used in locations and error messages.
+ * \param input The content of the file.
+ * \throws StaticError if the input is not valid.
+ * \returns The tokens, ending with END_OF_FILE.
+ */
+Tokens jsonnet_lex(Allocator *alloc, const std::string &filename, const char *input);
+
+/** Discard the fodder of the tokens.
+ *
+ * Comments and whitespace are only needed by the formatter.  This is used before parsing code
+ * that is only going to be evaluated, so that the AST does not carry copies of them.
+ */
+void jsonnet_strip_fodder(Tokens &tokens);
 
 std::string jsonnet_unlex(const Tokens &tokens);
 
@@ -17,6 +17,7 @@ limitations under the License.
 #include "lexer.h"
 
 #include <list>
+#include "ast.h"
 #include "gtest/gtest.h"
 
 namespace {
@@ -28,7 +29,8 @@ void testLex(const char* name, const char* input, const std::list<Token>& tokens
     test_tokens.push_back(Token(Token::Kind::END_OF_FILE, ""));
 
     try {
-        std::list<Token> lexed_tokens = jsonnet_lex(name, input);
+        Allocator allocator;
+        std::list<Token> lexed_tokens = jsonnet_lex(&allocator, name, input);
         ASSERT_EQ(test_tokens, lexed_tokens) << "Test failed: " << name << std::endl;
     } catch (StaticError& e) {
         ASSERT_EQ(error, e.toString());
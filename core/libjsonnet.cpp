@@ -32,6 +32,7 @@ extern "C" {
 #include "desugarer.h"
 #include "formatter.h"
 #include "json.h"
+#include "optimizer.h"
 #include "parser.h"
 #include "static_analysis.h"
 #include "vm.h"
@@ -83,6 +84,50 @@ int jsonnet_json_extract_null(struct JsonnetVm *vm, const struct JsonnetJsonValu
     return v->kind == JsonnetJsonValue::NULL_KIND;
 }
 
+int jsonnet_json_extract_array(struct JsonnetVm *vm, const struct JsonnetJsonValue *v, size_t *out)
+{
+    (void)vm;
+    if (v->kind != JsonnetJsonValue::ARRAY)
+        return 0;
+    *out = v->elements.size();
+    return 1;
+}
+
+const JsonnetJsonValue *jsonnet_json_array_element(struct JsonnetVm *vm,
+                                                   const struct JsonnetJsonValue *arr, size_t i)
+{
+    (void)vm;
+    if (arr->kind != JsonnetJsonValue::ARRAY || i >= arr->elements.size())
+        return nullptr;
+    return arr->elements[i].get();
+}
+
+int jsonnet_json_extract_object(struct JsonnetVm *vm, const struct JsonnetJsonValue *v, size_t *out)
+{
+    (void)vm;
+    if (v->kind != JsonnetJsonValue::OBJECT)
+        return 0;
+    *out = v->fields.size();
+    return 1;
+}
+
+const char *jsonnet_json_object_field(struct JsonnetVm *vm, const struct JsonnetJsonValue *obj,
+                                      size_t i, const struct JsonnetJsonValue **v)
+{
+    (void)vm;
+    if (obj->kind != JsonnetJsonValue::OBJECT || i >= obj->fields.size())
+        return nullptr;
+    if (obj->fieldIndex.size() != obj->fields.size()) {
+        obj->fieldIndex.clear();
+        obj->fieldIndex.reserve(obj->fields.size());
+        for (auto it = obj->fields.begin(); it != obj->fields.end(); ++it)
+            obj->fieldIndex.push_back(it);
+    }
+    const auto &it = obj->fieldIndex[i];
+    *v = it->second.get();
+    return it->first.c_str();
+}
+
 JsonnetJsonValue *jsonnet_json_make_string(JsonnetVm *vm, const char *v)
 {
     (void)vm;
@@ -147,6 +192,7 @@ void jsonnet_json_object_append(JsonnetVm *vm, JsonnetJsonValue *obj, const char
     (void)vm;
     assert(obj->kind == JsonnetJsonValue::OBJECT);
     obj->fields[std::string(f)] = std::unique_ptr<JsonnetJsonValue>(v);
+    obj->fieldIndex.clear();
 }
 
 void jsonnet_json_destroy(JsonnetVm *vm, JsonnetJsonValue *v)
@@ -167,6 +213,7 @@ struct JsonnetVm {
     void *importCallbackContext;
     bool stringOutput;
     std::vector<std::string> jpaths;
+    VmAstCache importCache;
 
     FmtOpts fmtOpts;
     bool fmtDebugDesugaring;
@@ -353,6 +400,30 @@ void jsonnet_tla_code(JsonnetVm *vm, const char *key, const char *val)
     vm->tla[key] = VmExt(val, true);
 }
 
+void jsonnet_ext_clear(JsonnetVm *vm)
+{
+    vm->ext.clear();
+}
+
+void jsonnet_tla_clear(JsonnetVm *vm)
+{
+    vm->tla.clear();
+}
+
+void jsonnet_import_cache_size(JsonnetVm *vm, unsigned v)
+{
+    vm->importCache.setCapacity(v);
+}
+
+void jsonnet_import_cache_invalidate(JsonnetVm *vm, const char *path)
+{
+    if (path == nullptr) {
+        vm->importCache.clear();
+    } else {
+        vm->importCache.invalidate(path);
+    }
+}
+
 void jsonnet_fmt_debug_desugaring(JsonnetVm *vm, int v)
 {
     vm->fmtDebugDesugaring = v;
@@ -425,7 +496,7 @@ static char *jsonnet_fmt_snippet_aux(JsonnetVm *vm, const char *filename, const
         std::string json_str;
         AST *expr;
         std::map<std::string, std::string> files;
-        Tokens tokens = jsonnet_lex(filename, snippet);
+        Tokens tokens = jsonnet_lex(&alloc, filename, snippet);
 
         // std::cout << jsonnet_unlex(tokens);
 
@@ -478,16 +549,22 @@ char *jsonnet_fmt_snippet(JsonnetVm *vm, const char *filename, const char *snipp
 }
 
 namespace {
-enum EvalKind { REGULAR, MULTI, STREAM };
+enum EvalKind { REGULAR, MULTI, STREAM, JSON };
 }  // namespace
 
+/** Evaluate the snippet, returning the output buffer or error message.
+ *
+ * For EvalKind JSON, the value is instead stored in *json_out and nullptr is returned on success.
+ */
 static char *jsonnet_evaluate_snippet_aux(JsonnetVm *vm, const char *filename, const char *snippet,
-                                          int *error, EvalKind kind)
+                                          int *error, EvalKind kind,
+                                          std::unique_ptr<JsonnetJsonValue> *json_out = nullptr)
 {
     try {
         Allocator alloc;
         AST *expr;
-        Tokens tokens = jsonnet_lex(filename, snippet);
+        Tokens tokens = jsonnet_lex(&alloc, filename, snippet);
+        jsonnet_strip_fodder(tokens);
 
         expr = jsonnet_parse(&alloc, tokens);
 
@@ -502,6 +579,7 @@ static char *jsonnet_evaluate_snippet_aux(JsonnetVm *vm, const char *filename, c
         max_stack++;
 
         jsonnet_static_analysis(expr);
+        jsonnet_optimize(&alloc, expr);
         switch (kind) {
             case REGULAR: {
                 std::string json_str = jsonnet_vm_execute(&alloc,
@@ -513,7 +591,8 @@ static char *jsonnet_evaluate_snippet_aux(JsonnetVm *vm, const char *filename, c
                                                           vm->nativeCallbacks,
                                                           vm->importCallback,
                                                           vm->importCallbackContext,
-                                                          vm->stringOutput);
+                                                          vm->stringOutput,
+                                                          &vm->importCache);
                 json_str += "\n";
                 *error = false;
                 return from_string(vm, json_str);
@@ -530,7 +609,8 @@ static char *jsonnet_evaluate_snippet_aux(JsonnetVm *vm, const char *filename, c
                                              vm->nativeCallbacks,
                                              vm->importCallback,
                                              vm->importCallbackContext,
-                                             vm->stringOutput);
+                                             vm->stringOutput,
+                                             &vm->importCache);
                 size_t sz = 1;  // final sentinel
                 for (const auto &pair : files) {
                     sz += pair.first.length() + 1;   // include sentinel
@@ -565,7 +645,9 @@ static char *jsonnet_evaluate_snippet_aux(JsonnetVm *vm, const char *filename, c
                                               vm->gcGrowthTrigger,
                                               vm->nativeCallbacks,
                                               vm->importCallback,
-                                              vm->importCallbackContext);
+                                              vm->importCallbackContext,
+                                              vm->stringOutput,
+                                              &vm->importCache);
                 size_t sz = 1;  // final sentinel
                 for (const auto &doc : documents) {
                     sz += doc.length() + 2;  // Add a '\n' as well as sentinel
@@ -587,6 +669,22 @@ static char *jsonnet_evaluate_snippet_aux(JsonnetVm *vm, const char *filename, c
                 return buf;
             } break;
 
+            case JSON: {
+                *json_out = jsonnet_vm_execute_json(&alloc,
+                                                    expr,
+                                                    vm->ext,
+                                                    max_stack,
+                                                    vm->gcMinObjects,
+                                                    vm->gcGrowthTrigger,
+                                                    vm->nativeCallbacks,
+                                                    vm->importCallback,
+                                                    vm->importCallbackContext,
+                                                    vm->stringOutput,
+                                                    &vm->importCache);
+                *error = false;
+                return nullptr;
+            } break;
+
             default:
                 fputs("INTERNAL ERROR: bad value of 'kind', probably memory corruption.\n", stderr);
                 abort();
@@ -621,7 +719,8 @@ static char *jsonnet_evaluate_snippet_aux(JsonnetVm *vm, const char *filename, c
 }
 
 static char *jsonnet_evaluate_file_aux(JsonnetVm *vm, const char *filename, int *error,
-                                       EvalKind kind)
+                                       EvalKind kind,
+                                       std::unique_ptr<JsonnetJsonValue> *json_out = nullptr)
 {
     std::ifstream f;
     f.open(filename);
@@ -634,7 +733,21 @@ static char *jsonnet_evaluate_file_aux(JsonnetVm *vm, const char *filename, int
     std::string input;
     input.assign(std::istreambuf_iterator<char>(f), std::istreambuf_iterator<char>());
 
-    return jsonnet_evaluate_snippet_aux(vm, filename, input.c_str(), error, kind);
+    return jsonnet_evaluate_snippet_aux(vm, filename, input.c_str(), error, kind, json_out);
+}
+
+/** Turn the result of an EvalKind JSON evaluation into a value, which is the error message as a
+ * string value if there was an error.
+ */
+static JsonnetJsonValue *json_result(JsonnetVm *vm, char *msg,
+                                     std::unique_ptr<JsonnetJsonValue> &json, int error)
+{
+    if (error) {
+        JsonnetJsonValue *r = jsonnet_json_make_string(vm, msg);
+        jsonnet_realloc(vm, msg, 0);
+        return r;
+    }
+    return json.release();
 }
 
 char *jsonnet_evaluate_file(JsonnetVm *vm, const char *filename, int *error)
@@ -661,6 +774,16 @@ char *jsonnet_evaluate_file_stream(JsonnetVm *vm, const char *filename, int *err
     return nullptr;  // Never happens.
 }
 
+JsonnetJsonValue *jsonnet_evaluate_file_json(JsonnetVm *vm, const char *filename, int *error)
+{
+    TRY
+        std::unique_ptr<JsonnetJsonValue> json;
+        char *msg = jsonnet_evaluate_file_aux(vm, filename, error, JSON, &json);
+        return json_result(vm, msg, json, *error);
+    CATCH("jsonnet_evaluate_file_json")
+    return nullptr;  // Never happens.
+}
+
 char *jsonnet_evaluate_snippet(JsonnetVm *vm, const char *filename, const char *snippet, int *error)
 {
     TRY
@@ -687,6 +810,17 @@ char *jsonnet_evaluate_snippet_stream(JsonnetVm *vm, const char *filename, const
     return nullptr;  // Never happens.
 }
 
+JsonnetJsonValue *jsonnet_evaluate_snippet_json(JsonnetVm *vm, const char *filename,
+                                                const char *snippet, int *error)
+{
+    TRY
+        std::unique_ptr<JsonnetJsonValue> json;
+        char *msg = jsonnet_evaluate_snippet_aux(vm, filename, snippet, error, JSON, &json);
+        return json_result(vm, msg, json, *error);
+    CATCH("jsonnet_evaluate_snippet_json")
+    return nullptr;  // Never happens.
+}
+
 char *jsonnet_realloc(JsonnetVm *vm, char *str, size_t sz)
 {
     (void)vm;
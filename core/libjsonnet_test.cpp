@@ -18,6 +18,8 @@ extern "C" {
 #include "libjsonnet.h"
 }
 
+#include <cstring>
+
 #include "gtest/gtest.h"
 
 TEST(JsonnetTest, TestEvaluateSnippet)
@@ -31,3 +33,140 @@ TEST(JsonnetTest, TestEvaluateSnippet)
     jsonnet_realloc(vm, output, 0);
     jsonnet_destroy(vm);
 }
+
+TEST(JsonnetTest, TestEvaluateSnippetJson)
+{
+    const char* snippet = "{ b: [1, 'x', null], a: true, h:: 'hidden' }";
+    struct JsonnetVm* vm = jsonnet_make();
+    int error = 0;
+    struct JsonnetJsonValue* v = jsonnet_evaluate_snippet_json(vm, "snippet", snippet, &error);
+    ASSERT_EQ(0, error);
+    size_t num = 0;
+    ASSERT_EQ(1, jsonnet_json_extract_object(vm, v, &num));
+    ASSERT_EQ(2u, num);
+    const struct JsonnetJsonValue* a;
+    const struct JsonnetJsonValue* b;
+    EXPECT_STREQ("a", jsonnet_json_object_field(vm, v, 0, &a));
+    EXPECT_STREQ("b", jsonnet_json_object_field(vm, v, 1, &b));
+    EXPECT_EQ(nullptr, jsonnet_json_object_field(vm, v, 2, &a));
+    EXPECT_EQ(1, jsonnet_json_extract_bool(vm, a));
+    ASSERT_EQ(1, jsonnet_json_extract_array(vm, b, &num));
+    ASSERT_EQ(3u, num);
+    double d = 0;
+    EXPECT_EQ(1, jsonnet_json_extract_number(vm, jsonnet_json_array_element(vm, b, 0), &d));
+    EXPECT_EQ(1.0, d);
+    EXPECT_STREQ("x", jsonnet_json_extract_string(vm, jsonnet_json_array_element(vm, b, 1)));
+    EXPECT_EQ(1, jsonnet_json_extract_null(vm, jsonnet_json_array_element(vm, b, 2)));
+    EXPECT_EQ(nullptr, jsonnet_json_array_element(vm, b, 3));
+    jsonnet_json_destroy(vm, v);
+
+    v = jsonnet_evaluate_snippet_json(vm, "snippet", "error 'foo'", &error);
+    EXPECT_EQ(1, error);
+    EXPECT_NE(nullptr, jsonnet_json_extract_string(vm, v));
+    jsonnet_json_destroy(vm, v);
+    jsonnet_destroy(vm);
+}
+
+static struct JsonnetJsonValue* native_length(void* ctx, const struct JsonnetJsonValue* const* argv,
+                                              int* success)
+{
+    struct JsonnetVm* vm = static_cast<struct JsonnetVm*>(ctx);
+    size_t num = 0;
+    if (jsonnet_json_extract_array(vm, argv[0], &num) ||
+        jsonnet_json_extract_object(vm, argv[0], &num)) {
+        *success = 1;
+        return jsonnet_json_make_number(vm, num);
+    }
+    *success = 0;
+    return jsonnet_json_make_string(vm, "expected an array or object");
+}
+
+TEST(JsonnetTest, TestNativeCallbackStructuredArgs)
+{
+    struct JsonnetVm* vm = jsonnet_make();
+    const char* params[] = {"x", nullptr};
+    jsonnet_native_callback(vm, "length", native_length, vm, params);
+    int error = 0;
+    char* output = jsonnet_evaluate_snippet(
+        vm, "snippet", "local f = std.native('length'); [f([1, [2]]), f({ a: 1, h:: 2 })]", &error);
+    EXPECT_EQ(0, error);
+    EXPECT_STREQ("[\n   2,\n   1\n]\n", output);
+    jsonnet_realloc(vm, output, 0);
+    jsonnet_destroy(vm);
+}
+
+struct ImportCacheCtx {
+    struct JsonnetVm* vm;
+    const char* content;
+};
+
+static char* import_cache_callback(void* ctx_, const char* base, const char* rel,
+                                   char** found_here, int* success)
+{
+    ImportCacheCtx* ctx = static_cast<ImportCacheCtx*>(ctx_);
+    (void)base;
+    *found_here = jsonnet_realloc(ctx->vm, nullptr, strlen(rel) + 1);
+    strcpy(*found_here, rel);
+    char* r = jsonnet_realloc(ctx->vm, nullptr, strlen(ctx->content) + 1);
+    strcpy(r, ctx->content);
+    *success = 1;
+    return r;
+}
+
+TEST(JsonnetTest, TestImportCache)
+{
+    struct JsonnetVm* vm = jsonnet_make();
+    ImportCacheCtx ctx = {vm, "{ n: std.length(x=[1, 2]), file: std.thisFile }"};
+    jsonnet_import_callback(vm, import_cache_callback, &ctx);
+    jsonnet_import_cache_size(vm, 1);
+    const char* snippet = "[import 'a.libsonnet', import 'a.libsonnet', (import 'b.libsonnet').n]";
+    const char* expected = "[\n   {\n      \"file\": \"a.libsonnet\",\n      \"n\": 2\n   },\n"
+                           "   {\n      \"file\": \"a.libsonnet\",\n      \"n\": 2\n   },\n"
+                           "   2\n]\n";
+    for (int i = 0; i < 3; ++i) {
+        int error = 0;
+        char* output = jsonnet_evaluate_snippet(vm, "snippet", snippet, &error);
+        EXPECT_EQ(0, error);
+        EXPECT_STREQ(expected, output);
+        jsonnet_realloc(vm, output, 0);
+    }
+
+    // A file whose content changed is parsed again.
+    ctx.content = "{ n: 3 }";
+    int error = 0;
+    char* output = jsonnet_evaluate_snippet(vm, "snippet", "(import 'a.libsonnet').n", &error);
+    EXPECT_EQ(0, error);
+    EXPECT_STREQ("3\n", output);
+    jsonnet_realloc(vm, output, 0);
+
+    jsonnet_import_cache_invalidate(vm, "a.libsonnet");
+    jsonnet_import_cache_invalidate(vm, nullptr);
+    output = jsonnet_evaluate_snippet(vm, "snippet", "(import 'a.libsonnet').n", &error);
+    EXPECT_EQ(0, error);
+    EXPECT_STREQ("3\n", output);
+    jsonnet_realloc(vm, output, 0);
+    jsonnet_destroy(vm);
+}
+
+TEST(JsonnetTest, TestImportCacheErrorLocation)
+{
+    // The error is in a.libsonnet, which has been evicted by b.libsonnet, so its file name is
+    // released along with its AST before the error is reported.
+    struct JsonnetVm* vm = jsonnet_make();
+    ImportCacheCtx ctx = {vm, "{ f: error 'boom' }"};
+    jsonnet_import_callback(vm, import_cache_callback, &ctx);
+    jsonnet_import_cache_size(vm, 1);
+    const char* snippet =
+        "local a = import 'a.libsonnet', b = import 'b.libsonnet';\n"
+        "std.length(a) + std.length(b) + a.f";
+    int error = 0;
+    char* output = jsonnet_evaluate_snippet(vm, "snippet", snippet, &error);
+    EXPECT_EQ(1, error);
+    EXPECT_STREQ(
+        "RUNTIME ERROR: boom\n"
+        "\ta.libsonnet:1:6-18\tobject <a>\n"
+        "\tsnippet:2:33-36\t\n",
+        output);
+    jsonnet_realloc(vm, output, 0);
+    jsonnet_destroy(vm);
+}
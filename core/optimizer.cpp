@@ -0,0 +1,453 @@
+/*
+Copyright 2015 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+*/
+
+#include <cassert>
+#include <cmath>
+#include <cstdint>
+#include <cstdio>
+
+#include <map>
+#include <vector>
+
+#include "desugarer.h"
+#include "optimizer.h"
+#include "pass.h"
+#include "static_analysis.h"
+
+/** String constants longer than this are not copied into every place they are used. */
+static const unsigned MAX_INLINE_STRING = 256;
+
+/** Whether the number survives a conversion to int64_t, as the bitwise operators do. */
+static bool in_int64_range(double v)
+{
+    return v >= -9223372036854775808.0 && v < 9223372036854775808.0;
+}
+
+/** The index of the builtin with the given name, or jsonnet_builtin_count() if there is none. */
+static unsigned long builtin_index(const UString &name)
+{
+    static const std::map<UString, unsigned long> indexes = [] {
+        std::map<UString, unsigned long> r;
+        for (unsigned long c = 0; c < jsonnet_builtin_count(); ++c)
+            r[jsonnet_builtin_decl(c).name] = c;
+        return r;
+    }();
+    auto it = indexes.find(name);
+    return it == indexes.end() ? jsonnet_builtin_count() : it->second;
+}
+
+/** Folds constant subexpressions, resolves std functions to builtins and removes unused local
+ * binds.
+ *
+ * Only expressions whose evaluation cannot fail are folded, so that any runtime error is still
+ * raised at run time, at the same location.
+ */
+class Optimizer : public CompilerPass {
+    /** A variable in scope, and its value if that is known to be a literal. */
+    struct Binding {
+        const Identifier *id;
+        AST *constant;
+        // Whether this is the std variable that the desugarer binds at the top of each file.
+        bool isStd;
+        unsigned uses;
+        Binding(const Identifier *id, bool is_std)
+            : id(id), constant(nullptr), isStd(is_std), uses(0)
+        {
+        }
+    };
+
+    std::vector<Binding> scope;
+
+    Binding *lookup(const Identifier *id)
+    {
+        for (auto it = scope.rbegin(); it != scope.rend(); ++it) {
+            if (it->id == id)
+                return &*it;
+        }
+        return nullptr;
+    }
+
+    static bool isConstant(const AST *ast)
+    {
+        switch (ast->type) {
+            case AST_LITERAL_BOOLEAN:
+            case AST_LITERAL_NULL: return true;
+            case AST_LITERAL_NUMBER:
+                return std::isfinite(static_cast<const LiteralNumber *>(ast)->value);
+            case AST_LITERAL_STRING: return true;
+            default: return false;
+        }
+    }
+
+    /** Recognise the binds of std made by the desugarer.
+     *
+     * These are local std = $std + { thisFile:: ... } at the top of each file, and the std object
+     * bound within the standard library itself, which has builtin fields that cannot be written
+     * in Jsonnet.
+     */
+    static bool isStdBind(const Local::Bind &bind)
+    {
+        if (bind.var->name != U"std")
+            return false;
+        if (bind.body->type == AST_DESUGARED_OBJECT) {
+            for (const auto &field : static_cast<const DesugaredObject *>(bind.body)->fields) {
+                if (field.body->type == AST_BUILTIN_FUNCTION)
+                    return true;
+            }
+            return false;
+        }
+        if (bind.body->type != AST_BINARY)
+            return false;
+        auto *body = static_cast<const Binary *>(bind.body);
+        return body->op == BOP_PLUS && body->left->type == AST_VAR &&
+               static_cast<const Var *>(body->left)->id->name == U"$std" &&
+               body->right->type == AST_DESUGARED_OBJECT;
+    }
+
+    /** If the AST is std.f for a std bound by the desugarer, returns the name f. */
+    const UString *stdField(const AST *ast)
+    {
+        if (ast->type != AST_INDEX)
+            return nullptr;
+        auto *index = static_cast<const Index *>(ast);
+        if (index->isSlice || index->target->type != AST_VAR || index->index == nullptr ||
+            index->index->type != AST_LITERAL_STRING)
+            return nullptr;
+        Binding *std_binding = lookup(static_cast<const Var *>(index->target)->id);
+        if (std_binding == nullptr || !std_binding->isStd)
+            return nullptr;
+        return &static_cast<const LiteralString *>(index->index)->value;
+    }
+
+    AST *boolean(const AST &ast, bool v)
+    {
+        return alloc.make<LiteralBoolean>(ast.location, ast.openFodder, v);
+    }
+
+    /** Returns nullptr if v is not a finite number, which is an error at run time. */
+    AST *number(const AST &ast, double v)
+    {
+        if (!std::isfinite(v))
+            return nullptr;
+        char buf[32];
+        std::snprintf(buf, sizeof buf, "%.17g", v);
+        return alloc.make<LiteralNumber>(ast.location, ast.openFodder, buf);
+    }
+
+    AST *string(const AST &ast, const UString &v)
+    {
+        return alloc.make<LiteralString>(
+            ast.location, ast.openFodder, v, LiteralString::DOUBLE, "", "");
+    }
+
+    AST *foldBinary(const Binary &ast)
+    {
+        if (ast.left->type != ast.right->type)
+            return nullptr;
+        switch (ast.left->type) {
+            case AST_LITERAL_BOOLEAN: {
+                bool a = static_cast<const LiteralBoolean *>(ast.left)->value;
+                bool b = static_cast<const LiteralBoolean *>(ast.right)->value;
+                switch (ast.op) {
+                    case BOP_AND: return boolean(ast, a && b);
+                    case BOP_OR: return boolean(ast, a || b);
+                    default: return nullptr;
+                }
+            }
+
+            case AST_LITERAL_NUMBER: {
+                double a = static_cast<const LiteralNumber *>(ast.left)->value;
+                double b = static_cast<const LiteralNumber *>(ast.right)->value;
+                if (!std::isfinite(a) || !std::isfinite(b))
+                    return nullptr;
+                switch (ast.op) {
+                    case BOP_PLUS: return number(ast, a + b);
+                    case BOP_MINUS: return number(ast, a - b);
+                    case BOP_MULT: return number(ast, a * b);
+                    case BOP_DIV: return b == 0 ? nullptr : number(ast, a / b);
+                    case BOP_LESS_EQ: return boolean(ast, a <= b);
+                    case BOP_GREATER_EQ: return boolean(ast, a >= b);
+                    case BOP_LESS: return boolean(ast, a < b);
+                    case BOP_GREATER: return boolean(ast, a > b);
+                    default:;
+                }
+                if (!in_int64_range(a) || !in_int64_range(b))
+                    return nullptr;
+                // The evaluator raises an error for any negative shift, e.g. by -0.5, which would
+                // be truncated to 0.
+                bool negative_shift = b < 0;
+                int64_t long_l = a;
+                int64_t long_r = b;
+                switch (ast.op) {
+                    case BOP_SHIFT_L:
+                        if (negative_shift)
+                            return nullptr;
+                        return number(ast, int64_t(uint64_t(long_l) << (long_r % 64)));
+                    case BOP_SHIFT_R:
+                        if (negative_shift)
+                            return nullptr;
+                        return number(ast, long_l >> (long_r % 64));
+                    case BOP_BITWISE_AND: return number(ast, long_l & long_r);
+                    case BOP_BITWISE_XOR: return number(ast, long_l ^ long_r);
+                    case BOP_BITWISE_OR: return number(ast, long_l | long_r);
+                    default: return nullptr;
+                }
+            }
+
+            case AST_LITERAL_STRING: {
+                const UString &a = static_cast<const LiteralString *>(ast.left)->value;
+                const UString &b = static_cast<const LiteralString *>(ast.right)->value;
+                switch (ast.op) {
+                    case BOP_PLUS: return string(ast, a + b);
+                    case BOP_LESS_EQ: return boolean(ast, a <= b);
+                    case BOP_GREATER_EQ: return boolean(ast, a >= b);
+                    case BOP_LESS: return boolean(ast, a < b);
+                    case BOP_GREATER: return boolean(ast, a > b);
+                    default: return nullptr;
+                }
+            }
+
+            default: return nullptr;
+        }
+    }
+
+    /** Resolve std.f to the builtin f, so calling it needs no lookups. */
+    AST *stdBuiltin(const Index &ast)
+    {
+        const UString *field = stdField(&ast);
+        if (field == nullptr)
+            return nullptr;
+        unsigned long builtin = builtin_index(*field);
+        if (builtin == jsonnet_builtin_count())
+            return nullptr;
+        Identifiers params;
+        for (const auto &p : jsonnet_builtin_decl(builtin).params)
+            params.push_back(alloc.makeIdentifier(p));
+        return alloc.make<BuiltinFunction>(ast.location, encode_utf8(*field), params, builtin);
+    }
+
+    AST *foldUnary(const Unary &ast)
+    {
+        switch (ast.expr->type) {
+            case AST_LITERAL_BOOLEAN: {
+                bool v = static_cast<const LiteralBoolean *>(ast.expr)->value;
+                return ast.op == UOP_NOT ? boolean(ast, !v) : nullptr;
+            }
+
+            case AST_LITERAL_NUMBER: {
+                double v = static_cast<const LiteralNumber *>(ast.expr)->value;
+                switch (ast.op) {
+                    case UOP_PLUS: return number(ast, v);
+                    case UOP_MINUS: return number(ast, -v);
+                    case UOP_BITWISE_NOT:
+                        if (!in_int64_range(v))
+                            return nullptr;
+                        return number(ast, ~int64_t(v));
+                    default: return nullptr;
+                }
+            }
+
+            default: return nullptr;
+        }
+    }
+
+    /** Fold calls of std functions on literals, if std has not been shadowed. */
+    AST *foldStdCall(const Apply &ast)
+    {
+        const UString *field = stdField(ast.target);
+        if (field == nullptr)
+            return nullptr;
+        for (const auto &arg : ast.args) {
+            if (arg.id != nullptr)
+                return nullptr;
+        }
+        const UString &name = *field;
+
+        if (name == U"length" && ast.args.size() == 1) {
+            const AST *v = ast.args[0].expr;
+            if (v->type == AST_ARRAY)
+                return number(ast, static_cast<const Array *>(v)->elements.size());
+            if (v->type == AST_LITERAL_STRING)
+                return number(ast, static_cast<const LiteralString *>(v)->value.size());
+
+        } else if (name == U"equals" && ast.args.size() == 2) {
+            const AST *a = ast.args[0].expr;
+            const AST *b = ast.args[1].expr;
+            if (!isConstant(a) || !isConstant(b))
+                return nullptr;
+            if (a->type != b->type)
+                return boolean(ast, false);
+            switch (a->type) {
+                case AST_LITERAL_BOOLEAN:
+                    return boolean(ast,
+                                   static_cast<const LiteralBoolean *>(a)->value ==
+                                       static_cast<const LiteralBoolean *>(b)->value);
+                case AST_LITERAL_NULL: return boolean(ast, true);
+                case AST_LITERAL_NUMBER:
+                    return boolean(ast,
+                                   static_cast<const LiteralNumber *>(a)->value ==
+                                       static_cast<const LiteralNumber *>(b)->value);
+                case AST_LITERAL_STRING:
+                    return boolean(ast,
+                                   static_cast<const LiteralString *>(a)->value ==
+                                       static_cast<const LiteralString *>(b)->value);
+                default: return nullptr;
+            }
+        }
+        return nullptr;
+    }
+
+   public:
+    Optimizer(Allocator &alloc) : CompilerPass(alloc) {}
+
+    void visitExpr(AST *&ast_)
+    {
+        switch (ast_->type) {
+            case AST_APPLY: {
+                auto *ast = static_cast<Apply *>(ast_);
+                for (auto &arg : ast->args)
+                    expr(arg.expr);
+                if (AST *folded = foldStdCall(*ast)) {
+                    ast_ = folded;
+                    return;
+                }
+                expr(ast->target);
+            } break;
+
+            case AST_BINARY: {
+                auto *ast = static_cast<Binary *>(ast_);
+                expr(ast->left);
+                if (ast->left->type == AST_LITERAL_BOOLEAN) {
+                    bool v = static_cast<LiteralBoolean *>(ast->left)->value;
+                    if ((ast->op == BOP_AND && !v) || (ast->op == BOP_OR && v)) {
+                        ast_ = ast->left;
+                        return;
+                    }
+                }
+                expr(ast->right);
+                if (AST *folded = foldBinary(*ast))
+                    ast_ = folded;
+            } break;
+
+            case AST_CONDITIONAL: {
+                auto *ast = static_cast<Conditional *>(ast_);
+                expr(ast->cond);
+                if (ast->cond->type == AST_LITERAL_BOOLEAN) {
+                    bool v = static_cast<LiteralBoolean *>(ast->cond)->value;
+                    ast_ = v ? ast->branchTrue : ast->branchFalse;
+                    expr(ast_);
+                    return;
+                }
+                expr(ast->branchTrue);
+                expr(ast->branchFalse);
+            } break;
+
+            case AST_FUNCTION: {
+                auto *ast = static_cast<Function *>(ast_);
+                size_t base = scope.size();
+                for (const auto &param : ast->params)
+                    scope.emplace_back(param.id, false);
+                for (auto &param : ast->params) {
+                    if (param.expr != nullptr)
+                        expr(param.expr);
+                }
+                expr(ast->body);
+                scope.resize(base, Binding(nullptr, false));
+            } break;
+
+            case AST_INDEX: {
+                if (AST *builtin = stdBuiltin(*static_cast<Index *>(ast_))) {
+                    ast_ = builtin;
+                    return;
+                }
+                CompilerPass::visitExpr(ast_);
+            } break;
+
+            case AST_LOCAL: {
+                auto *ast = static_cast<Local *>(ast_);
+                assert(ast->binds.size() > 0);
+                size_t base = scope.size();
+                bool is_std = ast->binds.size() == 1 && isStdBind(ast->binds[0]);
+                for (const auto &bind : ast->binds)
+                    scope.emplace_back(bind.var, is_std);
+                for (size_t i = 0; i < ast->binds.size(); ++i) {
+                    AST *&body = ast->binds[i].body;
+                    expr(body);
+                    if (isConstant(body)) {
+                        bool small =
+                            body->type != AST_LITERAL_STRING ||
+                            static_cast<LiteralString *>(body)->value.size() <= MAX_INLINE_STRING;
+                        if (small)
+                            scope[base + i].constant = body;
+                    }
+                }
+                expr(ast->body);
+                Local::Binds binds;
+                for (size_t i = 0; i < ast->binds.size(); ++i) {
+                    if (scope[base + i].uses > 0)
+                        binds.push_back(ast->binds[i]);
+                }
+                scope.resize(base, Binding(nullptr, false));
+                if (binds.empty()) {
+                    ast_ = ast->body;
+                } else {
+                    ast->binds = binds;
+                }
+            } break;
+
+            case AST_OBJECT_COMPREHENSION_SIMPLE: {
+                auto *ast = static_cast<ObjectComprehensionSimple *>(ast_);
+                expr(ast->array);
+                scope.emplace_back(ast->id, false);
+                expr(ast->field);
+                expr(ast->value);
+                scope.pop_back();
+            } break;
+
+            case AST_UNARY: {
+                auto *ast = static_cast<Unary *>(ast_);
+                expr(ast->expr);
+                if (AST *folded = foldUnary(*ast))
+                    ast_ = folded;
+            } break;
+
+            case AST_VAR: {
+                auto *ast = static_cast<Var *>(ast_);
+                Binding *binding = lookup(ast->id);
+                // Variables bound by the interpreter, e.g. $std, are not in scope.
+                if (binding == nullptr)
+                    return;
+                if (binding->constant != nullptr) {
+                    AST *r = clone_ast(alloc, binding->constant);
+                    r->location = ast->location;
+                    r->openFodder = ast->openFodder;
+                    ast_ = r;
+                } else {
+                    binding->uses++;
+                }
+            } break;
+
+            default: CompilerPass::visitExpr(ast_);
+        }
+    }
+};
+
+void jsonnet_optimize(Allocator *alloc, AST *&ast)
+{
+    Optimizer(*alloc).expr(ast);
+    // Folding removes references to variables, so the free variables need to be recomputed.
+    jsonnet_static_analysis(ast);
+}
@@ -0,0 +1,33 @@
+/*
+Copyright 2015 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+*/
+
+#ifndef JSONNET_OPTIMIZER_H
+#define JSONNET_OPTIMIZER_H
+
+#include "ast.h"
+
+/** Fold the constant subexpressions of a desugared AST, resolve the functions of std to
+ * builtins, and remove unused local binds.
+ *
+ * The AST must have been statically analysed already, so that errors in code that is removed
+ * are still reported.  The freeVariables members are updated afterwards.
+ *
+ * \param alloc Allocator for making new ASTs.
+ * \param ast The AST to change.
+ */
+void jsonnet_optimize(Allocator *alloc, AST *&ast);
+
+#endif
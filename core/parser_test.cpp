@@ -28,8 +28,8 @@ namespace {
 void testParse(const char* snippet)
 {
     try {
-        std::list<Token> tokens = jsonnet_lex("test", snippet);
         Allocator allocator;
+        std::list<Token> tokens = jsonnet_lex(&allocator, "test", snippet);
         AST* ast = jsonnet_parse(&allocator, tokens);
         (void)ast;
     } catch (StaticError& e) {
@@ -126,8 +126,8 @@ TEST(Parser, TestTuple)
 void testParseError(const char* snippet, const std::string& expectedError)
 {
     try {
-        std::list<Token> tokens = jsonnet_lex("test", snippet);
         Allocator allocator;
+        std::list<Token> tokens = jsonnet_lex(&allocator, "test", snippet);
         AST* ast = jsonnet_parse(&allocator, tokens);
         (void)ast;
     } catch (StaticError& e) {
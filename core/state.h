@@ -93,16 +93,151 @@ std::string type_str(const Value &v)
 }
 
 struct HeapThunk;
+struct HeapLeafObject;
 
 /** Stores the values bound to variables.
  *
  * Each nested local statement, function call, and field access has its own binding frame to
  * give the values for the local variable, function parameters, or upValues.
+ *
+ * Binding frames only hold the variables that are actually used (see capture) and are copied
+ * into every closure, thunk and object, so they are stored as a flat vector of slots rather
+ * than as a tree.  Small frames are searched linearly.  Large ones, e.g. a local with many
+ * binds, keep all but the last few slots sorted by identifier and binary search them.
  */
-typedef std::map<const Identifier *, HeapThunk *> BindingFrame;
+class BindingFrame {
+   public:
+    typedef std::pair<const Identifier *, HeapThunk *> Binding;
+    typedef std::vector<Binding>::iterator iterator;
+    typedef std::vector<Binding>::const_iterator const_iterator;
+
+   private:
+    /** How many slots can be searched linearly after the sorted ones. */
+    static const size_t MAX_UNSORTED = 8;
+
+    std::vector<Binding> slots;
+
+    /** The number of slots at the beginning that are sorted by identifier. */
+    size_t sorted = 0;
+
+    static bool lessId(const Binding &a, const Identifier *id)
+    {
+        return std::less<const Identifier *>()(a.first, id);
+    }
+
+    static bool lessBinding(const Binding &a, const Binding &b)
+    {
+        return lessId(a, b.first);
+    }
+
+    template <class It>
+    static It findIn(It begin, It sorted_end, It end, const Identifier *id)
+    {
+        It it = std::lower_bound(begin, sorted_end, id, lessId);
+        if (it != sorted_end && it->first == id)
+            return it;
+        for (it = sorted_end; it != end; ++it) {
+            if (it->first == id)
+                return it;
+        }
+        return end;
+    }
+
+   public:
+    iterator begin(void)
+    {
+        return slots.begin();
+    }
+    iterator end(void)
+    {
+        return slots.end();
+    }
+    const_iterator begin(void) const
+    {
+        return slots.begin();
+    }
+    const_iterator end(void) const
+    {
+        return slots.end();
+    }
+
+    size_t size(void) const
+    {
+        return slots.size();
+    }
+
+    void reserve(size_t n)
+    {
+        slots.reserve(n);
+    }
+
+    /** Remove all bindings and release their storage. */
+    void clear(void)
+    {
+        std::vector<Binding>().swap(slots);
+        sorted = 0;
+    }
+
+    iterator find(const Identifier *id)
+    {
+        return findIn(slots.begin(), slots.begin() + sorted, slots.end(), id);
+    }
+
+    const_iterator find(const Identifier *id) const
+    {
+        return findIn(slots.cbegin(), slots.cbegin() + sorted, slots.cend(), id);
+    }
+
+    /** Add a binding for a variable that is known not to be bound in this frame yet.
+     *
+     * This can reorder the slots, so iterators are not valid afterwards.
+     */
+    void bind(const Identifier *id, HeapThunk *thunk)
+    {
+        slots.emplace_back(id, thunk);
+        if (slots.size() - sorted > MAX_UNSORTED) {
+            auto middle = slots.begin() + sorted;
+            std::sort(middle, slots.end(), lessBinding);
+            std::inplace_merge(slots.begin(), middle, slots.end(), lessBinding);
+            sorted = slots.size();
+        }
+    }
+
+    HeapThunk *&operator[](const Identifier *id)
+    {
+        auto it = find(id);
+        if (it != slots.end())
+            return it->second;
+        bind(id, nullptr);
+        return find(id)->second;
+    }
+};
 
 /** Supertype of all objects.  Types of Value::OBJECT will point at these.  */
 struct HeapObject : public HeapEntity {
+    /** The values of fields that have been evaluated with this object as self.
+     *
+     * Keyed by the field and the "super" level it was found at (see Frame::offset), which
+     * together determine the value.  The thunks are filled once the evaluation completes.
+     */
+    std::map<std::pair<const Identifier *, unsigned>, HeapThunk *> fieldCache;
+
+    /** The leaves of the inheritance tree in the order fields are looked up, i.e. indexed by
+     * "super" level.  Built lazily and only for extended objects.  The leaves are reachable
+     * from the tree, so this does not need to be traversed by the garbage collector.
+     */
+    std::vector<HeapLeafObject *> leaves;
+
+    /** For each field, the indexes in leaves of the leaves that define it, in increasing
+     * order.  Built along with leaves.
+     */
+    std::unordered_map<const Identifier *, std::vector<unsigned>> fieldLeaves;
+
+    /** The fields sorted by name, first only the visible ones and then all of them.  Built
+     * lazily, see Interpreter::sortedFields.
+     */
+    std::unique_ptr<std::vector<const Identifier *>> sortedFields[2];
+
     HeapObject(Type type) : HeapEntity(type) {}
 };
 
@@ -147,15 +282,90 @@ struct HeapThunk : public HeapEntity {
     }
 };
 
+/** Stores an array on the heap.
+ *
+ * The elements live in a buffer that can be shared between arrays.  A slice is a view of a
+ * range of the buffer, and concatenating onto an array that ends where its buffer ends appends
+ * to the buffer in place.  Other arrays sharing the buffer keep their own offset and length,
+ * so they do not see the new elements.  Elements are never modified once they are in a buffer.
+ *
+ * Elements must be accessed by index, as the buffer may be reallocated whenever another array
+ * extends it.
+ */
 struct HeapArray : public HeapEntity {
-    // It is convenient for this to not be const, so that we can add elements to it one at a
-    // time after creation.  Thus, elements are not GCed as the array is being
-    // created.
-    std::vector<HeapThunk *> elements;
+   private:
+    std::shared_ptr<std::vector<HeapThunk *>> buffer;
+    size_t offset;
+    size_t length;
+
+    /** Make room for n more elements at the end of this array's own range of a buffer. */
+    void prepareAppend(size_t n)
+    {
+        size_t needed = length + n;
+        if (offset + length != buffer->size()) {
+            // Someone else has extended the buffer, so take a copy of our range.
+            auto *copy = new std::vector<HeapThunk *>();
+            copy->reserve(needed);
+            copy->insert(copy->end(),
+                         buffer->begin() + offset,
+                         buffer->begin() + offset + length);
+            buffer.reset(copy);
+            offset = 0;
+        } else if (buffer->capacity() < offset + needed) {
+            buffer->reserve(std::max(offset + needed, 2 * buffer->capacity()));
+        }
+    }
+
+   public:
     HeapArray(const std::vector<HeapThunk *> &elements)
-        : HeapEntity(ARRAY), elements(elements)
+        : HeapEntity(ARRAY),
+          buffer(std::make_shared<std::vector<HeapThunk *>>(elements)),
+          offset(0),
+          length(elements.size())
     {
     }
+
+    /** A view of the elements [from, from + len) of another array. */
+    HeapArray(const HeapArray *arr, size_t from, size_t len)
+        : HeapEntity(ARRAY), buffer(arr->buffer), offset(arr->offset + from), length(len)
+    {
+    }
+
+    /** The concatenation of two arrays, reusing the buffer of lhs if possible. */
+    HeapArray(const HeapArray *lhs, const HeapArray *rhs)
+        : HeapEntity(ARRAY), buffer(lhs->buffer), offset(lhs->offset), length(lhs->length)
+    {
+        append(rhs);
+    }
+
+    size_t size(void) const
+    {
+        return length;
+    }
+
+    HeapThunk *at(size_t i) const
+    {
+        return (*buffer)[offset + i];
+    }
+
+    /** Add an element to the end, e.g. while the array is being built. */
+    void push_back(HeapThunk *th)
+    {
+        prepareAppend(1);
+        buffer->push_back(th);
+        length++;
+    }
+
+    /** Add the elements of another array (possibly this one) to the end. */
+    void append(const HeapArray *arr)
+    {
+        size_t n = arr->length;
+        prepareAppend(n);
+        // Capacity is reserved, so this does not reallocate even if arr shares the buffer.
+        for (size_t i = 0; i < n; ++i)
+            buffer->push_back((*arr->buffer)[arr->offset + i]);
+        length += n;
+    }
 };
 
 /** Supertype of all objects that are not super objects or extended objects.  */
@@ -242,8 +452,8 @@ struct HeapComprehensionObject : public HeapLeafObject {
  *
  * Either body is non-null and builtinName is "", or body is null and builtin refers to a built-in
  * function.  In the former case, the closure represents a user function, otherwise calling it
- * will trigger the builtin function to execute.  Params is empty when the function is a
- * builtin.
+ * will trigger the builtin function to execute.  Builtins are numbered as in
+ * jsonnet_builtin_decl, followed by the native callbacks of the interpreter.
  */
 struct HeapClosure : public HeapEntity {
     /** The captured environment. */
@@ -261,23 +471,90 @@ struct HeapClosure : public HeapEntity {
     const Params params;
     const AST *body;
     std::string builtinName;
+    unsigned long builtin;
     HeapClosure(const BindingFrame &up_values, HeapObject *self, unsigned offset,
-                const Params &params, const AST *body, const std::string &builtin_name)
+                const Params &params, const AST *body, const std::string &builtin_name,
+                unsigned long builtin)
         : HeapEntity(CLOSURE),
           upValues(up_values),
           self(self),
           offset(offset),
           params(params),
           body(body),
-          builtinName(builtin_name)
+          builtinName(builtin_name),
+          builtin(builtin)
     {
     }
 };
 
-/** Stores a simple string on the heap. */
+/** Stores a string on the heap.
+ *
+ * A string can also be the concatenation of two other strings (a rope), in which case the
+ * characters are only copied into place when they are first needed.  This makes building a
+ * long string with repeated + linear rather than quadratic.
+ */
 struct HeapString : public HeapEntity {
-    const UString value;
-    HeapString(const UString &value) : HeapEntity(STRING), value(value) {}
+   private:
+    mutable UString str;
+
+    /** The operands of the concatenation, or nullptr once the characters are in str. */
+    mutable const HeapString *left, *right;
+
+    size_t length;
+
+    void flatten(void) const
+    {
+        str.reserve(length);
+        // Iterate rather than recurse, since ropes built in a loop are very deep.
+        std::vector<const HeapString *> todo{right, left};
+        while (!todo.empty()) {
+            const HeapString *curr = todo.back();
+            todo.pop_back();
+            if (curr->left != nullptr) {
+                todo.push_back(curr->right);
+                todo.push_back(curr->left);
+            } else {
+                str.append(curr->str);
+            }
+        }
+        left = nullptr;
+        right = nullptr;
+    }
+
+   public:
+    HeapString(const UString &value)
+        : HeapEntity(STRING), str(value), left(nullptr), right(nullptr), length(value.length())
+    {
+    }
+
+    HeapString(const HeapString *left, const HeapString *right)
+        : HeapEntity(STRING), left(left), right(right), length(left->size() + right->size())
+    {
+    }
+
+    /** The characters of the string. */
+    const UString &value(void) const
+    {
+        if (left != nullptr)
+            flatten();
+        return str;
+    }
+
+    /** The number of characters, without flattening the string. */
+    size_t size(void) const
+    {
+        return length;
+    }
+
+    /** The operands of the concatenation if the string has not been flattened yet. */
+    const HeapString *getLeft(void) const
+    {
+        return left;
+    }
+    const HeapString *getRight(void) const
+    {
+        return right;
+    }
 };
 
 /** The heap does memory management, i.e. garbage collection. */
@@ -372,6 +649,8 @@ class Heap {
                         auto *obj = static_cast<HeapSimpleObject *>(curr);
                         for (auto upv : obj->upValues)
                             addIfHeapEntity(upv.second, s.children);
+                        for (auto field : obj->fieldCache)
+                            addIfHeapEntity(field.second, s.children);
                         break;
                     }
                     case HeapEntity::EXTENDED_OBJECT: {
@@ -379,6 +658,8 @@ class Heap {
                         auto *obj = static_cast<HeapExtendedObject *>(curr);
                         addIfHeapEntity(obj->left, s.children);
                         addIfHeapEntity(obj->right, s.children);
+                        for (auto field : obj->fieldCache)
+                            addIfHeapEntity(field.second, s.children);
                         break;
                     }
                     case HeapEntity::COMPREHENSION_OBJECT: {
@@ -388,13 +669,15 @@ class Heap {
                             addIfHeapEntity(upv.second, s.children);
                         for (auto upv : obj->compValues)
                             addIfHeapEntity(upv.second, s.children);
+                        for (auto field : obj->fieldCache)
+                            addIfHeapEntity(field.second, s.children);
                         break;
                     }
                     case HeapEntity::ARRAY: {
                         assert(dynamic_cast<HeapArray *>(curr));
                         auto *arr = static_cast<HeapArray *>(curr);
-                        for (auto el : arr->elements)
-                            addIfHeapEntity(el, s.children);
+                        for (size_t i = 0; i < arr->size(); ++i)
+                            addIfHeapEntity(arr->at(i), s.children);
                         break;
                     }
                     case HeapEntity::CLOSURE: {
@@ -420,9 +703,15 @@ class Heap {
                         }
                         break;
                     }
-                    case HeapEntity::STRING:
+                    case HeapEntity::STRING: {
                         assert(dynamic_cast<HeapString *>(curr));
+                        auto *str = static_cast<HeapString *>(curr);
+                        if (str->getLeft() != nullptr) {
+                            addIfHeapEntity(const_cast<HeapString *>(str->getLeft()), s.children);
+                            addIfHeapEntity(const_cast<HeapString *>(str->getRight()), s.children);
+                        }
                         break;
+                    }
                     default:
                         assert(false);
                         break;
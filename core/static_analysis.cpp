@@ -201,7 +201,8 @@ static IdSet static_analysis(AST *ast_, bool in_object, const IdSet &vars)
     case AST_VAR: {
         assert(dynamic_cast<const Var *>(ast_));
         auto* ast = static_cast<const Var *>(ast_);
-        if (vars.find(ast->id) == vars.end()) {
+        // $std is the shared standard library, which the interpreter binds (see desugarer.h).
+        if (vars.find(ast->id) == vars.end() && ast->id->name != U"$std") {
             throw StaticError(ast->location, "Unknown variable: " + encode_utf8(ast->id->name));
         }
         r.insert(ast->id);
@@ -212,8 +213,7 @@ static IdSet static_analysis(AST *ast_, bool in_object, const IdSet &vars)
         break;
     }
 
-    for (auto *id : r)
-        ast_->freeVariables.push_back(id);
+    ast_->freeVariables.assign(r.begin(), r.end());
 
     return r;
 }
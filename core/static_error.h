@@ -19,10 +19,11 @@ limitations under the License.
 
 #include <iostream>
 #include <sstream>
+#include <string>
 
 struct Location {
-    unsigned long line;
-    unsigned long column;
+    unsigned line;
+    unsigned column;
     Location(void) : line(0), column(0) {}
     Location(unsigned long line, unsigned long column) : line(line), column(column) {}
     bool isSet(void) const
@@ -42,13 +43,15 @@ static inline std::ostream &operator<<(std::ostream &o, const Location &loc)
 }
 
 struct LocationRange {
-    std::string file;
+    // Interned by the Allocator that owns the AST (see Allocator::makeFileName), or a string
+    // that outlives the evaluation.  nullptr if there is no file.
+    const std::string *file;
     // [begin, end)
     Location begin, end;
-    LocationRange(void) {}
+    LocationRange(void) : file(nullptr) {}
     /** This is useful for special locations, e.g. manifestation entry point. */
-    LocationRange(const std::string &msg) : file(msg) {}
-    LocationRange(const std::string &file, const Location &begin, const Location &end)
+    LocationRange(const std::string *msg) : file(msg) {}
+    LocationRange(const std::string *file, const Location &begin, const Location &end)
         : file(file), begin(begin), end(end)
     {
     }
@@ -56,30 +59,71 @@ struct LocationRange {
     {
         return begin.isSet();
     }
+    /** The name of the file, or "" if there is none. */
+    const std::string &fileName(void) const
+    {
+        static const std::string none;
+        return file == nullptr ? none : *file;
+    }
 };
 
-static inline std::ostream &operator<<(std::ostream &o, const LocationRange &loc)
+/** The location of an error.
+ *
+ * Errors are reported after the Allocator that interned the file names of the ASTs has gone, so
+ * unlike LocationRange this holds a copy of the file name.
+ */
+struct ErrorLocation {
+    // "" if there is no file.
+    std::string file;
+    // [begin, end)
+    Location begin, end;
+    ErrorLocation(void) {}
+    ErrorLocation(const std::string &file, const Location &begin, const Location &end)
+        : file(file), begin(begin), end(end)
+    {
+    }
+    ErrorLocation(const LocationRange &loc) : file(loc.fileName()), begin(loc.begin), end(loc.end)
+    {
+    }
+    bool isSet(void) const
+    {
+        return begin.isSet();
+    }
+};
+
+static inline std::ostream &print_location(std::ostream &o, const std::string &file,
+                                           const Location &begin, const Location &end)
 {
-    if (loc.file.length() > 0)
-        o << loc.file;
-    if (loc.isSet()) {
-        if (loc.file.length() > 0)
+    if (file.length() > 0)
+        o << file;
+    if (begin.isSet()) {
+        if (file.length() > 0)
             o << ":";
-        if (loc.begin.line == loc.end.line) {
-            if (loc.begin.column == loc.end.column - 1) {
-                o << loc.begin;
+        if (begin.line == end.line) {
+            if (begin.column == end.column - 1) {
+                o << begin;
             } else {
-                o << loc.begin << "-" << loc.end.column;
+                o << begin << "-" << end.column;
             }
         } else {
-            o << "(" << loc.begin << ")-(" << loc.end << ")";
+            o << "(" << begin << ")-(" << end << ")";
         }
     }
     return o;
 }
 
+static inline std::ostream &operator<<(std::ostream &o, const LocationRange &loc)
+{
+    return print_location(o, loc.fileName(), loc.begin, loc.end);
+}
+
+static inline std::ostream &operator<<(std::ostream &o, const ErrorLocation &loc)
+{
+    return print_location(o, loc.file, loc.begin, loc.end);
+}
+
 struct StaticError {
-    LocationRange location;
+    ErrorLocation location;
     std::string msg;
     StaticError(const std::string &msg) : msg(msg) {}
     StaticError(const std::string &filename, const Location &location, const std::string &msg)
@@ -14,17 +14,21 @@ See the License for the specific language governing permissions and
 limitations under the License.
 */
 
+#include <algorithm>
 #include <cassert>
 #include <cmath>
 
+#include <functional>
 #include <memory>
 #include <set>
 #include <string>
+#include <unordered_map>
 
 #include "desugarer.h"
 #include "json.h"
 #include "json.hpp"
 #include "md5.h"
+#include "optimizer.h"
 #include "parser.h"
 #include "state.h"
 #include "static_analysis.h"
@@ -46,6 +50,56 @@ std::string dir_name(const std::string &path)
     return "";
 }
 
+/** Concatenations of strings shorter than this are copied rather than building a rope.
+ */
+const size_t ropeMinLength = 256;
+
+/** A piece of a parsed std.format string: either literal text or a single % conversion.
+ */
+struct FormatCode {
+    /** The conversion, e.g. 'd' for both %d and %i, or 0 if this is literal text. */
+    char32_t ctype;
+
+    /** The literal text, if ctype is 0. */
+    UString literal;
+
+    /** The mapping key of %(key)s, if hasKey. */
+    bool hasKey;
+    UString key;
+
+    /** Conversion flags. */
+    bool alt, zero, left, blank, plus;
+
+    /** Whether the conversion was upper case, e.g. %X. */
+    bool caps;
+
+    /** The field width, taken from the values instead if fwStar. */
+    bool fwStar;
+    double fw;
+
+    /** The precision, if hasPrec, taken from the values instead if precStar. */
+    bool hasPrec;
+    bool precStar;
+    double prec;
+
+    FormatCode(void)
+        : ctype(0),
+          hasKey(false),
+          alt(false),
+          zero(false),
+          left(false),
+          blank(false),
+          plus(false),
+          caps(false),
+          fwStar(false),
+          fw(0),
+          hasPrec(false),
+          precStar(false),
+          prec(0)
+    {
+    }
+};
+
 /** Stack frames.
  *
  * Of these, FRAME_CALL is the most special, as it is the only frame the stack
@@ -74,6 +128,17 @@ enum FrameKind {
     FRAME_BUILTIN_JOIN_STRINGS, // When executing std.join over strings, used to hold intermediate state.
     FRAME_BUILTIN_JOIN_ARRAYS,  // When executing std.join over arrays, used to hold intermediate state.
     FRAME_BUILTIN_DECODE_UTF8,  // When executing std.decodeUTF8, used to hold intermediate state.
+    FRAME_BUILTIN_SORT,         // When executing std.sort, used to hold intermediate state.
+    FRAME_BUILTIN_UNIQ,         // When executing std.uniq, used to hold intermediate state.
+    FRAME_BUILTIN_SET,          // When executing std.set, used to hold intermediate state.
+    FRAME_BUILTIN_SET_MEMBER,   // When executing std.setMember, used to hold intermediate state.
+    FRAME_BUILTIN_SET_UNION,    // When executing std.setUnion, used to hold intermediate state.
+    FRAME_BUILTIN_SET_INTER,    // When executing std.setInter, used to hold intermediate state.
+    FRAME_BUILTIN_SET_DIFF,     // When executing std.setDiff, used to hold intermediate state.
+    FRAME_BUILTIN_FLAT_MAP,     // When executing std.flatMap, used to hold intermediate state.
+    FRAME_BUILTIN_FLATTEN_ARRAYS,  // When executing std.flattenArrays, holds intermediate state.
+    FRAME_BUILTIN_FOLDL,        // When executing std.foldl, used to hold intermediate state.
+    FRAME_BUILTIN_FOLDR,        // When executing std.foldr, used to hold intermediate state.
 };
 
 /** A frame on the stack.
@@ -126,12 +191,18 @@ struct Frame {
     /** Used for a variety of purposes. */
     unsigned elementId;
 
+    /** Used for a variety of purposes. */
+    unsigned elementEnd;
+
     /** Used for a variety of purposes. */
     std::map<const Identifier *, HeapThunk *> elements;
 
     /** Used for a variety of purposes. */
     std::vector<HeapThunk *> thunks;
 
+    /** Used for a variety of purposes. */
+    std::vector<Value> values;
+
     /** Used for accumulating a joined string. */
     UString str;
     bool first;
@@ -162,6 +233,11 @@ struct Frame {
      */
     unsigned offset;
 
+    /** When evaluating an object field, the thunk in self's field cache that is filled with
+     * the value when the frame terminates, or nullptr.
+     */
+    HeapThunk *fieldThunk;
+
     /** A set of variables introduced at this point. */
     BindingFrame bindings;
 
@@ -171,9 +247,11 @@ struct Frame {
           location(ast->location),
           tailCall(false),
           elementId(0),
+          elementEnd(0),
           context(NULL),
           self(NULL),
-          offset(0)
+          offset(0),
+          fieldThunk(nullptr)
     {
         val.t = Value::NULL_TYPE;
         val2.t = Value::NULL_TYPE;
@@ -185,9 +263,11 @@ struct Frame {
           location(location),
           tailCall(false),
           elementId(0),
+          elementEnd(0),
           context(NULL),
           self(NULL),
-          offset(0)
+          offset(0),
+          fieldThunk(nullptr)
     {
         val.t = Value::NULL_TYPE;
         val2.t = Value::NULL_TYPE;
@@ -202,12 +282,16 @@ struct Frame {
             heap.markFrom(context);
         if (self)
             heap.markFrom(self);
+        if (fieldThunk)
+            heap.markFrom(fieldThunk);
         for (const auto &bind : bindings)
             heap.markFrom(bind.second);
         for (const auto &el : elements)
             heap.markFrom(el.second);
         for (const auto &th : thunks)
             heap.markFrom(th);
+        for (const auto &v : values)
+            heap.markFrom(v);
     }
 
     bool isCall(void) const
@@ -348,7 +432,7 @@ class Stack {
                     // Give the last line a name.
                     stack_trace[stack_trace.size() - 1].name = getName(i, f.context);
                 }
-                if (f.location.isSet() || f.location.file.length() > 0)
+                if (f.location.isSet() || f.location.file != nullptr)
                     stack_trace.push_back(TraceFrame(f.location));
             }
         }
@@ -489,6 +573,27 @@ class Interpreter {
     /** Used to refer to idJsonObjVar. */
     const AST *jsonObjVar;
 
+    /** Used to bind the shared standard library in every file, see jsonnet_std_ast. */
+    const Identifier *idStd;
+
+    /** The value of the shared standard library. */
+    HeapThunk *stdThunk;
+
+    /** Used to bind the function called from native code, see callFunction. */
+    const Identifier *idNativeCallTarget;
+
+    /** Applications used to call functions from native code, by call site and arity. */
+    std::map<std::pair<const AST *, unsigned>, const Apply *> nativeCalls;
+
+    /** Used to bind the name of the field indexed from native code, see makeIndexThunk. */
+    const Identifier *idNativeIndexField;
+
+    /** Indexes used to get object fields from native code, by call site. */
+    std::map<const AST *, const Index *> nativeIndexes;
+
+    /** Format strings already parsed by std.format. */
+    std::map<UString, std::vector<FormatCode>> formatCodes;
+
     struct ImportCacheValue {
         std::string foundHere;
         std::string content;
@@ -514,9 +619,26 @@ class Interpreter {
     /** User context pointer for the import callback. */
     void *importCallbackContext;
 
+    /** Parsed imports kept between executions, or nullptr. */
+    VmAstCache *importCache;
+
+    /** The entries of importCache used by this execution, kept alive until it ends. */
+    std::vector<std::shared_ptr<const VmCachedAst>> cachedAsts;
+
+    /** Thunks of the external code used so far, so each is parsed and evaluated once. */
+    std::map<std::string, HeapThunk *> cachedExtCodes;
+
     /** Builtin functions by name. */
     typedef std::map<std::string, BuiltinFunc> BuiltinMap;
-    BuiltinMap builtins;
+
+    /** Builtin functions, indexed as in jsonnet_builtin_decl, or nullptr if not implemented. */
+    std::vector<BuiltinFunc> builtins;
+
+    /** The native callbacks, numbered after the builtins in HeapClosure::builtin. */
+    std::vector<const VmNativeCallback *> natives;
+
+    /** Closures of the builtins evaluated so far, see builtinClosure. */
+    std::vector<HeapClosure *> builtinClosures;
 
     RuntimeError makeError(const LocationRange &loc, const std::string &msg)
     {
@@ -541,6 +663,20 @@ class Interpreter {
             // Mark from the scratch register
             heap.markFrom(scratch);
 
+            // Mark from the standard library
+            if (stdThunk != nullptr)
+                heap.markFrom(stdThunk);
+
+            // Mark from cached external code
+            for (const auto &pair : cachedExtCodes)
+                heap.markFrom(pair.second);
+
+            // Mark from the closures of builtins
+            for (HeapClosure *closure : builtinClosures) {
+                if (closure != nullptr)
+                    heap.markFrom(closure);
+            }
+
             // Mark from cached imports
             for (const auto &pair : cachedImports) {
                 HeapThunk *thunk = pair.second->thunk;
@@ -601,28 +737,52 @@ class Interpreter {
     {
         Value r;
         r.t = Value::FUNCTION;
-        r.v.h = makeHeap<HeapClosure>(env, self, offset, params, body, "");
+        r.v.h = makeHeap<HeapClosure>(env, self, offset, params, body, "", 0);
         return r;
     }
 
-    Value makeNativeBuiltin(const std::string &name, const std::vector<std::string> &params)
+    Value makeNativeBuiltin(const std::string &name, unsigned long builtin,
+                            const std::vector<std::string> &params)
     {
         HeapClosure::Params hc_params;
         for (const auto &p : params) {
             hc_params.emplace_back(alloc->makeIdentifier(decode_utf8(p)), nullptr);
         }
-        return makeBuiltin(name, hc_params);
+        return makeBuiltin(name, builtin, hc_params);
     }
 
-    Value makeBuiltin(const std::string &name, const HeapClosure::Params &params)
+    Value makeBuiltin(const std::string &name, unsigned long builtin,
+                      const HeapClosure::Params &params)
     {
         AST *body = nullptr;
         Value r;
         r.t = Value::FUNCTION;
-        r.v.h = makeHeap<HeapClosure>(BindingFrame(), nullptr, 0, params, body, name);
+        r.v.h = makeHeap<HeapClosure>(BindingFrame(), nullptr, 0, params, body, name, builtin);
         return r;
     }
 
+    /** The closure of a builtin function.
+     *
+     * It is allocated the first time the builtin is evaluated and shared afterwards, as it
+     * captures nothing.
+     */
+    HeapClosure *builtinClosure(const BuiltinFunction *ast)
+    {
+        HeapClosure *closure = builtinClosures[ast->builtin];
+        if (closure != nullptr)
+            return closure;
+        HeapClosure::Params params;
+        params.reserve(ast->params.size());
+        for (const auto &p : ast->params) {
+            // None of the builtins have default args.
+            params.emplace_back(p, nullptr);
+        }
+        closure = makeHeap<HeapClosure>(
+            BindingFrame(), nullptr, 0, params, nullptr, ast->name, ast->builtin);
+        builtinClosures[ast->builtin] = closure;
+        return closure;
+    }
+
     template <class T, class... Args>
     Value makeObject(Args... args)
     {
@@ -640,10 +800,30 @@ class Interpreter {
         return r;
     }
 
+    /** Concatenate two strings, which must be reachable by the garbage collector.
+     *
+     * Short results are copied, long ones refer to the operands until they are flattened.
+     */
+    Value makeStringConcat(HeapString *lhs, HeapString *rhs)
+    {
+        Value r;
+        r.t = Value::STRING;
+        if (rhs->size() == 0) {
+            r.v.h = lhs;
+        } else if (lhs->size() == 0) {
+            r.v.h = rhs;
+        } else if (lhs->size() + rhs->size() < ropeMinLength) {
+            r.v.h = makeHeap<HeapString>(lhs->value() + rhs->value());
+        } else {
+            r.v.h = makeHeap<HeapString>(lhs, rhs);
+        }
+        return r;
+    }
+
     /** Auxiliary function of objectIndex.
      *
-     * Traverse the object's tree from right to left, looking for an object
-     * with the given field.  Call with offset initially set to 0.
+     * Find the first leaf of the object's tree, from right to left, with the given field.
+     * For extended objects this uses the index built by objectLeaves.
      *
      * \param f The field we're looking for.
      * \param start_from Step over this many leaves first.
@@ -653,30 +833,73 @@ class Interpreter {
     HeapLeafObject *findObject(const Identifier *f, HeapObject *curr, unsigned start_from,
                                unsigned &counter)
     {
-        if (auto *ext = dynamic_cast<HeapExtendedObject *>(curr)) {
-            auto *r = findObject(f, ext->right, start_from, counter);
-            if (r)
-                return r;
-            auto *l = findObject(f, ext->left, start_from, counter);
-            if (l)
-                return l;
+        if (curr->type != HeapEntity::EXTENDED_OBJECT) {
+            counter = 0;
+            return start_from == 0 && leafHasField(static_cast<HeapLeafObject *>(curr), f)
+                       ? static_cast<HeapLeafObject *>(curr)
+                       : nullptr;
+        }
+        const auto &leaves = objectLeaves(curr);
+        auto it = curr->fieldLeaves.find(f);
+        if (it == curr->fieldLeaves.end())
+            return nullptr;
+        const auto &indexes = it->second;
+        auto found = std::lower_bound(indexes.begin(), indexes.end(), start_from);
+        if (found == indexes.end())
+            return nullptr;
+        counter = *found;
+        return leaves[counter];
+    }
+
+    /** Whether the given leaf object defines the field. */
+    bool leafHasField(const HeapLeafObject *leaf, const Identifier *f)
+    {
+        if (leaf->type == HeapEntity::SIMPLE_OBJECT) {
+            auto *simp = static_cast<const HeapSimpleObject *>(leaf);
+            return simp->fields.find(f) != simp->fields.end();
         } else {
-            if (counter >= start_from) {
-                if (auto *simp = dynamic_cast<HeapSimpleObject *>(curr)) {
-                    auto it = simp->fields.find(f);
-                    if (it != simp->fields.end()) {
-                        return simp;
-                    }
-                } else if (auto *comp = dynamic_cast<HeapComprehensionObject *>(curr)) {
-                    auto it = comp->compValues.find(f);
-                    if (it != comp->compValues.end()) {
-                        return comp;
-                    }
-                }
+            auto *comp = static_cast<const HeapComprehensionObject *>(leaf);
+            return comp->compValues.find(f) != comp->compValues.end();
+        }
+    }
+
+    /** Flatten the inheritance tree of an extended object, and index its fields.
+     *
+     * The result is cached in the object (see HeapObject::leaves), since objects are
+     * immutable.
+     *
+     * \param obj An extended object.
+     * \returns The leaves of the tree, right-most first.
+     */
+    const std::vector<HeapLeafObject *> &objectLeaves(HeapObject *obj)
+    {
+        if (!obj->leaves.empty())
+            return obj->leaves;
+        std::vector<HeapObject *> todo{obj};
+        while (!todo.empty()) {
+            HeapObject *curr = todo.back();
+            todo.pop_back();
+            if (curr->type == HeapEntity::EXTENDED_OBJECT) {
+                auto *ext = static_cast<HeapExtendedObject *>(curr);
+                // Visit the right-hand side first.
+                todo.push_back(ext->left);
+                todo.push_back(ext->right);
+            } else {
+                obj->leaves.push_back(static_cast<HeapLeafObject *>(curr));
             }
-            counter++;
         }
-        return nullptr;
+        for (unsigned i = 0; i < obj->leaves.size(); ++i) {
+            if (obj->leaves[i]->type == HeapEntity::SIMPLE_OBJECT) {
+                auto *simp = static_cast<HeapSimpleObject *>(obj->leaves[i]);
+                for (const auto &field : simp->fields)
+                    obj->fieldLeaves[field.first].push_back(i);
+            } else {
+                auto *comp = static_cast<HeapComprehensionObject *>(obj->leaves[i]);
+                for (const auto &field : comp->compValues)
+                    obj->fieldLeaves[field.first].push_back(i);
+            }
+        }
+        return obj->leaves;
     }
 
     typedef std::map<const Identifier *, ObjectField::Hide> IdHideMap;
@@ -723,6 +946,30 @@ class Interpreter {
         return r;
     }
 
+    /** The fields of an object sorted by name, which is the order they are manifested in.
+     *
+     * The result is cached in the object (see HeapObject::sortedFields), since objects are
+     * immutable.
+     *
+     * \param include_hidden Whether to include hidden fields.
+     */
+    const std::vector<const Identifier *> &sortedFields(HeapObject *obj, bool include_hidden)
+    {
+        auto &cached = obj->sortedFields[include_hidden];
+        if (cached == nullptr) {
+            // Using std::map has the useful side-effect of ordering the fields
+            // alphabetically.
+            std::map<UString, const Identifier *> fields;
+            for (const auto &f : objectFields(obj, !include_hidden))
+                fields[f->name] = f;
+            cached.reset(new std::vector<const Identifier *>());
+            cached->reserve(fields.size());
+            for (const auto &pair : fields)
+                cached->push_back(pair.second);
+        }
+        return *cached;
+    }
+
     /** Import another Jsonnet file.
      *
      * If the file has already been imported, then use that version.  This maintains
@@ -736,15 +983,51 @@ class Interpreter {
     {
         ImportCacheValue *input = importString(loc, file);
         if (input->thunk == nullptr) {
-            Tokens tokens = jsonnet_lex(input->foundHere, input->content.c_str());
+            // If no errors then populate cache.
+            input->thunk = makeFileThunk(idImport, input->foundHere, input->content);
+        }
+        return input->thunk;
+    }
+
+    /** Lex, parse, desugar and analyse a file, or find it in importCache. */
+    const AST *parseFile(const std::string &filename, const std::string &content)
+    {
+        if (importCache == nullptr || importCache->getCapacity() == 0) {
+            Tokens tokens = jsonnet_lex(alloc, filename, content.c_str());
+            jsonnet_strip_fodder(tokens);
             AST *expr = jsonnet_parse(alloc, tokens);
             jsonnet_desugar(alloc, expr, nullptr);
             jsonnet_static_analysis(expr);
-            // If no errors then populate cache.
-            auto *thunk = makeHeap<HeapThunk>(idImport, nullptr, 0, expr);
-            input->thunk = thunk;
+            jsonnet_optimize(alloc, expr);
+            return expr;
         }
-        return input->thunk;
+        auto cached = importCache->get(filename, content);
+        if (cached == nullptr) {
+            std::shared_ptr<VmCachedAst> entry(new VmCachedAst());
+            Tokens tokens = jsonnet_lex(&entry->alloc, filename, content.c_str());
+            jsonnet_strip_fodder(tokens);
+            entry->ast = jsonnet_parse(&entry->alloc, tokens);
+            jsonnet_desugar(&entry->alloc, entry->ast, nullptr);
+            jsonnet_static_analysis(entry->ast);
+            jsonnet_optimize(&entry->alloc, entry->ast);
+            importCache->put(filename, content, entry);
+            cached = entry;
+        }
+        cachedAsts.push_back(cached);
+        return cached->ast;
+    }
+
+    /** Parse a file and make a thunk to evaluate it. */
+    HeapThunk *makeFileThunk(const Identifier *name, const std::string &filename,
+                             const std::string &content)
+    {
+        const AST *expr = parseFile(filename, content);
+        auto *thunk = makeHeap<HeapThunk>(name, nullptr, 0, expr);
+        // The only free variable of a file is $std, but a file from importCache has
+        // identifiers from another allocator.
+        for (const Identifier *fv : expr->freeVariables)
+            thunk->upValues[fv] = stdThunk;
+        return thunk;
     }
 
     /** Import a file as a string.
@@ -758,7 +1041,7 @@ class Interpreter {
      */
     ImportCacheValue *importString(const LocationRange &loc, const LiteralString *file)
     {
-        std::string dir = dir_name(loc.file);
+        std::string dir = dir_name(loc.fileName());
 
         const UString &path = file->value;
 
@@ -798,9 +1081,10 @@ class Interpreter {
     BindingFrame capture(const std::vector<const Identifier *> &free_vars)
     {
         BindingFrame env;
+        env.reserve(free_vars.size());
         for (auto fv : free_vars) {
             auto *th = stack.lookUpVar(fv);
-            env[fv] = th;
+            env.bind(fv, th);
         }
         return env;
     }
@@ -812,8 +1096,8 @@ class Interpreter {
      */
     unsigned countLeaves(HeapObject *obj)
     {
-        if (auto *ext = dynamic_cast<HeapExtendedObject *>(obj)) {
-            return countLeaves(ext->left) + countLeaves(ext->right);
+        if (obj->type == HeapEntity::EXTENDED_OBJECT) {
+            return objectLeaves(obj).size();
         } else {
             // Must be a HeapLeafObject.
             return 1;
@@ -827,7 +1111,8 @@ class Interpreter {
      */
     Interpreter(Allocator *alloc, const ExtMap &ext_vars, unsigned max_stack, double gc_min_objects,
                 double gc_growth_trigger, const VmNativeCallbackMap &native_callbacks,
-                JsonnetImportCallback *import_callback, void *import_callback_context)
+                JsonnetImportCallback *import_callback, void *import_callback_context,
+                VmAstCache *import_cache)
 
         : heap(gc_min_objects, gc_growth_trigger),
           stack(max_stack),
@@ -837,50 +1122,107 @@ class Interpreter {
           idInvariant(alloc->makeIdentifier(U"object_assert")),
           idJsonObjVar(alloc->makeIdentifier(U"_")),
           jsonObjVar(alloc->make<Var>(LocationRange(), Fodder{}, idJsonObjVar)),
+          idStd(alloc->makeIdentifier(U"$std")),
+          stdThunk(nullptr),
+          idNativeCallTarget(alloc->makeIdentifier(U"$target")),
+          idNativeIndexField(alloc->makeIdentifier(U"$field")),
           externalVars(ext_vars),
           nativeCallbacks(native_callbacks),
           importCallback(import_callback),
-          importCallbackContext(import_callback_context)
+          importCallbackContext(import_callback_context),
+          importCache(import_cache)
     {
         scratch = makeNull();
-        builtins["makeArray"] = &Interpreter::builtinMakeArray;
-        builtins["pow"] = &Interpreter::builtinPow;
-        builtins["floor"] = &Interpreter::builtinFloor;
-        builtins["ceil"] = &Interpreter::builtinCeil;
-        builtins["sqrt"] = &Interpreter::builtinSqrt;
-        builtins["sin"] = &Interpreter::builtinSin;
-        builtins["cos"] = &Interpreter::builtinCos;
-        builtins["tan"] = &Interpreter::builtinTan;
-        builtins["asin"] = &Interpreter::builtinAsin;
-        builtins["acos"] = &Interpreter::builtinAcos;
-        builtins["atan"] = &Interpreter::builtinAtan;
-        builtins["type"] = &Interpreter::builtinType;
-        builtins["filter"] = &Interpreter::builtinFilter;
-        builtins["objectHasEx"] = &Interpreter::builtinObjectHasEx;
-        builtins["length"] = &Interpreter::builtinLength;
-        builtins["objectFieldsEx"] = &Interpreter::builtinObjectFieldsEx;
-        builtins["codepoint"] = &Interpreter::builtinCodepoint;
-        builtins["char"] = &Interpreter::builtinChar;
-        builtins["log"] = &Interpreter::builtinLog;
-        builtins["exp"] = &Interpreter::builtinExp;
-        builtins["mantissa"] = &Interpreter::builtinMantissa;
-        builtins["exponent"] = &Interpreter::builtinExponent;
-        builtins["modulo"] = &Interpreter::builtinModulo;
-        builtins["extVar"] = &Interpreter::builtinExtVar;
-        builtins["primitiveEquals"] = &Interpreter::builtinPrimitiveEquals;
-        builtins["native"] = &Interpreter::builtinNative;
-        builtins["md5"] = &Interpreter::builtinMd5;
-        builtins["trace"] = &Interpreter::builtinTrace;
-        builtins["splitLimit"] = &Interpreter::builtinSplitLimit;
-        builtins["substr"] = &Interpreter::builtinSubstr;
-        builtins["range"] = &Interpreter::builtinRange;
-        builtins["strReplace"] = &Interpreter::builtinStrReplace;
-        builtins["asciiLower"] = &Interpreter::builtinAsciiLower;
-        builtins["asciiUpper"] = &Interpreter::builtinAsciiUpper;
-        builtins["join"] = &Interpreter::builtinJoin;
-        builtins["parseJson"] = &Interpreter::builtinParseJson;
-        builtins["encodeUTF8"] = &Interpreter::builtinEncodeUTF8;
-        builtins["decodeUTF8"] = &Interpreter::builtinDecodeUTF8;
+        stdThunk = makeHeap<HeapThunk>(idStd, nullptr, 0, jsonnet_std_ast());
+        BuiltinMap by_name;
+        by_name["makeArray"] = &Interpreter::builtinMakeArray;
+        by_name["pow"] = &Interpreter::builtinPow;
+        by_name["floor"] = &Interpreter::builtinFloor;
+        by_name["ceil"] = &Interpreter::builtinCeil;
+        by_name["sqrt"] = &Interpreter::builtinSqrt;
+        by_name["sin"] = &Interpreter::builtinSin;
+        by_name["cos"] = &Interpreter::builtinCos;
+        by_name["tan"] = &Interpreter::builtinTan;
+        by_name["asin"] = &Interpreter::builtinAsin;
+        by_name["acos"] = &Interpreter::builtinAcos;
+        by_name["atan"] = &Interpreter::builtinAtan;
+        by_name["type"] = &Interpreter::builtinType;
+        by_name["filter"] = &Interpreter::builtinFilter;
+        by_name["objectHasEx"] = &Interpreter::builtinObjectHasEx;
+        by_name["length"] = &Interpreter::builtinLength;
+        by_name["objectFieldsEx"] = &Interpreter::builtinObjectFieldsEx;
+        by_name["codepoint"] = &Interpreter::builtinCodepoint;
+        by_name["char"] = &Interpreter::builtinChar;
+        by_name["log"] = &Interpreter::builtinLog;
+        by_name["exp"] = &Interpreter::builtinExp;
+        by_name["mantissa"] = &Interpreter::builtinMantissa;
+        by_name["exponent"] = &Interpreter::builtinExponent;
+        by_name["modulo"] = &Interpreter::builtinModulo;
+        by_name["extVar"] = &Interpreter::builtinExtVar;
+        by_name["primitiveEquals"] = &Interpreter::builtinPrimitiveEquals;
+        by_name["native"] = &Interpreter::builtinNative;
+        by_name["md5"] = &Interpreter::builtinMd5;
+        by_name["trace"] = &Interpreter::builtinTrace;
+        by_name["splitLimit"] = &Interpreter::builtinSplitLimit;
+        by_name["substr"] = &Interpreter::builtinSubstr;
+        by_name["range"] = &Interpreter::builtinRange;
+        by_name["strReplace"] = &Interpreter::builtinStrReplace;
+        by_name["asciiLower"] = &Interpreter::builtinAsciiLower;
+        by_name["asciiUpper"] = &Interpreter::builtinAsciiUpper;
+        by_name["join"] = &Interpreter::builtinJoin;
+        by_name["parseJson"] = &Interpreter::builtinParseJson;
+        by_name["encodeUTF8"] = &Interpreter::builtinEncodeUTF8;
+        by_name["decodeUTF8"] = &Interpreter::builtinDecodeUTF8;
+        by_name["slice"] = &Interpreter::builtinSlice;
+        by_name["sortImpl"] = &Interpreter::builtinSortImpl;
+        by_name["uniqImpl"] = &Interpreter::builtinUniqImpl;
+        by_name["setImpl"] = &Interpreter::builtinSetImpl;
+        by_name["setMemberImpl"] = &Interpreter::builtinSetMemberImpl;
+        by_name["setUnionImpl"] = &Interpreter::builtinSetUnionImpl;
+        by_name["setInterImpl"] = &Interpreter::builtinSetInterImpl;
+        by_name["setDiffImpl"] = &Interpreter::builtinSetDiffImpl;
+        by_name["manifestJsonEx"] = &Interpreter::builtinManifestJsonEx;
+        by_name["manifestYamlDocImpl"] = &Interpreter::builtinManifestYamlDocImpl;
+        by_name["manifestYamlStreamImpl"] = &Interpreter::builtinManifestYamlStreamImpl;
+        by_name["format"] = &Interpreter::builtinFormat;
+        by_name["startsWith"] = &Interpreter::builtinStartsWith;
+        by_name["endsWith"] = &Interpreter::builtinEndsWith;
+        by_name["lstripChars"] = &Interpreter::builtinLstripChars;
+        by_name["rstripChars"] = &Interpreter::builtinRstripChars;
+        by_name["stripChars"] = &Interpreter::builtinStripChars;
+        by_name["parseInt"] = &Interpreter::builtinParseInt;
+        by_name["parseOctal"] = &Interpreter::builtinParseOctal;
+        by_name["parseHex"] = &Interpreter::builtinParseHex;
+        by_name["escapeStringJson"] = &Interpreter::builtinEscapeStringJson;
+        by_name["escapeStringPython"] = &Interpreter::builtinEscapeStringPython;
+        by_name["escapeStringBash"] = &Interpreter::builtinEscapeStringBash;
+        by_name["escapeStringDollars"] = &Interpreter::builtinEscapeStringDollars;
+        by_name["base64"] = &Interpreter::builtinBase64;
+        by_name["base64DecodeBytes"] = &Interpreter::builtinBase64DecodeBytes;
+        by_name["base64Decode"] = &Interpreter::builtinBase64Decode;
+        by_name["findSubstr"] = &Interpreter::builtinFindSubstr;
+        by_name["split"] = &Interpreter::builtinSplit;
+        by_name["map"] = &Interpreter::builtinMap;
+        by_name["mapWithIndex"] = &Interpreter::builtinMapWithIndex;
+        by_name["flatMap"] = &Interpreter::builtinFlatMap;
+        by_name["foldl"] = &Interpreter::builtinFoldl;
+        by_name["foldr"] = &Interpreter::builtinFoldr;
+        by_name["flattenArrays"] = &Interpreter::builtinFlattenArrays;
+        by_name["equals"] = &Interpreter::builtinEquals;
+        by_name["mergePatch"] = &Interpreter::builtinMergePatch;
+        by_name["prune"] = &Interpreter::builtinPrune;
+
+        // Calls are dispatched by the index of the builtin rather than by name.
+        unsigned long builtin_count = jsonnet_builtin_count();
+        builtins.resize(builtin_count, nullptr);
+        builtinClosures.resize(builtin_count, nullptr);
+        for (unsigned long c = 0; c < builtin_count; ++c) {
+            auto it = by_name.find(encode_utf8(jsonnet_builtin_decl(c).name));
+            if (it != by_name.end())
+                builtins[c] = it->second;
+        }
+        for (const auto &pair : nativeCallbacks)
+            natives.push_back(&pair.second);
     }
 
     /** Clean up the heap, stack, stash, and builtin function ASTs. */
@@ -956,7 +1298,7 @@ class Interpreter {
 
             auto *el = makeHeap<HeapThunk>(func->params[0].id, nullptr, 0, nullptr);
             el->fill(makeNumber(i));  // i guaranteed not to be inf/NaN
-            th->upValues[func->params[0].id] = el;
+            th->upValues.bind(func->params[0].id, el);
             elements[i] = th;
         }
         scratch = makeArray(elements);
@@ -1062,7 +1404,7 @@ class Interpreter {
         if (func->params.size() != 1) {
             throw makeError(loc, "filter function takes 1 parameter.");
         }
-        if (arr->elements.size() == 0) {
+        if (arr->size() == 0) {
             scratch = makeArray({});
         } else {
             f.kind = FRAME_BUILTIN_FILTER;
@@ -1071,166 +1413,1555 @@ class Interpreter {
             f.thunks.clear();
             f.elementId = 0;
 
-            auto *thunk = arr->elements[f.elementId];
+            auto *thunk = arr->at(f.elementId);
             BindingFrame bindings = func->upValues;
-            bindings[func->params[0].id] = thunk;
+            bindings.bind(func->params[0].id, thunk);
             stack.newCall(loc, func, func->self, func->offset, bindings);
             return func->body;
         }
         return nullptr;
     }
 
-    const AST *builtinObjectHasEx(const LocationRange &loc, const std::vector<Value> &args)
+    /** Call a function from native code, e.g. the key function of std.sort.
+     *
+     * The call is pushed onto the stack and the returned AST must then be evaluated, after which
+     * the result is in scratch and the frame that was on top of the stack resumes.  The caller
+     * must keep the function and the arguments reachable.
+     *
+     * \param site The application of the builtin, which is blamed for errors in the call.
+     */
+    const AST *callFunction(const AST *site, const Value &func,
+                            const std::vector<HeapThunk *> &args)
     {
-        validateBuiltinArgs(
-            loc, "objectHasEx", args, {Value::OBJECT, Value::STRING, Value::BOOLEAN});
-        const auto *obj = static_cast<const HeapObject *>(args[0].v.h);
-        const auto *str = static_cast<const HeapString *>(args[1].v.h);
-        bool include_hidden = args[2].v.b;
-        bool found = false;
-        for (const auto &field : objectFields(obj, !include_hidden)) {
-            if (field->name == str->value) {
-                found = true;
-                break;
+        auto *closure = static_cast<HeapClosure *>(func.v.h);
+        if (closure->body != nullptr && closure->params.size() == args.size()) {
+            BindingFrame bindings = closure->upValues;
+            bindings.reserve(bindings.size() + args.size());
+            for (unsigned i = 0; i < args.size(); ++i)
+                bindings.bind(closure->params[i].id, args[i]);
+            stack.newCall(site->location, closure, closure->self, closure->offset, bindings);
+            return closure->body;
+        }
+
+        // Otherwise apply the function as user code would, which handles default arguments,
+        // arity errors, and builtin functions (which have no body).
+        const Apply *apply = nativeCall(site, args.size());
+        auto *target = makeHeap<HeapThunk>(idNativeCallTarget, nullptr, 0, nullptr);
+        target->fill(func);
+        BindingFrame bindings;
+        bindings.reserve(args.size() + 1);
+        bindings.bind(idNativeCallTarget, target);
+        for (unsigned i = 0; i < args.size(); ++i) {
+            const auto *var = static_cast<const Var *>(apply->args[i].expr);
+            bindings.bind(var->id, args[i]);
+        }
+        stack.newCall(site->location, nullptr, nullptr, 0, bindings);
+        return apply;
+    }
+
+    /** The application of idNativeCallTarget to $arg0 ... $argN used to call functions from
+     * native code at the given site.
+     */
+    const Apply *nativeCall(const AST *site, unsigned num_args)
+    {
+        const Apply *&apply = nativeCalls[std::make_pair(site, num_args)];
+        if (apply == nullptr) {
+            ArgParams params;
+            for (unsigned i = 0; i < num_args; ++i) {
+                auto *id = alloc->makeIdentifier(U"$arg" + decode_utf8(std::to_string(i)));
+                auto *var = alloc->make<Var>(site->location, Fodder{}, id);
+                var->freeVariables.push_back(id);
+                params.emplace_back(var, Fodder{});
             }
+            auto *target = alloc->make<Var>(site->location, Fodder{}, idNativeCallTarget);
+            apply = alloc->make<Apply>(site->location, Fodder{}, target, Fodder{}, params, false,
+                                       Fodder{}, Fodder{}, false);
         }
-        scratch = makeBoolean(found);
-        return nullptr;
+        return apply;
     }
 
-    const AST *builtinLength(const LocationRange &loc, const std::vector<Value> &args)
+    /** Make a thunk that calls the function when forced, like the elements of std.map.  The new
+     * thunks are kept reachable via the top frame's thunks.  The caller must keep the function
+     * and the arguments reachable.
+     *
+     * \param name The name of the thunk, for stack traces.
+     */
+    HeapThunk *makeCallThunk(const AST *site, const Identifier *name, const Value &func,
+                             const std::vector<HeapThunk *> &args)
     {
-        if (args.size() != 1) {
-            throw makeError(loc, "length takes 1 parameter.");
+        Frame &f = stack.top();
+        auto *closure = static_cast<HeapClosure *>(func.v.h);
+        if (closure->body != nullptr && closure->params.size() == args.size()) {
+            auto *th = makeHeap<HeapThunk>(name, closure->self, closure->offset, closure->body);
+            f.thunks.push_back(th);
+            th->upValues = closure->upValues;
+            th->upValues.reserve(th->upValues.size() + args.size());
+            for (unsigned i = 0; i < args.size(); ++i)
+                th->upValues.bind(closure->params[i].id, args[i]);
+            return th;
         }
-        HeapEntity *e = args[0].v.h;
-        switch (args[0].t) {
-            case Value::OBJECT: {
-                auto fields = objectFields(static_cast<HeapObject *>(e), true);
-                scratch = makeNumber(fields.size());
-            } break;
+        const Apply *apply = nativeCall(site, args.size());
+        auto *th = makeHeap<HeapThunk>(name, nullptr, 0, apply);
+        f.thunks.push_back(th);
+        auto *target = makeHeap<HeapThunk>(idNativeCallTarget, nullptr, 0, nullptr);
+        target->fill(func);
+        th->upValues.reserve(args.size() + 1);
+        th->upValues.bind(idNativeCallTarget, target);
+        for (unsigned i = 0; i < args.size(); ++i) {
+            const auto *var = static_cast<const Var *>(apply->args[i].expr);
+            th->upValues.bind(var->id, args[i]);
+        }
+        return th;
+    }
 
-            case Value::ARRAY:
-                scratch = makeNumber(static_cast<HeapArray *>(e)->elements.size());
-                break;
+    /** Make a thunk that indexes the object when forced, like obj[f] in user code.  The new
+     * thunk is kept reachable via the top frame's thunks.
+     */
+    HeapThunk *makeIndexThunk(const AST *site, const Value &obj, const Identifier *f)
+    {
+        const Index *&index = nativeIndexes[site];
+        if (index == nullptr) {
+            auto *target = alloc->make<Var>(site->location, Fodder{}, idNativeCallTarget);
+            target->freeVariables.push_back(idNativeCallTarget);
+            auto *field = alloc->make<Var>(site->location, Fodder{}, idNativeIndexField);
+            field->freeVariables.push_back(idNativeIndexField);
+            index = alloc->make<Index>(site->location, Fodder{}, target, Fodder{}, false, field,
+                                       Fodder{}, nullptr, Fodder{}, nullptr, Fodder{});
+        }
+        auto *th = makeHeap<HeapThunk>(f, nullptr, 0, index);
+        stack.top().thunks.push_back(th);
+        th->upValues.reserve(2);
+        auto *target = makeHeap<HeapThunk>(idNativeCallTarget, nullptr, 0, nullptr);
+        th->upValues.bind(idNativeCallTarget, target);
+        target->fill(obj);
+        auto *field = makeHeap<HeapThunk>(idNativeIndexField, nullptr, 0, nullptr);
+        th->upValues.bind(idNativeIndexField, field);
+        field->fill(makeString(f->name));
+        return th;
+    }
 
-            case Value::STRING:
-                scratch = makeNumber(static_cast<HeapString *>(e)->value.length());
-                break;
+    /** Make a thunk holding the value, which is kept reachable via the top frame's thunks. */
+    HeapThunk *makeValueThunk(const Value &v)
+    {
+        auto *th = makeHeap<HeapThunk>(idArrayElement, nullptr, 0, nullptr);
+        stack.top().thunks.push_back(th);
+        th->fill(v);
+        return th;
+    }
 
-            case Value::FUNCTION:
-                scratch = makeNumber(static_cast<HeapClosure *>(e)->params.size());
-                break;
+    /** Whether the function returns its only parameter, like std.id. */
+    static bool isIdentity(const Value &func)
+    {
+        auto *closure = static_cast<HeapClosure *>(func.v.h);
+        if (closure->body == nullptr || closure->params.size() != 1 ||
+            closure->body->type != AST_VAR)
+            return false;
+        return static_cast<const Var *>(closure->body)->id == closure->params[0].id;
+    }
 
-            default:
-                throw makeError(loc,
-                                "length operates on strings, objects, "
-                                "and arrays, got " +
-                                    type_str(args[0]));
+    /** Compute the keys of the elements in f.thunks into f.values, using the key function in
+     * f.val.  Resumes from the first element whose key is not yet known, so each key is only
+     * computed once.
+     *
+     * \returns The AST to evaluate for the next key, or nullptr once all keys are known.
+     */
+    const AST *computeKeys(void)
+    {
+        Frame &f = stack.top();
+        // The identity function just forces the elements, so avoid calling it.
+        bool identity = isIdentity(f.val);
+        while (f.values.size() < f.thunks.size()) {
+            HeapThunk *th = f.thunks[f.values.size()];
+            if (!identity)
+                return callFunction(f.ast, f.val, {th});
+            if (!th->filled) {
+                stack.newCall(f.location, th, th->self, th->offset, th->upValues);
+                return th->body;
+            }
+            f.values.push_back(th->content);
         }
         return nullptr;
     }
 
-    const AST *builtinObjectFieldsEx(const LocationRange &loc, const std::vector<Value> &args)
+    /** Order two keys like the < operator does, raising the same errors. */
+    bool keyLess(const LocationRange &loc, const Value &a, const Value &b)
     {
-        validateBuiltinArgs(loc, "objectFieldsEx", args, {Value::OBJECT, Value::BOOLEAN});
-        const auto *obj = static_cast<HeapObject *>(args[0].v.h);
-        bool include_hidden = args[1].v.b;
-        // Stash in a set first to sort them.
-        std::set<UString> fields;
-        for (const auto &field : objectFields(obj, !include_hidden)) {
-            fields.insert(field->name);
+        if (a.t != b.t) {
+            throw makeError(loc,
+                            "binary operator < requires matching types, got " + type_str(a) +
+                                " and " + type_str(b) + ".");
         }
-        scratch = makeArray({});
-        auto &elements = static_cast<HeapArray *>(scratch.v.h)->elements;
-        for (const auto &field : fields) {
-            auto *th = makeHeap<HeapThunk>(idArrayElement, nullptr, 0, nullptr);
-            elements.push_back(th);
-            th->fill(makeString(field));
+        switch (a.t) {
+            case Value::NUMBER: return a.v.d < b.v.d;
+
+            case Value::STRING:
+                return static_cast<HeapString *>(a.v.h)->value() <
+                       static_cast<HeapString *>(b.v.h)->value();
+
+            case Value::ARRAY: throw makeError(loc, "binary operator < does not operate on arrays.");
+
+            case Value::BOOLEAN:
+                throw makeError(loc, "binary operator < does not operate on booleans.");
+
+            case Value::FUNCTION:
+                throw makeError(loc, "binary operator < does not operate on functions.");
+
+            case Value::NULL_TYPE: throw makeError(loc, "binary operator < does not operate on null.");
+
+            case Value::OBJECT:
+                throw makeError(loc, "binary operator < does not operate on objects.");
         }
-        return nullptr;
+        return false;  // Quiet, compiler.
     }
 
-    const AST *builtinCodepoint(const LocationRange &loc, const std::vector<Value> &args)
+    /** Compare two values like std.equals does, evaluating array elements and object fields as
+     * required.
+     *
+     * This can trigger a garbage collection cycle, so both values must be reachable.  Frames
+     * may be pushed, so references into the stack are not valid afterwards.
+     */
+    bool equalValues(const LocationRange &loc, const Value &a, const Value &b)
     {
-        validateBuiltinArgs(loc, "codepoint", args, {Value::STRING});
-        const UString &str = static_cast<HeapString *>(args[0].v.h)->value;
-        if (str.length() != 1) {
-            std::stringstream ss;
-            ss << "codepoint takes a string of length 1, got length " << str.length();
-            throw makeError(loc, ss.str());
+        if (a.t != b.t)
+            return false;
+        switch (a.t) {
+            case Value::BOOLEAN: return a.v.b == b.v.b;
+
+            case Value::NUMBER: return a.v.d == b.v.d;
+
+            case Value::STRING:
+                return static_cast<HeapString *>(a.v.h)->value() ==
+                       static_cast<HeapString *>(b.v.h)->value();
+
+            case Value::NULL_TYPE: return true;
+
+            case Value::FUNCTION: throw makeError(loc, "cannot test equality of functions");
+
+            case Value::ARRAY: {
+                auto *arr_a = static_cast<HeapArray *>(a.v.h);
+                auto *arr_b = static_cast<HeapArray *>(b.v.h);
+                if (arr_a->size() != arr_b->size())
+                    return false;
+                // Forced elements stay reachable from the arrays.
+                for (size_t i = 0; i < arr_a->size(); ++i) {
+                    const Value &elem_a = forceThunk(loc, arr_a->at(i));
+                    const Value &elem_b = forceThunk(loc, arr_b->at(i));
+                    if (!equalValues(loc, elem_a, elem_b))
+                        return false;
+                }
+                return true;
+            }
+
+            case Value::OBJECT: {
+                auto *obj_a = static_cast<HeapObject *>(a.v.h);
+                auto *obj_b = static_cast<HeapObject *>(b.v.h);
+                // The field lists are cached in the objects, so they stay valid.
+                const auto &fields_a = sortedFields(obj_a, false);
+                const auto &fields_b = sortedFields(obj_b, false);
+                if (fields_a.size() != fields_b.size())
+                    return false;
+                for (size_t i = 0; i < fields_a.size(); ++i) {
+                    if (fields_a[i]->name != fields_b[i]->name)
+                        return false;
+                }
+                // Like indexing, only check the invariants if there is a field to compare.
+                if (fields_a.size() == 0)
+                    return true;
+                runInvariants(loc, obj_a);
+                runInvariants(loc, obj_b);
+                // Field values stay reachable from the field caches of the objects.
+                for (size_t i = 0; i < fields_a.size(); ++i) {
+                    Value field_a = evaluateObjectField(loc, obj_a, fields_a[i]);
+                    Value field_b = evaluateObjectField(loc, obj_b, fields_b[i]);
+                    if (!equalValues(loc, field_a, field_b))
+                        return false;
+                }
+                return true;
+            }
         }
-        char32_t c = static_cast<HeapString *>(args[0].v.h)->value[0];
-        scratch = makeNumber((unsigned long)(c));
-        return nullptr;
+        return false;  // Quiet, compiler.
     }
 
-    const AST *builtinChar(const LocationRange &loc, const std::vector<Value> &args)
+    /** Evaluate a thunk unless it is already filled, and return its value. */
+    const Value &forceThunk(const LocationRange &loc, HeapThunk *thunk)
     {
-        validateBuiltinArgs(loc, "char", args, {Value::NUMBER});
-        long l = long(args[0].v.d);
-        if (l < 0) {
-            std::stringstream ss;
-            ss << "codepoints must be >= 0, got " << l;
-            throw makeError(loc, ss.str());
-        }
-        if (l >= JSONNET_CODEPOINT_MAX) {
-            std::stringstream ss;
-            ss << "invalid unicode codepoint, got " << l;
-            throw makeError(loc, ss.str());
+        if (!thunk->filled) {
+            stack.newCall(loc, thunk, thunk->self, thunk->offset, thunk->upValues);
+            evaluate(thunk->body, stack.size());
+            thunk->fill(scratch);
+            stack.pop();
         }
-        char32_t c = l;
-        scratch = makeString(UString(&c, 1));
-        return nullptr;
+        return thunk->content;
     }
 
-    const AST *builtinLog(const LocationRange &loc, const std::vector<Value> &args)
+    /** Evaluate a field of an object, caching its value in the object. */
+    Value evaluateObjectField(const LocationRange &loc, HeapObject *obj, const Identifier *f)
     {
-        validateBuiltinArgs(loc, "log", args, {Value::NUMBER});
-        scratch = makeNumberCheck(loc, std::log(args[0].v.d));
-        return nullptr;
+        // pushes FRAME_CALL
+        const AST *body = objectIndex(loc, obj, f, 0);
+        evaluateField(body);
+        stack.pop();
+        return scratch;
     }
 
-    const AST *builtinExp(const LocationRange &loc, const std::vector<Value> &args)
+    /** Raise an error unless the arguments have the expected types, except that strings are
+     * accepted in place of arrays, as they can be indexed in the same way.
+     */
+    void validateIndexableArgs(const LocationRange &loc, const std::string &name,
+                               const std::vector<Value> &args,
+                               const std::vector<Value::Type> params)
     {
-        validateBuiltinArgs(loc, "exp", args, {Value::NUMBER});
-        scratch = makeNumberCheck(loc, std::exp(args[0].v.d));
-        return nullptr;
+        bool ok = args.size() == params.size();
+        for (unsigned i = 0; ok && i < args.size(); ++i) {
+            ok = args[i].t == params[i] ||
+                 (params[i] == Value::ARRAY && args[i].t == Value::STRING);
+        }
+        if (!ok)
+            validateBuiltinArgs(loc, name, args, params);
     }
 
-    const AST *builtinMantissa(const LocationRange &loc, const std::vector<Value> &args)
+    /** Set up the frame on top of the stack to compute the keys of the elements of the given
+     * arrays, or the characters of the given strings.  The builtin arguments are no longer
+     * reachable from the frame afterwards.
+     */
+    void startKeys(FrameKind kind, const Value &key_f, const std::vector<Value> &indexables)
     {
-        validateBuiltinArgs(loc, "mantissa", args, {Value::NUMBER});
-        int exp;
-        double m = std::frexp(args[0].v.d, &exp);
-        scratch = makeNumberCheck(loc, m);
-        return nullptr;
+        std::vector<HeapThunk *> elements;
+        for (const Value &v : indexables) {
+            if (v.t == Value::ARRAY) {
+                auto *arr = static_cast<HeapArray *>(v.v.h);
+                for (size_t i = 0; i < arr->size(); ++i)
+                    elements.push_back(arr->at(i));
+                continue;
+            }
+            UString str = static_cast<HeapString *>(v.v.h)->value();
+            for (char32_t c : str) {
+                auto *th = makeHeap<HeapThunk>(idArrayElement, nullptr, 0, nullptr);
+                // Keep it reachable, along with the arguments, until the frame is set up.
+                stack.top().thunks.push_back(th);
+                th->fill(makeString(UString(&c, 1)));
+                elements.push_back(th);
+            }
+        }
+        Frame &f = stack.top();
+        f.kind = kind;
+        f.val = key_f;
+        f.thunks = elements;
+        f.values.clear();
     }
 
-    const AST *builtinExponent(const LocationRange &loc, const std::vector<Value> &args)
+    /** Keep the indexes of elements whose key differs from that of the last one kept, like
+     * std.uniq.  Frames may be pushed, so references into the stack are not valid afterwards.
+     */
+    std::vector<unsigned> uniqKeys(const std::vector<unsigned> &order)
     {
-        validateBuiltinArgs(loc, "exponent", args, {Value::NUMBER});
-        int exp;
-        std::frexp(args[0].v.d, &exp);
-        scratch = makeNumberCheck(loc, exp);
-        return nullptr;
+        LocationRange loc = stack.top().location;
+        std::vector<unsigned> kept;
+        for (unsigned i : order) {
+            if (kept.size() > 0) {
+                // The keys stay reachable from the frame.
+                Value last = stack.top().values[kept.back()];
+                Value key = stack.top().values[i];
+                if (equalValues(loc, last, key))
+                    continue;
+            }
+            kept.push_back(i);
+        }
+        return kept;
     }
 
-    const AST *builtinModulo(const LocationRange &loc, const std::vector<Value> &args)
+    /** Finish std.sort, std.uniq or std.set once the keys are known. */
+    const AST *sortElements(void)
     {
-        validateBuiltinArgs(loc, "modulo", args, {Value::NUMBER, Value::NUMBER});
-        double a = args[0].v.d;
-        double b = args[1].v.d;
-        if (b == 0)
-            throw makeError(loc, "division by zero.");
-        scratch = makeNumberCheck(loc, std::fmod(a, b));
+        const AST *ast = computeKeys();
+        if (ast != nullptr)
+            return ast;
+        Frame &f = stack.top();
+        FrameKind kind = f.kind;
+        const LocationRange &loc = f.location;
+        const std::vector<Value> &keys = f.values;
+        std::vector<unsigned> order(keys.size());
+        for (unsigned i = 0; i < order.size(); ++i)
+            order[i] = i;
+        if (kind != FRAME_BUILTIN_UNIQ) {
+            std::stable_sort(order.begin(), order.end(), [&](unsigned i, unsigned j) {
+                return keyLess(loc, keys[i], keys[j]);
+            });
+        }
+        if (kind != FRAME_BUILTIN_SORT)
+            order = uniqKeys(order);
+        std::vector<HeapThunk *> elements;
+        for (unsigned i : order)
+            elements.push_back(stack.top().thunks[i]);
+        scratch = makeArray(elements);
         return nullptr;
     }
 
-    const AST *builtinExtVar(const LocationRange &loc, const std::vector<Value> &args)
+    /** Finish std.setUnion, std.setInter or std.setDiff once the keys are known.  The elements
+     * of the first set come first in f.thunks, up to f.elementEnd.
+     */
+    const AST *setElements(void)
+    {
+        const AST *ast = computeKeys();
+        if (ast != nullptr)
+            return ast;
+        FrameKind kind = stack.top().kind;
+        LocationRange loc = stack.top().location;
+        unsigned size_a = stack.top().elementEnd;
+        unsigned size = stack.top().thunks.size();
+        std::vector<unsigned> kept;
+        unsigned i = 0, j = size_a;
+        while (i < size_a && j < size) {
+            // The keys stay reachable from the frame.
+            Value key_a = stack.top().values[i];
+            Value key_b = stack.top().values[j];
+            if (equalValues(loc, key_a, key_b)) {
+                if (kind != FRAME_BUILTIN_SET_DIFF)
+                    kept.push_back(i);
+                i++;
+                j++;
+            } else if (keyLess(loc, key_a, key_b)) {
+                if (kind != FRAME_BUILTIN_SET_INTER)
+                    kept.push_back(i);
+                i++;
+            } else {
+                if (kind == FRAME_BUILTIN_SET_UNION)
+                    kept.push_back(j);
+                j++;
+            }
+        }
+        if (kind != FRAME_BUILTIN_SET_INTER) {
+            for (; i < size_a; ++i)
+                kept.push_back(i);
+        }
+        if (kind == FRAME_BUILTIN_SET_UNION) {
+            for (; j < size; ++j)
+                kept.push_back(j);
+        }
+        std::vector<HeapThunk *> elements;
+        for (unsigned k : kept)
+            elements.push_back(stack.top().thunks[k]);
+        scratch = makeArray(elements);
+        return nullptr;
+    }
+
+    /** Continue the binary search of std.setMember.  The key of x is f.values[0], the array is
+     * f.val2, and the elements in [f.elementId, f.elementEnd) remain to be searched.
+     */
+    const AST *setMember(void)
+    {
+        while (true) {
+            const AST *ast = computeKeys();
+            if (ast != nullptr)
+                return ast;
+            Frame &f = stack.top();
+            if (f.values.size() == 2) {
+                LocationRange loc = f.location;
+                // The keys stay reachable from the frame.
+                Value key_x = f.values[0];
+                Value key_mid = f.values[1];
+                // The search compares x with different elements than std.sort would, so reject
+                // keys that cannot be ordered before finding an equal one, as std.sort does.
+                auto orderable = [](const Value &k) {
+                    return k.t != Value::ARRAY && k.t != Value::OBJECT;
+                };
+                if (!orderable(key_x) || !orderable(key_mid))
+                    keyLess(loc, key_x, key_mid);
+                if (equalValues(loc, key_x, key_mid)) {
+                    scratch = makeBoolean(true);
+                    return nullptr;
+                }
+                bool less = keyLess(loc, key_x, key_mid);
+                Frame &f2 = stack.top();
+                unsigned mid = f2.elementId + (f2.elementEnd - f2.elementId) / 2;
+                if (less)
+                    f2.elementEnd = mid;
+                else
+                    f2.elementId = mid + 1;
+                f2.thunks.pop_back();
+                f2.values.pop_back();
+                continue;
+            }
+            if (f.elementId >= f.elementEnd) {
+                scratch = makeBoolean(false);
+                return nullptr;
+            }
+            auto *arr = static_cast<HeapArray *>(f.val2.v.h);
+            f.thunks.push_back(arr->at(f.elementId + (f.elementEnd - f.elementId) / 2));
+        }
+    }
+
+    const AST *startSort(FrameKind kind, const LocationRange &loc, const std::string &name,
+                         const std::vector<Value> &args)
+    {
+        validateIndexableArgs(loc, name, args, {Value::ARRAY, Value::FUNCTION});
+        startKeys(kind, args[1], {args[0]});
+        return sortElements();
+    }
+
+    const AST *builtinSortImpl(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        return startSort(FRAME_BUILTIN_SORT, loc, "sortImpl", args);
+    }
+
+    const AST *builtinUniqImpl(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        return startSort(FRAME_BUILTIN_UNIQ, loc, "uniqImpl", args);
+    }
+
+    const AST *builtinSetImpl(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        return startSort(FRAME_BUILTIN_SET, loc, "setImpl", args);
+    }
+
+    const AST *builtinSetMemberImpl(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        // x can be of any type.
+        validateIndexableArgs(
+            loc, "setMemberImpl", args, {args[0].t, Value::ARRAY, Value::FUNCTION});
+        stack.top().val2 = args[0];
+        startKeys(FRAME_BUILTIN_SET_MEMBER, args[2], {args[1]});
+        // The elements are only keyed as the search reaches them, so the only element of
+        // f.thunks is x, held in a thunk so that it can be keyed like them.
+        scratch = makeArray(stack.top().thunks);
+        auto *x = makeHeap<HeapThunk>(idArrayElement, nullptr, 0, nullptr);
+        Frame &f = stack.top();
+        x->fill(f.val2);
+        f.thunks = {x};
+        f.val2 = scratch;
+        f.elementId = 0;
+        f.elementEnd = static_cast<HeapArray *>(scratch.v.h)->size();
+        return setMember();
+    }
+
+    const AST *startSetOp(FrameKind kind, const LocationRange &loc, const std::string &name,
+                          const std::vector<Value> &args)
+    {
+        validateIndexableArgs(loc, name, args, {Value::ARRAY, Value::ARRAY, Value::FUNCTION});
+        unsigned size_a = args[0].t == Value::ARRAY
+                              ? static_cast<HeapArray *>(args[0].v.h)->size()
+                              : static_cast<HeapString *>(args[0].v.h)->value().size();
+        startKeys(kind, args[2], {args[0], args[1]});
+        stack.top().elementEnd = size_a;
+        return setElements();
+    }
+
+    const AST *builtinSetUnionImpl(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        return startSetOp(FRAME_BUILTIN_SET_UNION, loc, "setUnionImpl", args);
+    }
+
+    const AST *builtinSetInterImpl(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        return startSetOp(FRAME_BUILTIN_SET_INTER, loc, "setInterImpl", args);
+    }
+
+    const AST *builtinSetDiffImpl(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        return startSetOp(FRAME_BUILTIN_SET_DIFF, loc, "setDiffImpl", args);
+    }
+
+    /** Raise an error unless the argument of std.map and friends has the expected type. */
+    void checkHigherOrderArg(const LocationRange &loc, const std::string &name,
+                             const std::string &param, const Value &v, bool ok,
+                             const std::string &expected)
+    {
+        if (!ok) {
+            std::stringstream ss;
+            ss << "std." << name << " " << param << " param must be " << expected << ", got "
+               << type_str(v);
+            throw makeError(loc, ss.str());
+        }
+    }
+
+    /** Check the function and array / string arguments of std.map and friends. */
+    void validateHigherOrderArgs(const LocationRange &loc, const std::string &name,
+                                 const std::vector<Value> &args,
+                                 const std::string &expected = "array / string")
+    {
+        checkHigherOrderArg(
+            loc, name, "first", args[0], args[0].t == Value::FUNCTION, "function");
+        checkHigherOrderArg(loc,
+                            name,
+                            "second",
+                            args[1],
+                            args[1].t == Value::ARRAY || args[1].t == Value::STRING,
+                            expected);
+    }
+
+    /** The number of elements of an array, or characters of a string. */
+    static size_t indexableSize(const Value &v)
+    {
+        if (v.t == Value::ARRAY)
+            return static_cast<HeapArray *>(v.v.h)->size();
+        return static_cast<HeapString *>(v.v.h)->size();
+    }
+
+    /** The thunk of an element of an array, or a new thunk holding a character of a string,
+     * which is kept reachable via the top frame's thunks.
+     */
+    HeapThunk *indexableElement(const Value &v, size_t i)
+    {
+        if (v.t == Value::ARRAY)
+            return static_cast<HeapArray *>(v.v.h)->at(i);
+        char32_t c = static_cast<HeapString *>(v.v.h)->value()[i];
+        auto *th = makeHeap<HeapThunk>(idArrayElement, nullptr, 0, nullptr);
+        stack.top().thunks.push_back(th);
+        th->fill(makeString(UString(&c, 1)));
+        return th;
+    }
+
+    const AST *builtinMap(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        Frame &f = stack.top();
+        validateHigherOrderArgs(loc, "map", args);
+        // The elements are computed lazily, so this is just a matter of building the thunks.
+        size_t sz = indexableSize(args[1]);
+        std::vector<HeapThunk *> elements(sz);
+        for (size_t i = 0; i < sz; ++i) {
+            HeapThunk *el = indexableElement(args[1], i);
+            elements[i] = makeCallThunk(f.ast, idArrayElement, args[0], {el});
+        }
+        scratch = makeArray(elements);
+        return nullptr;
+    }
+
+    const AST *builtinMapWithIndex(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        Frame &f = stack.top();
+        validateHigherOrderArgs(loc, "mapWithIndex", args, "array");
+        size_t sz = indexableSize(args[1]);
+        std::vector<HeapThunk *> elements(sz);
+        for (size_t i = 0; i < sz; ++i) {
+            auto *idx = makeHeap<HeapThunk>(idArrayElement, nullptr, 0, nullptr);
+            f.thunks.push_back(idx);
+            idx->fill(makeNumber(i));
+            HeapThunk *el = indexableElement(args[1], i);
+            elements[i] = makeCallThunk(f.ast, idArrayElement, args[0], {idx, el});
+        }
+        scratch = makeArray(elements);
+        return nullptr;
+    }
+
+    /** Append the elements of the array v to f.thunks, as though by f.thunks + v. */
+    void appendElements(const Value &v)
+    {
+        Frame &f = stack.top();
+        if (v.t != Value::ARRAY) {
+            throw makeError(f.location,
+                            "binary operator + requires matching types, got array and " +
+                                type_str(v) + ".");
+        }
+        auto *arr = static_cast<HeapArray *>(v.v.h);
+        for (size_t i = 0; i < arr->size(); ++i)
+            f.thunks.push_back(arr->at(i));
+    }
+
+    /** Continue std.flatMap.  The function is f.val, the array or string is f.val2, and
+     * f.elementId is the index of the element whose result is in scratch, if any.
+     *
+     * \returns The AST to evaluate for the next result, or nullptr once all are known.
+     */
+    const AST *flatMap(bool have_result)
+    {
+        Frame &f = stack.top();
+        if (have_result) {
+            if (f.val2.t == Value::ARRAY) {
+                appendElements(scratch);
+            } else if (scratch.t == Value::STRING) {
+                f.str.append(static_cast<HeapString *>(scratch.v.h)->value());
+            } else if (scratch.t != Value::NULL_TYPE) {
+                std::stringstream ss;
+                ss << "expected string but arr[" << f.elementId << "] was " << type_str(scratch);
+                throw makeError(f.location, ss.str());
+            }
+            f.elementId++;
+        }
+        if (f.elementId < indexableSize(f.val2)) {
+            if (f.val2.t == Value::STRING)
+                f.thunks.clear();
+            HeapThunk *el = indexableElement(f.val2, f.elementId);
+            return callFunction(f.ast, f.val, {el});
+        }
+        if (f.val2.t == Value::ARRAY)
+            scratch = makeArray(f.thunks);
+        else
+            scratch = makeString(f.str);
+        return nullptr;
+    }
+
+    const AST *builtinFlatMap(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        Frame &f = stack.top();
+        validateHigherOrderArgs(loc, "flatMap", args);
+        f.kind = FRAME_BUILTIN_FLAT_MAP;
+        f.val = args[0];
+        f.val2 = args[1];
+        f.thunks.clear();
+        f.str.clear();
+        f.elementId = 0;
+        return flatMap(false);
+    }
+
+    /** Continue std.flattenArrays.  The arrays are in f.val2 and the next one to append is
+     * f.elementId.
+     */
+    const AST *flattenArrays(void)
+    {
+        Frame &f = stack.top();
+        const auto *arr = static_cast<HeapArray *>(f.val2.v.h);
+        while (f.elementId < arr->size()) {
+            auto *th = arr->at(f.elementId);
+            if (!th->filled) {
+                stack.newCall(f.location, th, th->self, th->offset, th->upValues);
+                return th->body;
+            }
+            appendElements(th->content);
+            f.elementId++;
+        }
+        scratch = makeArray(f.thunks);
+        return nullptr;
+    }
+
+    const AST *builtinFlattenArrays(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        validateBuiltinArgs(loc, "flattenArrays", args, {Value::ARRAY});
+        Frame &f = stack.top();
+        f.kind = FRAME_BUILTIN_FLATTEN_ARRAYS;
+        f.val2 = args[0];
+        f.thunks.clear();
+        f.elementId = 0;
+        return flattenArrays();
+    }
+
+    /** Continue std.foldl or std.foldr.  The function is f.val, the array or string is f.val2,
+     * f.elementId is the number of elements folded so far, and the accumulator is in scratch.
+     *
+     * \returns The AST to evaluate for the next accumulator, or nullptr once done.
+     */
+    const AST *fold(void)
+    {
+        Frame &f = stack.top();
+        size_t sz = indexableSize(f.val2);
+        if (f.elementId >= sz)
+            return nullptr;
+        f.thunks.clear();
+        auto *acc = makeHeap<HeapThunk>(idArrayElement, nullptr, 0, nullptr);
+        f.thunks.push_back(acc);
+        acc->fill(scratch);
+        if (f.kind == FRAME_BUILTIN_FOLDL) {
+            HeapThunk *el = indexableElement(f.val2, f.elementId);
+            return callFunction(f.ast, f.val, {acc, el});
+        }
+        HeapThunk *el = indexableElement(f.val2, sz - 1 - f.elementId);
+        return callFunction(f.ast, f.val, {el, acc});
+    }
+
+    const AST *startFold(FrameKind kind, const LocationRange &loc, const std::string &name,
+                         const std::vector<Value> &args)
+    {
+        validateHigherOrderArgs(loc, name, args);
+        Frame &f = stack.top();
+        f.kind = kind;
+        f.val = args[0];
+        f.val2 = args[1];
+        f.elementId = 0;
+        scratch = args[2];
+        return fold();
+    }
+
+    const AST *builtinFoldl(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        return startFold(FRAME_BUILTIN_FOLDL, loc, "foldl", args);
+    }
+
+    const AST *builtinFoldr(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        return startFold(FRAME_BUILTIN_FOLDR, loc, "foldr", args);
+    }
+
+    const AST *builtinManifestJsonEx(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        // The value can be of any type.
+        validateBuiltinArgs(loc, "manifestJsonEx", args, {args[0].t, Value::STRING});
+        UString indent = static_cast<HeapString *>(args[1].v.h)->value();
+        std::vector<UString> path;
+        UString buf;
+        scratch = args[0];
+        manifestJsonEx(loc, indent, U"", path, buf);
+        scratch = makeString(buf);
+        return nullptr;
+    }
+
+    const AST *builtinManifestYamlDocImpl(const LocationRange &loc,
+                                          const std::vector<Value> &args)
+    {
+        // The value can be of any type.
+        validateBuiltinArgs(loc, "manifestYamlDocImpl", args, {args[0].t, Value::BOOLEAN});
+        std::vector<UString> path;
+        UString buf;
+        scratch = args[0];
+        manifestYaml(loc, args[1].v.b, U"", path, buf);
+        scratch = makeString(buf);
+        return nullptr;
+    }
+
+    const AST *builtinManifestYamlStreamImpl(const LocationRange &loc,
+                                             const std::vector<Value> &args)
+    {
+        if (args.size() == 3 && args[0].t != Value::ARRAY) {
+            throw makeError(loc, "manifestYamlStream only takes arrays, got " + type_str(args[0]));
+        }
+        validateBuiltinArgs(loc,
+                            "manifestYamlStreamImpl",
+                            args,
+                            {Value::ARRAY, Value::BOOLEAN, Value::BOOLEAN});
+        bool indent_array_in_object = args[1].v.b;
+        std::vector<UString> path;
+        UString buf = U"---\n";
+        scratch = args[0];
+        auto *arr = static_cast<HeapArray *>(scratch.v.h);
+        for (size_t i = 0; i < arr->size(); ++i) {
+            if (i > 0)
+                buf += U"\n---\n";
+            LocationRange tloc = enterElement(loc, arr->at(i));
+            manifestYaml(tloc, indent_array_in_object, U"", path, buf);
+            leaveElement();
+        }
+        buf += args[2].v.b ? U"\n...\n" : U"\n";
+        scratch = makeString(buf);
+        return nullptr;
+    }
+
+    /** Parse a std.format string into literal text and conversions, caching the result. */
+    const std::vector<FormatCode> &parseFormat(const LocationRange &loc, const UString &str)
+    {
+        auto cached = formatCodes.find(str);
+        if (cached != formatCodes.end())
+            return cached->second;
+
+        std::vector<FormatCode> codes;
+        FormatCode text;
+        size_t i = 0;
+        auto check_truncated = [&]() {
+            if (i >= str.length())
+                throw makeError(loc, "Truncated format code.");
+        };
+        auto parse_number = [&](double &v) {
+            for (;; ++i) {
+                check_truncated();
+                if (str[i] < U'0' || str[i] > U'9')
+                    break;
+                v = v * 10 + (str[i] - U'0');
+            }
+        };
+        while (i < str.length()) {
+            char32_t c = str[i++];
+            if (c != U'%') {
+                text.literal += c;
+                continue;
+            }
+            if (!text.literal.empty()) {
+                codes.push_back(text);
+                text.literal.clear();
+            }
+            FormatCode code;
+            check_truncated();
+            if (str[i] == U'(') {
+                code.hasKey = true;
+                for (++i; check_truncated(), str[i] != U')'; ++i)
+                    code.key += str[i];
+                ++i;
+            }
+            for (;; ++i) {
+                check_truncated();
+                if (str[i] == U'#')
+                    code.alt = true;
+                else if (str[i] == U'0')
+                    code.zero = true;
+                else if (str[i] == U'-')
+                    code.left = true;
+                else if (str[i] == U' ')
+                    code.blank = true;
+                else if (str[i] == U'+')
+                    code.plus = true;
+                else
+                    break;
+            }
+            if (i < str.length() && str[i] == U'*') {
+                code.fwStar = true;
+                ++i;
+            } else {
+                parse_number(code.fw);
+            }
+            check_truncated();
+            if (str[i] == U'.') {
+                code.hasPrec = true;
+                ++i;
+                if (i < str.length() && str[i] == U'*') {
+                    code.precStar = true;
+                    ++i;
+                } else {
+                    parse_number(code.prec);
+                }
+            }
+            // Length modifiers are ignored.
+            check_truncated();
+            if (str[i] == U'h' || str[i] == U'l' || str[i] == U'L')
+                ++i;
+            check_truncated();
+            c = str[i++];
+            switch (c) {
+                case U'd':
+                case U'i':
+                case U'u': code.ctype = U'd'; break;
+
+                case U'o':
+                case U'x':
+                case U'e':
+                case U'f':
+                case U'g':
+                case U'c':
+                case U's':
+                case U'%': code.ctype = c; break;
+
+                case U'X':
+                case U'E':
+                case U'F':
+                case U'G':
+                    code.ctype = c - U'A' + U'a';
+                    code.caps = true;
+                    break;
+
+                default:
+                    throw makeError(loc,
+                                    "Unrecognised conversion type: " + encode_utf8(UString(1, c)));
+            }
+            codes.push_back(code);
+        }
+        if (!text.literal.empty())
+            codes.push_back(text);
+
+        std::vector<FormatCode> &entry = formatCodes[str];
+        entry = std::move(codes);
+        return entry;
+    }
+
+    /** Whether the conversion requires a number. */
+    static bool formatNumeric(char32_t ctype)
+    {
+        return ctype == U'd' || ctype == U'o' || ctype == U'x' || ctype == U'f' ||
+               ctype == U'e' || ctype == U'g';
+    }
+
+    /** Add ch to the left of str so that its length is at least w. */
+    static UString formatPadLeft(const UString &str, double w, char32_t ch)
+    {
+        UString r;
+        for (double n = w - str.length(); n > 0; n -= 1)
+            r += ch;
+        return r + str;
+    }
+
+    /** Render a sign and magnitude integer with at least min_chars characters and min_digits
+     * digits, like std.format's render_int.  zero_prefix goes before the digits of non-zero
+     * numbers.
+     */
+    static UString formatInt(bool neg, double mag, double min_chars, double min_digits,
+                             bool blank, bool plus, double radix, const UString &zero_prefix)
+    {
+        UString dec;
+        if (mag == 0) {
+            dec = U"0";
+        } else {
+            // Using the same floating point arithmetic as the Jsonnet version, which matters for
+            // numbers beyond 2^53.
+            for (double n = mag; n != 0; n = std::floor(n / radix))
+                dec += char32_t(U'0' + int(std::fmod(n, radix)));
+            std::reverse(dec.begin(), dec.end());
+            dec = zero_prefix + dec;
+        }
+        double zp = min_chars - (neg || blank || plus ? 1 : 0);
+        double zp2 = zp > min_digits ? zp : min_digits;
+        UString sign = neg ? U"-" : plus ? U"+" : blank ? U" " : U"";
+        return sign + formatPadLeft(dec, zp2, U'0');
+    }
+
+    /** Render an integer in hexadecimal, like std.format's render_hex. */
+    static UString formatHex(double n, double min_chars, double min_digits, bool blank,
+                             bool plus, bool add_zerox, bool caps)
+    {
+        const char32_t *numerals = caps ? U"0123456789ABCDEF" : U"0123456789abcdef";
+        UString hex;
+        double mag = std::floor(std::fabs(n));
+        if (mag == 0) {
+            hex = U"0";
+        } else {
+            for (; mag != 0; mag = std::floor(mag / 16))
+                hex += numerals[int(std::fmod(mag, 16))];
+            std::reverse(hex.begin(), hex.end());
+        }
+        bool neg = n < 0;
+        double zp = min_chars - (neg || blank || plus ? 1 : 0) - (add_zerox ? 2 : 0);
+        double zp2 = zp > min_digits ? zp : min_digits;
+        UString sign = neg ? U"-" : plus ? U"+" : blank ? U" " : U"";
+        UString zerox = add_zerox ? (caps ? U"0X" : U"0x") : U"";
+        return sign + zerox + formatPadLeft(hex, zp2, U'0');
+    }
+
+    /** Render a number in decimal form, like std.format's render_float_dec. */
+    UString formatFloatDec(const LocationRange &loc, double n, double zero_pad, bool blank,
+                           bool plus, bool ensure_pt, bool trailing, double prec)
+    {
+        double whole = std::floor(std::fabs(n));
+        double dot_size = prec == 0 && !ensure_pt ? 0 : 1;
+        double zp = zero_pad - prec - dot_size;
+        UString str = formatInt(n < 0, whole, zp, 0, blank, plus, 10, U"");
+        if (prec == 0)
+            return ensure_pt ? str + U"." : str;
+        double scale = makeNumberCheck(loc, std::pow(10, prec)).v.d;
+        double frac = std::floor((std::fabs(n) - whole) * scale + 0.5);
+        if (!trailing && frac == 0)
+            return str;
+        UString frac_str = formatInt(false, frac, prec, 0, false, false, 10, U"");
+        if (!trailing) {
+            size_t end = frac_str.find_last_not_of(U'0');
+            frac_str.erase(end == UString::npos ? 0 : end + 1);
+        }
+        return str + U"." + frac_str;
+    }
+
+    /** Render a number in scientific form, like std.format's render_float_sci. */
+    UString formatFloatSci(const LocationRange &loc, double n, double zero_pad, bool blank,
+                           bool plus, bool ensure_pt, bool trailing, bool caps, double prec)
+    {
+        double exponent = n == 0 ? 0 : std::floor(std::log(std::fabs(n)) / std::log(10));
+        UString suff = (caps ? U"E" : U"e") +
+                       formatInt(exponent < 0, std::fabs(exponent), 3, 0, false, true, 10, U"");
+        // Avoid a rounding error where 10^-324 is 0, -324 being the smallest exponent possible.
+        double mantissa = exponent == -324 ? n * 10 / std::pow(10, exponent + 1)
+                                           : n / std::pow(10, exponent);
+        double zp2 = zero_pad - suff.length();
+        return formatFloatDec(loc, mantissa, zp2, blank, plus, ensure_pt, trailing, prec) + suff;
+    }
+
+    /** Raise an error unless the value suits the conversion.  at is the index of the value
+     * among the values, or its mapping key.
+     */
+    void formatCheckValue(const LocationRange &loc, const FormatCode &code, const Value &val,
+                          const std::string &at)
+    {
+        if (formatNumeric(code.ctype) && val.t != Value::NUMBER) {
+            throw makeError(loc, "Format required number at " + at + ", got " + type_str(val));
+        }
+    }
+
+    /** Render a value with a conversion other than %%, given its field width and precision.
+     *
+     * This can trigger a garbage collection cycle, the value must be reachable.
+     *
+     * \param prec The precision, or nullptr if not given.
+     */
+    UString formatValue(const LocationRange &loc, const FormatCode &code, const Value &val,
+                        double fw, const Value *prec)
+    {
+        double zp = code.zero && !code.left ? fw : 0;
+        double iprec = 0, fpprec = 6;
+        if (prec != nullptr && prec->t != Value::NULL_TYPE) {
+            if (prec->t != Value::NUMBER) {
+                if (code.ctype == U'd' || code.ctype == U'o' || code.ctype == U'x') {
+                    throw makeError(loc,
+                                    "std.max second param expected number, got " +
+                                        type_str(*prec));
+                }
+                throw makeError(loc,
+                                "binary operator - requires matching types, got number and " +
+                                    type_str(*prec) + ".");
+            }
+            iprec = fpprec = prec->v.d;
+        }
+        double d = val.v.d;
+        switch (code.ctype) {
+            case U's':
+                if (val.t == Value::STRING)
+                    return static_cast<HeapString *>(val.v.h)->value();
+                scratch = val;
+                return toString(loc);
+
+            case U'c':
+                if (val.t == Value::NUMBER) {
+                    builtinChar(loc, {val});
+                    return static_cast<HeapString *>(scratch.v.h)->value();
+                } else if (val.t == Value::STRING) {
+                    auto *str = static_cast<HeapString *>(val.v.h);
+                    if (str->size() != 1) {
+                        throw makeError(
+                            loc,
+                            "%c expected 1-sized string got: " + std::to_string(str->size()));
+                    }
+                    return str->value();
+                }
+                throw makeError(loc, "%c expected number / string, got: " + type_str(val));
+
+            case U'd':
+                return formatInt(d <= -1,
+                                 std::floor(std::fabs(d)),
+                                 zp,
+                                 iprec,
+                                 code.blank,
+                                 code.plus,
+                                 10,
+                                 U"");
+
+            case U'o':
+                return formatInt(d <= -1,
+                                 std::floor(std::fabs(d)),
+                                 zp,
+                                 iprec,
+                                 code.blank,
+                                 code.plus,
+                                 8,
+                                 code.alt ? U"0" : U"");
+
+            case U'x':
+                return formatHex(
+                    std::floor(d), zp, iprec, code.blank, code.plus, code.alt, code.caps);
+
+            case U'f':
+                return formatFloatDec(
+                    loc, d, zp, code.blank, code.plus, code.alt, true, fpprec);
+
+            case U'e':
+                return formatFloatSci(
+                    loc, d, zp, code.blank, code.plus, code.alt, true, code.caps, fpprec);
+
+            case U'g': {
+                double log_d = makeNumberCheck(loc, std::log(std::fabs(d))).v.d;
+                double exponent = std::floor(log_d / std::log(10));
+                if (exponent < -4 || exponent >= fpprec) {
+                    return formatFloatSci(loc,
+                                          d,
+                                          zp,
+                                          code.blank,
+                                          code.plus,
+                                          code.alt,
+                                          code.alt,
+                                          code.caps,
+                                          fpprec - 1);
+                }
+                double digits_before_pt = 1 > exponent + 1 ? 1 : exponent + 1;
+                return formatFloatDec(loc,
+                                      d,
+                                      zp,
+                                      code.blank,
+                                      code.plus,
+                                      code.alt,
+                                      code.alt,
+                                      fpprec - digits_before_pt);
+            }
+        }
+        return U"";  // Quiet, compiler.
+    }
+
+    /** Append the rendered conversion to buf, padded with spaces to the field width. */
+    static void formatAppend(const FormatCode &code, const UString &s, double fw, UString &buf)
+    {
+        if (code.left) {
+            buf += s;
+            for (double n = fw - s.length(); n > 0; n -= 1)
+                buf += U' ';
+        } else {
+            buf += formatPadLeft(s, fw, U' ');
+        }
+    }
+
+    /** The field width taken from the values by %*d. */
+    double formatWidth(const LocationRange &loc, const Value &fw)
+    {
+        if (fw.t != Value::NUMBER) {
+            throw makeError(loc,
+                            "binary operator - requires matching types, got " + type_str(fw) +
+                                " and number.");
+        }
+        return fw.v.d;
+    }
+
+    const AST *builtinFormat(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        // The values can be of any type.
+        validateBuiltinArgs(loc, "format", args, {Value::STRING, args[1].t});
+        const auto &codes = parseFormat(loc, static_cast<HeapString *>(args[0].v.h)->value());
+        UString buf;
+        if (args[1].t == Value::OBJECT) {
+            // Field values stay reachable from the field caches of the object.
+            auto *obj = static_cast<HeapObject *>(args[1].v.h);
+            bool checked_invariants = false;
+            for (const auto &code : codes) {
+                if (code.ctype == 0) {
+                    buf += code.literal;
+                    continue;
+                }
+                if (code.fwStar)
+                    throw makeError(loc, "Cannot use * field width with object.");
+                if (code.ctype == U'%') {
+                    formatAppend(code, U"%", code.fw, buf);
+                    continue;
+                }
+                if (!code.hasKey)
+                    throw makeError(loc, "Mapping keys required.");
+                const Identifier *fid = alloc->makeIdentifier(code.key);
+                unsigned unused_found_at = 0;
+                if (findObject(fid, obj, 0, unused_found_at) == nullptr)
+                    throw makeError(loc, "No such field: " + encode_utf8(code.key));
+                // Like indexing the object, so check its invariants once.
+                if (!checked_invariants) {
+                    runInvariants(loc, obj);
+                    checked_invariants = true;
+                }
+                Value val = evaluateObjectField(loc, obj, fid);
+                formatCheckValue(loc, code, val, encode_utf8(code.key));
+                Value prec = makeNumber(code.prec);
+                if (code.precStar && formatNumeric(code.ctype))
+                    throw makeError(loc, "Cannot use * precision with object.");
+                UString s = formatValue(loc, code, val, code.fw, code.hasPrec ? &prec : nullptr);
+                formatAppend(code, s, code.fw, buf);
+            }
+        } else {
+            // A single value is formatted as if it were the only element of an array.  Forced
+            // elements stay reachable from the array.
+            HeapArray *arr =
+                args[1].t == Value::ARRAY ? static_cast<HeapArray *>(args[1].v.h) : nullptr;
+            size_t size = arr == nullptr ? 1 : arr->size();
+            auto value_at = [&](size_t j) -> Value {
+                return arr == nullptr ? args[1] : forceThunk(loc, arr->at(j));
+            };
+            size_t j = 0;
+            for (const auto &code : codes) {
+                if (code.ctype == 0) {
+                    buf += code.literal;
+                    continue;
+                }
+                double fw = code.fw;
+                if (code.fwStar) {
+                    if (j >= size) {
+                        throw makeError(loc,
+                                        "Not enough values to format: " + std::to_string(size) +
+                                            ", expected at least " + std::to_string(j));
+                    }
+                    fw = formatWidth(loc, value_at(j++));
+                }
+                size_t prec_j = j;
+                if (code.precStar)
+                    j++;
+                if (code.ctype == U'%') {
+                    formatAppend(code, U"%", fw, buf);
+                    continue;
+                }
+                if (j >= size) {
+                    throw makeError(loc,
+                                    "Not enough values to format: " + std::to_string(size) +
+                                        ", expected more than " + std::to_string(j));
+                }
+                Value val = value_at(j);
+                formatCheckValue(loc, code, val, std::to_string(j));
+                j++;
+                Value prec = makeNumber(code.prec);
+                if (code.precStar && formatNumeric(code.ctype))
+                    prec = value_at(prec_j);
+                UString s = formatValue(loc, code, val, fw, code.hasPrec ? &prec : nullptr);
+                formatAppend(code, s, fw, buf);
+            }
+            if (j < size) {
+                throw makeError(loc,
+                                "Too many values to format: " + std::to_string(size) +
+                                    ", expected " + std::to_string(j));
+            }
+        }
+        scratch = makeString(buf);
+        return nullptr;
+    }
+
+    const AST *builtinObjectHasEx(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        validateBuiltinArgs(
+            loc, "objectHasEx", args, {Value::OBJECT, Value::STRING, Value::BOOLEAN});
+        const auto *obj = static_cast<const HeapObject *>(args[0].v.h);
+        const auto *str = static_cast<const HeapString *>(args[1].v.h);
+        bool include_hidden = args[2].v.b;
+        bool found = false;
+        for (const auto &field : objectFields(obj, !include_hidden)) {
+            if (field->name == str->value()) {
+                found = true;
+                break;
+            }
+        }
+        scratch = makeBoolean(found);
+        return nullptr;
+    }
+
+    const AST *builtinLength(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        if (args.size() != 1) {
+            throw makeError(loc, "length takes 1 parameter.");
+        }
+        HeapEntity *e = args[0].v.h;
+        switch (args[0].t) {
+            case Value::OBJECT: {
+                const auto &fields = sortedFields(static_cast<HeapObject *>(e), false);
+                scratch = makeNumber(fields.size());
+            } break;
+
+            case Value::ARRAY:
+                scratch = makeNumber(static_cast<HeapArray *>(e)->size());
+                break;
+
+            case Value::STRING:
+                scratch = makeNumber(static_cast<HeapString *>(e)->size());
+                break;
+
+            case Value::FUNCTION:
+                scratch = makeNumber(static_cast<HeapClosure *>(e)->params.size());
+                break;
+
+            default:
+                throw makeError(loc,
+                                "length operates on strings, objects, "
+                                "and arrays, got " +
+                                    type_str(args[0]));
+        }
+        return nullptr;
+    }
+
+    const AST *builtinObjectFieldsEx(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        validateBuiltinArgs(loc, "objectFieldsEx", args, {Value::OBJECT, Value::BOOLEAN});
+        auto *obj = static_cast<HeapObject *>(args[0].v.h);
+        bool include_hidden = args[1].v.b;
+        const auto &fields = sortedFields(obj, include_hidden);
+        scratch = makeArray({});
+        auto *arr = static_cast<HeapArray *>(scratch.v.h);
+        for (const auto *field : fields) {
+            auto *th = makeHeap<HeapThunk>(idArrayElement, nullptr, 0, nullptr);
+            arr->push_back(th);
+            th->fill(makeString(field->name));
+        }
+        return nullptr;
+    }
+
+    const AST *builtinMergePatch(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        // The target and the patch can be of any type.
+        if (args[1].t != Value::OBJECT) {
+            scratch = args[1];
+            return nullptr;
+        }
+        const AST *site = stack.top().ast;
+        // The builtin itself, for merging nested objects.  It stays reachable from the frame.
+        Value merge_patch = stack.top().val;
+        auto *patch = static_cast<HeapObject *>(args[1].v.h);
+        const auto &patch_fields = sortedFields(patch, false);
+        // Fields that are null in the patch are removed, so every field of the patch is
+        // evaluated.  The values stay reachable from the field cache of the patch.
+        if (patch_fields.size() > 0)
+            runInvariants(loc, patch);
+        std::vector<Value> patch_values;
+        for (const auto *f : patch_fields)
+            patch_values.push_back(evaluateObjectField(loc, patch, f));
+
+        const std::vector<const Identifier *> no_fields;
+        auto *target =
+            args[0].t == Value::OBJECT ? static_cast<HeapObject *>(args[0].v.h) : nullptr;
+        const auto &target_fields = target == nullptr ? no_fields : sortedFields(target, false);
+        // The fields of the result are evaluated lazily, like those of an object comprehension.
+        scratch = makeObject<HeapComprehensionObject>(
+            BindingFrame{}, jsonObjVar, idJsonObjVar, std::map<const Identifier *, HeapThunk *>{});
+        auto *obj = static_cast<HeapComprehensionObject *>(scratch.v.h);
+        size_t i = 0, j = 0;
+        while (i < target_fields.size() || j < patch_fields.size()) {
+            if (j == patch_fields.size() ||
+                (i < target_fields.size() && target_fields[i]->name < patch_fields[j]->name)) {
+                HeapThunk *th = makeIndexThunk(site, args[0], target_fields[i]);
+                obj->compValues[target_fields[i]] = th;
+                i++;
+                continue;
+            }
+            bool in_target =
+                i < target_fields.size() && target_fields[i]->name == patch_fields[j]->name;
+            const Identifier *f = patch_fields[j];
+            const Value &v = patch_values[j];
+            if (v.t == Value::NULL_TYPE) {
+                // The field is removed.
+            } else if (in_target || v.t == Value::OBJECT) {
+                // Like a call to std.mergePatch, the field of the target is evaluated even if
+                // the patch replaces it.
+                HeapThunk *target_value = in_target
+                                              ? makeIndexThunk(site, args[0], target_fields[i])
+                                              : makeValueThunk(makeNull());
+                HeapThunk *patch_value = makeValueThunk(v);
+                HeapThunk *th =
+                    makeCallThunk(site, f, merge_patch, {target_value, patch_value});
+                obj->compValues[f] = th;
+            } else {
+                HeapThunk *th = makeValueThunk(v);
+                obj->compValues[f] = th;
+            }
+            if (in_target)
+                i++;
+            j++;
+        }
+        return nullptr;
+    }
+
+    /** Whether a value is kept by std.prune. */
+    bool isContent(const Value &v)
+    {
+        switch (v.t) {
+            case Value::NULL_TYPE: return false;
+            case Value::ARRAY: return static_cast<HeapArray *>(v.v.h)->size() > 0;
+            case Value::OBJECT:
+                return sortedFields(static_cast<HeapObject *>(v.v.h), false).size() > 0;
+            default: return true;
+        }
+    }
+
+    /** Remove the nulls, empty arrays and empty objects from a value recursively, like
+     * std.prune.  Every element and field is evaluated.
+     *
+     * This can trigger a garbage collection cycle, so the value must be reachable.
+     *
+     * \returns A thunk holding the result, which is kept reachable via the top frame's thunks.
+     */
+    HeapThunk *pruneValue(const LocationRange &loc, const Value &v)
+    {
+        switch (v.t) {
+            case Value::ARRAY: {
+                auto *arr = static_cast<HeapArray *>(v.v.h);
+                std::vector<HeapThunk *> elements;
+                for (size_t i = 0; i < arr->size(); ++i) {
+                    HeapThunk *th = pruneValue(loc, forceThunk(loc, arr->at(i)));
+                    if (isContent(th->content))
+                        elements.push_back(th);
+                }
+                // Make the thunk first, so the array is reachable as soon as it is made.
+                auto *th = makeValueThunk(makeNull());
+                th->content = makeArray(elements);
+                return th;
+            }
+
+            case Value::OBJECT: {
+                auto *obj = static_cast<HeapObject *>(v.v.h);
+                // The field list is cached in the object, so it stays valid.
+                const auto &fields = sortedFields(obj, false);
+                if (fields.size() > 0)
+                    runInvariants(loc, obj);
+                // The fields are filled in as they are pruned, like in jsonToHeap.
+                auto *th = makeValueThunk(makeNull());
+                th->content = makeObject<HeapComprehensionObject>(
+                    BindingFrame{},
+                    jsonObjVar,
+                    idJsonObjVar,
+                    std::map<const Identifier *, HeapThunk *>{});
+                auto *r = static_cast<HeapComprehensionObject *>(th->content.v.h);
+                for (const auto *f : fields) {
+                    // The value stays reachable from the field cache of the object.
+                    HeapThunk *field = pruneValue(loc, evaluateObjectField(loc, obj, f));
+                    if (isContent(field->content))
+                        r->compValues[f] = field;
+                }
+                return th;
+            }
+
+            default: return makeValueThunk(v);
+        }
+    }
+
+    const AST *builtinPrune(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        // The value can be of any type.
+        scratch = pruneValue(loc, args[0])->content;
+        return nullptr;
+    }
+
+    const AST *builtinCodepoint(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        validateBuiltinArgs(loc, "codepoint", args, {Value::STRING});
+        const UString &str = static_cast<HeapString *>(args[0].v.h)->value();
+        if (str.length() != 1) {
+            std::stringstream ss;
+            ss << "codepoint takes a string of length 1, got length " << str.length();
+            throw makeError(loc, ss.str());
+        }
+        char32_t c = static_cast<HeapString *>(args[0].v.h)->value()[0];
+        scratch = makeNumber((unsigned long)(c));
+        return nullptr;
+    }
+
+    const AST *builtinChar(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        validateBuiltinArgs(loc, "char", args, {Value::NUMBER});
+        long l = long(args[0].v.d);
+        if (l < 0) {
+            std::stringstream ss;
+            ss << "codepoints must be >= 0, got " << l;
+            throw makeError(loc, ss.str());
+        }
+        if (l >= JSONNET_CODEPOINT_MAX) {
+            std::stringstream ss;
+            ss << "invalid unicode codepoint, got " << l;
+            throw makeError(loc, ss.str());
+        }
+        char32_t c = l;
+        scratch = makeString(UString(&c, 1));
+        return nullptr;
+    }
+
+    const AST *builtinLog(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        validateBuiltinArgs(loc, "log", args, {Value::NUMBER});
+        scratch = makeNumberCheck(loc, std::log(args[0].v.d));
+        return nullptr;
+    }
+
+    const AST *builtinExp(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        validateBuiltinArgs(loc, "exp", args, {Value::NUMBER});
+        scratch = makeNumberCheck(loc, std::exp(args[0].v.d));
+        return nullptr;
+    }
+
+    const AST *builtinMantissa(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        validateBuiltinArgs(loc, "mantissa", args, {Value::NUMBER});
+        int exp;
+        double m = std::frexp(args[0].v.d, &exp);
+        scratch = makeNumberCheck(loc, m);
+        return nullptr;
+    }
+
+    const AST *builtinExponent(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        validateBuiltinArgs(loc, "exponent", args, {Value::NUMBER});
+        int exp;
+        std::frexp(args[0].v.d, &exp);
+        scratch = makeNumberCheck(loc, exp);
+        return nullptr;
+    }
+
+    const AST *builtinModulo(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        validateBuiltinArgs(loc, "modulo", args, {Value::NUMBER, Value::NUMBER});
+        double a = args[0].v.d;
+        double b = args[1].v.d;
+        if (b == 0)
+            throw makeError(loc, "division by zero.");
+        scratch = makeNumberCheck(loc, std::fmod(a, b));
+        return nullptr;
+    }
+
+    const AST *builtinExtVar(const LocationRange &loc, const std::vector<Value> &args)
     {
         validateBuiltinArgs(loc, "extVar", args, {Value::STRING});
-        const UString &var = static_cast<HeapString *>(args[0].v.h)->value;
+        const UString &var = static_cast<HeapString *>(args[0].v.h)->value();
         std::string var8 = encode_utf8(var);
         auto it = externalVars.find(var8);
         if (it == externalVars.end()) {
@@ -1239,13 +2970,21 @@ class Interpreter {
         }
         const VmExt &ext = it->second;
         if (ext.isCode) {
-            std::string filename = "<extvar:" + var8 + ">";
-            Tokens tokens = jsonnet_lex(filename, ext.data.c_str());
-            AST *expr = jsonnet_parse(alloc, tokens);
-            jsonnet_desugar(alloc, expr, nullptr);
-            jsonnet_static_analysis(expr);
+            HeapThunk *thunk;
+            auto cached = cachedExtCodes.find(var8);
+            if (cached == cachedExtCodes.end()) {
+                thunk = makeFileThunk(nullptr, "<extvar:" + var8 + ">", ext.data);
+                cachedExtCodes[var8] = thunk;
+            } else {
+                thunk = cached->second;
+            }
+            if (thunk->filled) {
+                scratch = thunk->content;
+                return nullptr;
+            }
             stack.pop();
-            return expr;
+            stack.newCall(loc, thunk, thunk->self, thunk->offset, thunk->upValues);
+            return thunk->body;
         } else {
             scratch = makeString(decode_utf8(ext.data));
             return nullptr;
@@ -1270,8 +3009,8 @@ class Interpreter {
             case Value::NUMBER: r = args[0].v.d == args[1].v.d; break;
 
             case Value::STRING:
-                r = static_cast<HeapString *>(args[0].v.h)->value ==
-                    static_cast<HeapString *>(args[1].v.h)->value;
+                r = static_cast<HeapString *>(args[0].v.h)->value() ==
+                    static_cast<HeapString *>(args[1].v.h)->value();
                 break;
 
             case Value::NULL_TYPE: r = true; break;
@@ -1288,18 +3027,26 @@ class Interpreter {
         return nullptr;
     }
 
+    const AST *builtinEquals(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        // The values can be of any type, and stay reachable via the frame's thunks.
+        scratch = makeBoolean(equalValues(loc, args[0], args[1]));
+        return nullptr;
+    }
+
     const AST *builtinNative(const LocationRange &loc, const std::vector<Value> &args)
     {
         validateBuiltinArgs(loc, "native", args, {Value::STRING});
 
-        std::string builtin_name = encode_utf8(static_cast<HeapString *>(args[0].v.h)->value);
+        std::string builtin_name = encode_utf8(static_cast<HeapString *>(args[0].v.h)->value());
 
         VmNativeCallbackMap::const_iterator nit = nativeCallbacks.find(builtin_name);
         if (nit == nativeCallbacks.end()) {
             scratch = makeNull();
         } else {
             const VmNativeCallback &cb = nit->second;
-            scratch = makeNativeBuiltin(builtin_name, cb.params);
+            unsigned long builtin = builtins.size() + std::distance(nativeCallbacks.cbegin(), nit);
+            scratch = makeNativeBuiltin(builtin_name, builtin, cb.params);
         }
         return nullptr;
     }
@@ -1308,7 +3055,7 @@ class Interpreter {
     {
         validateBuiltinArgs(loc, "md5", args, {Value::STRING});
 
-        std::string value = encode_utf8(static_cast<HeapString *>(args[0].v.h)->value);
+        std::string value = encode_utf8(static_cast<HeapString *>(args[0].v.h)->value());
 
         scratch = makeString(decode_utf8(md5(value)));
         return nullptr;
@@ -1318,13 +3065,13 @@ class Interpreter {
     {
         validateBuiltinArgs(loc, "encodeUTF8", args, {Value::STRING});
 
-        std::string byteString = encode_utf8(static_cast<HeapString *>(args[0].v.h)->value);
+        std::string byteString = encode_utf8(static_cast<HeapString *>(args[0].v.h)->value());
 
         scratch = makeArray({});
-        auto &elements = static_cast<HeapArray *>(scratch.v.h)->elements;
+        auto *arr = static_cast<HeapArray *>(scratch.v.h);
         for (const auto c : byteString) {
             auto *th = makeHeap<HeapThunk>(idArrayElement, nullptr, 0, nullptr);
-            elements.push_back(th);
+            arr->push_back(th);
             th->fill(makeNumber(uint8_t(c)));
         }
         return nullptr;
@@ -1333,9 +3080,9 @@ class Interpreter {
     const AST *decodeUTF8(void)
     {
         Frame &f = stack.top();
-        const auto& elements = static_cast<HeapArray*>(f.val.v.h)->elements;
-        while (f.elementId < elements.size()) {
-            auto *th = elements[f.elementId];
+        const auto *arr = static_cast<HeapArray*>(f.val.v.h);
+        while (f.elementId < arr->size()) {
+            auto *th = arr->at(f.elementId);
             if (th->filled) {
                 auto b = th->content;
                 if (b.t != Value::NUMBER) {
@@ -1373,6 +3120,77 @@ class Interpreter {
         return decodeUTF8();
     }
 
+    const AST *builtinSlice(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        const Value &indexable = args[0];
+        if (indexable.t != Value::STRING && indexable.t != Value::ARRAY) {
+            throw makeError(loc,
+                            "std.slice accepts a string or an array, but got: " +
+                                type_str(indexable));
+        }
+        double length = indexable.t == Value::STRING
+                            ? static_cast<HeapString *>(indexable.v.h)->size()
+                            : static_cast<HeapArray *>(indexable.v.h)->size();
+        double bounds[] = {0, length, 1};
+        const char *names[] = {"index", "end", "step"};
+        for (unsigned i = 0; i < 3; ++i) {
+            const Value &v = args[i + 1];
+            if (v.t == Value::NULL_TYPE)
+                continue;
+            if (v.t != Value::NUMBER) {
+                throw makeError(loc,
+                                std::string("std.slice ") + names[i] + " must be a number, got " +
+                                    type_str(v));
+            }
+            bounds[i] = v.v.d;
+        }
+        double index = bounds[0], end = bounds[1], step = bounds[2];
+        if (index < 0 || end < 0 || step < 0) {
+            throw makeError(loc,
+                            "got [" + jsonnet_unparse_number(index) + ":" +
+                                jsonnet_unparse_number(end) + ":" + jsonnet_unparse_number(step) +
+                                "] but negative index, end, and steps are not supported");
+        }
+        if (step == 0) {
+            throw makeError(loc, "got 0 but step must be greater than 0");
+        }
+        double to = std::min(end, length);
+
+        if (indexable.t == Value::STRING) {
+            const UString &str = static_cast<HeapString *>(indexable.v.h)->value();
+            UString r;
+            for (double cur = index; cur < to; cur += step)
+                r += str[size_t(cur)];
+            scratch = makeString(r);
+            return nullptr;
+        }
+
+        auto *arr = static_cast<HeapArray *>(indexable.v.h);
+        if (step == 1 && index == std::floor(index)) {
+            // A contiguous range, which can share the elements of the array.
+            to = std::ceil(to);
+            if (index >= to) {
+                scratch = makeArray({});
+            } else {
+                auto *view = makeHeap<HeapArray>(arr, size_t(index), size_t(to - index));
+                scratch.t = Value::ARRAY;
+                scratch.v.h = view;
+            }
+            return nullptr;
+        }
+        std::vector<HeapThunk *> elements;
+        for (double cur = index; cur < to; cur += step) {
+            if (cur != std::floor(cur)) {
+                std::stringstream ss;
+                ss << "array index was not integer: " << cur;
+                throw makeError(loc, ss.str());
+            }
+            elements.push_back(arr->at(size_t(cur)));
+        }
+        scratch = makeArray(elements);
+        return nullptr;
+    }
+
     const AST *builtinTrace(const LocationRange &loc, const std::vector<Value> &args)
     {
         if(args[0].t != Value::STRING) {
@@ -1382,8 +3200,8 @@ class Interpreter {
             throw makeError(loc, ss.str());
         }
 
-        std::string str = encode_utf8(static_cast<HeapString *>(args[0].v.h)->value);
-        std::cerr << "TRACE: " << loc.file << ":" << loc.begin.line << " " <<  str
+        std::string str = encode_utf8(static_cast<HeapString *>(args[0].v.h)->value());
+        std::cerr << "TRACE: " << loc.fileName() << ":" << loc.begin.line << " " <<  str
             << std::endl;
 
         scratch = args[1];
@@ -1395,17 +3213,44 @@ class Interpreter {
         validateBuiltinArgs(loc, "splitLimit", args, {Value::STRING, Value::STRING, Value::NUMBER});
         const auto *str = static_cast<const HeapString *>(args[0].v.h);
         const auto *c = static_cast<const HeapString *>(args[1].v.h);
-        long maxsplits = long(args[2].v.d);
+        splitLimit(str, c, long(args[2].v.d));
+        return nullptr;
+    }
+
+    const AST *builtinSplit(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        if (args[0].t != Value::STRING) {
+            throw makeError(
+                loc, "std.split first parameter should be a string, got " + type_str(args[0]));
+        }
+        if (args[1].t != Value::STRING) {
+            throw makeError(
+                loc, "std.split second parameter should be a string, got " + type_str(args[1]));
+        }
+        const auto *str = static_cast<const HeapString *>(args[0].v.h);
+        const auto *c = static_cast<const HeapString *>(args[1].v.h);
+        if (c->size() != 1) {
+            throw makeError(loc,
+                            "std.split second parameter should have length 1, got " +
+                                std::to_string(c->size()));
+        }
+        splitLimit(str, c, -1);
+        return nullptr;
+    }
+
+    /** Split str at the character c at most maxsplits times, or without limit if -1. */
+    void splitLimit(const HeapString *str, const HeapString *c, long maxsplits)
+    {
         unsigned start = 0;
         unsigned test = 0;
         scratch = makeArray({});
-        auto &elements = static_cast<HeapArray *>(scratch.v.h)->elements;
-        while (test < str->value.size() && (maxsplits == -1 ||
-                                            size_t(maxsplits) > elements.size())) {
-            if (c->value[0] == str->value[test]) {
+        auto *arr = static_cast<HeapArray *>(scratch.v.h);
+        while (test < str->value().size() && (maxsplits == -1 ||
+                                            size_t(maxsplits) > arr->size())) {
+            if (c->value()[0] == str->value()[test]) {
                 auto *th = makeHeap<HeapThunk>(idArrayElement, nullptr, 0, nullptr);
-                elements.push_back(th);
-                th->fill(makeString(str->value.substr(start, test - start)));
+                arr->push_back(th);
+                th->fill(makeString(str->value().substr(start, test - start)));
                 start = test + 1;
                 test = start;
             } else {
@@ -1413,10 +3258,8 @@ class Interpreter {
             }
         }
         auto *th = makeHeap<HeapThunk>(idArrayElement, nullptr, 0, nullptr);
-        elements.push_back(th);
-        th->fill(makeString(str->value.substr(start)));
-
-        return nullptr;
+        arr->push_back(th);
+        th->fill(makeString(str->value().substr(start)));
     }
 
     const AST *builtinSubstr(const LocationRange &loc, const std::vector<Value> &args)
@@ -1435,14 +3278,14 @@ class Interpreter {
             ss << "substr third parameter should be greater than zero, got " << len;
             throw makeError(loc, ss.str());
         }
-        if (static_cast<unsigned long>(from) > str->value.size()) {
+        if (static_cast<unsigned long>(from) > str->value().size()) {
             scratch = makeString(UString());
             return nullptr;
         }
-        if (size_t(len + from) > str->value.size()) {
-          len = str->value.size() - from;
+        if (size_t(len + from) > str->value().size()) {
+          len = str->value().size() - from;
         }
-        scratch = makeString(str->value.substr(from, len));
+        scratch = makeString(str->value().substr(from, len));
         return nullptr;
     }
 
@@ -1454,10 +3297,10 @@ class Interpreter {
         long len = to - from + 1;
         scratch = makeArray({});
         if (len > 0) {
-            auto &elements = static_cast<HeapArray *>(scratch.v.h)->elements;
+            auto *arr = static_cast<HeapArray *>(scratch.v.h);
             for (int i = 0; i < len; ++i) {
                 auto *th = makeHeap<HeapThunk>(idArrayElement, nullptr, 0, nullptr);
-                elements.push_back(th);
+                arr->push_back(th);
                 th->fill(makeNumber(from + i));
             }
         }
@@ -1470,18 +3313,18 @@ class Interpreter {
         const auto *str = static_cast<const HeapString *>(args[0].v.h);
         const auto *from = static_cast<const HeapString *>(args[1].v.h);
         const auto *to = static_cast<const HeapString *>(args[2].v.h);
-        if (from->value.empty()) {
+        if (from->value().empty()) {
           throw makeError(loc, "'from' string must not be zero length.");
         }
-        UString new_str(str->value);
+        UString new_str(str->value());
         UString::size_type pos = 0;
         while (pos < new_str.size()) {
-            auto index = new_str.find(from->value, pos);
+            auto index = new_str.find(from->value(), pos);
             if (index == new_str.npos) {
                 break;
             }
-            new_str.replace(index, from->value.size(), to->value);
-            pos = index + to->value.size();
+            new_str.replace(index, from->value().size(), to->value());
+            pos = index + to->value().size();
         }
         scratch = makeString(new_str);
         return nullptr;
@@ -1491,7 +3334,7 @@ class Interpreter {
     {
         validateBuiltinArgs(loc, "asciiLower", args, {Value::STRING});
         const auto *str = static_cast<const HeapString *>(args[0].v.h);
-        UString new_str(str->value);
+        UString new_str(str->value());
         for (size_t i = 0; i < new_str.size(); ++i) {
             if (new_str[i] >= 'A' && new_str[i] <= 'Z') {
                 new_str[i] = new_str[i] - 'A' + 'a';
@@ -1505,7 +3348,7 @@ class Interpreter {
     {
         validateBuiltinArgs(loc, "asciiUpper", args, {Value::STRING});
         const auto *str = static_cast<const HeapString *>(args[0].v.h);
-        UString new_str(str->value);
+        UString new_str(str->value());
         for (size_t i = 0; i < new_str.size(); ++i) {
             if (new_str[i] >= 'a' && new_str[i] <= 'z') {
                 new_str[i] = new_str[i] - 'a' + 'A';
@@ -1515,11 +3358,347 @@ class Interpreter {
         return nullptr;
     }
 
+    const AST *builtinStartsWith(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        validateBuiltinArgs(loc, "startsWith", args, {Value::STRING, Value::STRING});
+        const UString &a = static_cast<HeapString *>(args[0].v.h)->value();
+        const UString &b = static_cast<HeapString *>(args[1].v.h)->value();
+        scratch = makeBoolean(a.length() >= b.length() && a.compare(0, b.length(), b) == 0);
+        return nullptr;
+    }
+
+    const AST *builtinEndsWith(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        validateBuiltinArgs(loc, "endsWith", args, {Value::STRING, Value::STRING});
+        const UString &a = static_cast<HeapString *>(args[0].v.h)->value();
+        const UString &b = static_cast<HeapString *>(args[1].v.h)->value();
+        scratch = makeBoolean(a.length() >= b.length() &&
+                              a.compare(a.length() - b.length(), b.length(), b) == 0);
+        return nullptr;
+    }
+
+    /** Strip the given characters from either end of a string.  Like std.member, the characters
+     * are given as a string or as an array of single character strings.
+     */
+    const AST *stripChars(const LocationRange &loc, const std::string &name,
+                          const std::vector<Value> &args, bool left, bool right)
+    {
+        // The characters are checked below.
+        validateBuiltinArgs(loc, name, args, {Value::STRING, args[1].t});
+        const UString &str = static_cast<HeapString *>(args[0].v.h)->value();
+        if (str.empty()) {
+            scratch = args[0];
+            return nullptr;
+        }
+        std::set<char32_t> chars;
+        if (args[1].t == Value::STRING) {
+            const UString &s = static_cast<HeapString *>(args[1].v.h)->value();
+            chars.insert(s.begin(), s.end());
+        } else if (args[1].t == Value::ARRAY) {
+            // Forced elements stay reachable from the array.
+            auto *arr = static_cast<HeapArray *>(args[1].v.h);
+            for (size_t i = 0; i < arr->size(); ++i) {
+                const Value &v = forceThunk(loc, arr->at(i));
+                if (v.t == Value::STRING && static_cast<HeapString *>(v.v.h)->size() == 1)
+                    chars.insert(static_cast<HeapString *>(v.v.h)->value()[0]);
+            }
+        } else {
+            throw makeError(loc, "std.member first argument must be an array or a string");
+        }
+        size_t begin = 0, end = str.length();
+        while (left && begin < end && chars.count(str[begin]) > 0)
+            ++begin;
+        while (right && begin < end && chars.count(str[end - 1]) > 0)
+            --end;
+        if (begin == 0 && end == str.length())
+            scratch = args[0];
+        else
+            scratch = makeString(str.substr(begin, end - begin));
+        return nullptr;
+    }
+
+    const AST *builtinLstripChars(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        return stripChars(loc, "lstripChars", args, true, false);
+    }
+
+    const AST *builtinRstripChars(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        return stripChars(loc, "rstripChars", args, false, true);
+    }
+
+    const AST *builtinStripChars(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        return stripChars(loc, "stripChars", args, true, true);
+    }
+
+    /** Parse a natural number written in the given base, with letters for digits above 9. */
+    double parseNat(const LocationRange &loc, const UString &str, int base)
+    {
+        double r = 0;
+        for (char32_t c : str) {
+            double digit = c >= U'a' ? double(c) - U'a' + 10
+                                     : c >= U'A' ? double(c) - U'A' + 10 : double(c) - U'0';
+            if (digit < 0 || digit >= base) {
+                std::stringstream ss;
+                ss << encode_utf8(str) << " is not a base " << base << " integer";
+                throw makeError(loc, ss.str());
+            }
+            r = makeNumberCheck(loc, base * r + digit).v.d;
+        }
+        return r;
+    }
+
+    /** Check the argument of std.parseInt and friends, and return the string. */
+    const UString &parseArg(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        if (args[0].t != Value::STRING)
+            throw makeError(loc, "Expected string, got " + type_str(args[0]));
+        return static_cast<HeapString *>(args[0].v.h)->value();
+    }
+
+    const AST *builtinParseInt(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        const UString &str = parseArg(loc, args);
+        if (str.empty() || str == U"-")
+            throw makeError(loc, "Not an integer: \"" + encode_utf8(str) + "\"");
+        if (str[0] == U'-')
+            scratch = makeNumber(-parseNat(loc, str.substr(1), 10));
+        else
+            scratch = makeNumber(parseNat(loc, str, 10));
+        return nullptr;
+    }
+
+    const AST *builtinParseOctal(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        const UString &str = parseArg(loc, args);
+        if (str.empty())
+            throw makeError(loc, "Not an octal number: \"\"");
+        scratch = makeNumber(parseNat(loc, str, 8));
+        return nullptr;
+    }
+
+    const AST *builtinParseHex(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        const UString &str = parseArg(loc, args);
+        if (str.empty())
+            throw makeError(loc, "Not hexadecimal: \"\"");
+        scratch = makeNumber(parseNat(loc, str, 16));
+        return nullptr;
+    }
+
+    /** The string to escape: the argument itself, or its JSON form if it is not a string.
+     *
+     * This can trigger a garbage collection cycle.
+     */
+    UString escapeArg(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        if (args[0].t == Value::STRING)
+            return static_cast<HeapString *>(args[0].v.h)->value();
+        scratch = args[0];
+        return toString(loc);
+    }
+
+    const AST *builtinEscapeStringJson(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        scratch = makeString(jsonnet_string_unparse(escapeArg(loc, args), false));
+        return nullptr;
+    }
+
+    const AST *builtinEscapeStringPython(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        return builtinEscapeStringJson(loc, args);
+    }
+
+    const AST *builtinEscapeStringBash(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        UString str = escapeArg(loc, args);
+        UString r = U"'";
+        for (char32_t c : str) {
+            if (c == U'\'')
+                r += U"'\"'\"'";
+            else
+                r += c;
+        }
+        r += U"'";
+        scratch = makeString(r);
+        return nullptr;
+    }
+
+    const AST *builtinEscapeStringDollars(const LocationRange &loc,
+                                          const std::vector<Value> &args)
+    {
+        UString str = escapeArg(loc, args);
+        UString r;
+        for (char32_t c : str) {
+            if (c == U'$')
+                r += U"$$";
+            else
+                r += c;
+        }
+        scratch = makeString(r);
+        return nullptr;
+    }
+
+    const AST *builtinBase64(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        static const char32_t *table =
+            U"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/";
+        std::vector<int64_t> bytes;
+        bool sane = true;
+        if (args[0].t == Value::STRING) {
+            for (char32_t c : static_cast<HeapString *>(args[0].v.h)->value()) {
+                sane = sane && c < 256;
+                bytes.push_back(c);
+            }
+        } else if (args[0].t == Value::ARRAY) {
+            // Forced elements stay reachable from the array.
+            auto *arr = static_cast<HeapArray *>(args[0].v.h);
+            for (size_t i = 0; i < arr->size(); ++i) {
+                const Value &v = forceThunk(loc, arr->at(i));
+                if (v.t != Value::NUMBER) {
+                    throw makeError(loc,
+                                    "binary operator < requires matching types, got " +
+                                        type_str(v) + " and number.");
+                }
+                sane = sane && v.v.d < 256;
+                bytes.push_back(v.v.d);
+            }
+        } else {
+            throw makeError(loc, "base64 only takes strings and arrays, got " + type_str(args[0]));
+        }
+        if (!sane)
+            throw makeError(loc, "Can only base64 encode strings / arrays of single bytes.");
+
+        UString r;
+        for (size_t i = 0; i < bytes.size(); i += 3) {
+            // 6 MSB of i
+            r += table[(bytes[i] & 252) >> 2];
+            if (i + 1 >= bytes.size()) {
+                // 2 LSB of i
+                r += table[(bytes[i] & 3) << 4];
+                r += U"==";
+            } else if (i + 2 >= bytes.size()) {
+                // 2 LSB of i, 4 MSB of i+1
+                r += table[(bytes[i] & 3) << 4 | (bytes[i + 1] & 240) >> 4];
+                // 4 LSB of i+1
+                r += table[(bytes[i + 1] & 15) << 2];
+                r += U"=";
+            } else {
+                // 2 LSB of i, 4 MSB of i+1
+                r += table[(bytes[i] & 3) << 4 | (bytes[i + 1] & 240) >> 4];
+                // 4 LSB of i+1, 2 MSB of i+2
+                r += table[(bytes[i + 1] & 15) << 2 | (bytes[i + 2] & 192) >> 6];
+                // 6 LSB of i+2
+                r += table[bytes[i + 2] & 63];
+            }
+        }
+        scratch = makeString(r);
+        return nullptr;
+    }
+
+    /** Decode a base64 string to bytes.  Padding is only recognized in the last two characters
+     * of each group of four.
+     */
+    std::vector<int> base64DecodeBytes(const LocationRange &loc, const std::string &name,
+                                       const std::vector<Value> &args)
+    {
+        static const UString table =
+            U"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/";
+        validateBuiltinArgs(loc, name, args, {Value::STRING});
+        const UString &str = static_cast<HeapString *>(args[0].v.h)->value();
+        if (str.length() % 4 != 0)
+            throw makeError(loc, "Not a base64 encoded string \"" + encode_utf8(str) + "\"");
+        auto inv = [&](char32_t c) {
+            size_t i = table.find(c);
+            if (i == UString::npos)
+                throw makeError(loc, "field does not exist: " + encode_utf8(UString(1, c)));
+            return int(i);
+        };
+        std::vector<int> bytes;
+        for (size_t i = 0; i < str.length(); i += 4) {
+            // all 6 bits of i, 2 MSB of i+1
+            bytes.push_back(inv(str[i]) << 2 | inv(str[i + 1]) >> 4);
+            // 4 LSB of i+1, 4MSB of i+2
+            if (str[i + 2] != U'=')
+                bytes.push_back((inv(str[i + 1]) & 15) << 4 | inv(str[i + 2]) >> 2);
+            // 2 LSB of i+2, all 6 bits of i+3
+            if (str[i + 3] != U'=')
+                bytes.push_back((inv(str[i + 2]) & 3) << 6 | inv(str[i + 3]));
+        }
+        return bytes;
+    }
+
+    const AST *builtinBase64DecodeBytes(const LocationRange &loc,
+                                        const std::vector<Value> &args)
+    {
+        std::vector<int> bytes = base64DecodeBytes(loc, "base64DecodeBytes", args);
+        scratch = makeArray({});
+        auto *arr = static_cast<HeapArray *>(scratch.v.h);
+        for (int b : bytes) {
+            auto *th = makeHeap<HeapThunk>(idArrayElement, nullptr, 0, nullptr);
+            arr->push_back(th);
+            th->fill(makeNumber(b));
+        }
+        return nullptr;
+    }
+
+    const AST *builtinBase64Decode(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        std::vector<int> bytes = base64DecodeBytes(loc, "base64Decode", args);
+        scratch = makeString(UString(bytes.begin(), bytes.end()));
+        return nullptr;
+    }
+
+    const AST *builtinFindSubstr(const LocationRange &loc, const std::vector<Value> &args)
+    {
+        if (args[0].t != Value::STRING) {
+            throw makeError(
+                loc, "findSubstr first parameter should be a string, got " + type_str(args[0]));
+        }
+        if (args[1].t != Value::STRING) {
+            throw makeError(
+                loc, "findSubstr second parameter should be a string, got " + type_str(args[1]));
+        }
+        const UString &pat = static_cast<HeapString *>(args[0].v.h)->value();
+        const UString &str = static_cast<HeapString *>(args[1].v.h)->value();
+        std::vector<size_t> found;
+        if (!pat.empty()) {
+            // Knuth-Morris-Pratt, so that the search is linear even with many partial matches.
+            std::vector<size_t> fail(pat.length() + 1, 0);
+            for (size_t i = 1, k = 0; i < pat.length(); ++i) {
+                while (k > 0 && pat[i] != pat[k])
+                    k = fail[k];
+                if (pat[i] == pat[k])
+                    ++k;
+                fail[i + 1] = k;
+            }
+            for (size_t i = 0, k = 0; i < str.length(); ++i) {
+                while (k > 0 && str[i] != pat[k])
+                    k = fail[k];
+                if (str[i] == pat[k])
+                    ++k;
+                if (k == pat.length()) {
+                    found.push_back(i + 1 - k);
+                    k = fail[k];
+                }
+            }
+        }
+        scratch = makeArray({});
+        auto *arr = static_cast<HeapArray *>(scratch.v.h);
+        for (size_t i : found) {
+            auto *th = makeHeap<HeapThunk>(idArrayElement, nullptr, 0, nullptr);
+            arr->push_back(th);
+            th->fill(makeNumber(i));
+        }
+        return nullptr;
+    }
+
     const AST *builtinParseJson(const LocationRange &loc, const std::vector<Value> &args)
     {
         validateBuiltinArgs(loc, "parseJson", args, {Value::STRING});
 
-        std::string value = encode_utf8(static_cast<HeapString *>(args[0].v.h)->value);
+        std::string value = encode_utf8(static_cast<HeapString *>(args[0].v.h)->value());
 
         auto j = json::parse(value);
 
@@ -1561,14 +3740,15 @@ class Interpreter {
                 filled = true;
                 auto *arr = static_cast<HeapArray *>(attach.v.h);
                 for (size_t i = 0; i < v.size(); ++i) {
-                    arr->elements.push_back(makeHeap<HeapThunk>(idArrayElement, nullptr, 0, nullptr));
-                    otherJsonToHeap(v[i], arr->elements[i]->filled, arr->elements[i]->content);
+                    arr->push_back(makeHeap<HeapThunk>(idArrayElement, nullptr, 0, nullptr));
+                    otherJsonToHeap(v[i], arr->at(i)->filled, arr->at(i)->content);
                 }
             } break;
 
             case json::value_t::object: {
                 attach = makeObject<HeapComprehensionObject>(
-                    BindingFrame{}, jsonObjVar, idJsonObjVar, BindingFrame{});
+                    BindingFrame{}, jsonObjVar, idJsonObjVar,
+                    std::map<const Identifier *, HeapThunk *>{});
                 filled = true;
                 auto *obj = static_cast<HeapComprehensionObject *>(attach.v.h);
                 for (auto it = v.begin(); it != v.end(); ++it) {
@@ -1595,18 +3775,18 @@ class Interpreter {
             throw makeError(stack.top().location, ss.str());
         }
         if (!first) {
-            running.append(static_cast<HeapString *>(sep.v.h)->value);
+            running.append(static_cast<HeapString *>(sep.v.h)->value());
         }
         first = false;
-        running.append(static_cast<HeapString *>(elt.v.h)->value);
+        running.append(static_cast<HeapString *>(elt.v.h)->value());
     }
 
     const AST *joinStrings(void)
     {
         Frame &f = stack.top();
-        const auto& elements = static_cast<HeapArray*>(f.val2.v.h)->elements;
-        while (f.elementId < elements.size()) {
-            auto *th = elements[f.elementId];
+        const auto *arr = static_cast<HeapArray*>(f.val2.v.h);
+        while (f.elementId < arr->size()) {
+            auto *th = arr->at(f.elementId);
             if (th->filled) {
                 joinString(f.first, f.str, f.val, f.elementId, th->content);
                 f.elementId++;
@@ -1631,20 +3811,22 @@ class Interpreter {
             throw makeError(stack.top().location, ss.str());
         }
         if (!first) {
-            auto& elts = static_cast<HeapArray *>(sep.v.h)->elements;
-            running.insert(running.end(), elts.begin(), elts.end());
+            auto *elts = static_cast<HeapArray *>(sep.v.h);
+            for (size_t i = 0; i < elts->size(); ++i)
+                running.push_back(elts->at(i));
         }
         first = false;
-        auto& elts = static_cast<HeapArray *>(elt.v.h)->elements;
-        running.insert(running.end(), elts.begin(), elts.end());
+        auto *elts = static_cast<HeapArray *>(elt.v.h);
+        for (size_t i = 0; i < elts->size(); ++i)
+            running.push_back(elts->at(i));
     }
 
     const AST *joinArrays(void)
     {
         Frame &f = stack.top();
-        const auto& elements = static_cast<HeapArray*>(f.val2.v.h)->elements;
-        while (f.elementId < elements.size()) {
-            auto *th = elements[f.elementId];
+        const auto *arr = static_cast<HeapArray*>(f.val2.v.h);
+        while (f.elementId < arr->size()) {
+            auto *th = arr->at(f.elementId);
             if (th->filled) {
                 joinArray(f.first, f.thunks, f.val, f.elementId, th->content);
                 f.elementId++;
@@ -1719,15 +3901,15 @@ class Interpreter {
                 filled = true;
                 auto *arr = static_cast<HeapArray *>(attach.v.h);
                 for (size_t i = 0; i < v->elements.size(); ++i) {
-                    arr->elements.push_back(
-                        makeHeap<HeapThunk>(idArrayElement, nullptr, 0, nullptr));
-                    jsonToHeap(v->elements[i], arr->elements[i]->filled, arr->elements[i]->content);
+                    arr->push_back(makeHeap<HeapThunk>(idArrayElement, nullptr, 0, nullptr));
+                    jsonToHeap(v->elements[i], arr->at(i)->filled, arr->at(i)->content);
                 }
             } break;
 
             case JsonnetJsonValue::OBJECT: {
                 attach = makeObject<HeapComprehensionObject>(
-                    BindingFrame{}, jsonObjVar, idJsonObjVar, BindingFrame{});
+                    BindingFrame{}, jsonObjVar, idJsonObjVar,
+                    std::map<const Identifier *, HeapThunk *>{});
                 filled = true;
                 auto *obj = static_cast<HeapComprehensionObject *>(attach.v.h);
                 for (const auto &pair : v->fields) {
@@ -1754,9 +3936,9 @@ class Interpreter {
     void objectInvariants(HeapObject *curr, HeapObject *self, unsigned &counter,
                           std::vector<HeapThunk *> &thunks)
     {
-        if (auto *ext = dynamic_cast<HeapExtendedObject *>(curr)) {
-            objectInvariants(ext->right, self, counter, thunks);
-            objectInvariants(ext->left, self, counter, thunks);
+        if (curr->type == HeapEntity::EXTENDED_OBJECT) {
+            for (auto *leaf : objectLeaves(curr))
+                objectInvariants(leaf, self, counter, thunks);
         } else {
             if (auto *simp = dynamic_cast<HeapSimpleObject *>(curr)) {
                 for (AST *assert : simp->asserts) {
@@ -1770,6 +3952,10 @@ class Interpreter {
     }
 
     /** Index an object's field.
+     *
+     * Pushes a call frame whose fieldThunk caches the value of the field with obj as self.
+     * If that thunk is already filled, the field has been evaluated before and the caller
+     * should use its content instead of evaluating the returned body.
      *
      * \param loc Location where the e.f occured.
      * \param obj The target
@@ -1784,12 +3970,19 @@ class Interpreter {
         if (found == nullptr) {
             throw makeError(loc, "field does not exist: " + encode_utf8(f->name));
         }
+        auto key = std::make_pair(f, found_at);
+        auto cached = self->fieldCache.find(key);
+        const AST *body;
         if (auto *simp = dynamic_cast<HeapSimpleObject *>(found)) {
             auto it = simp->fields.find(f);
-            const AST *body = it->second.body;
+            body = it->second.body;
 
-            stack.newCall(loc, simp, self, found_at, simp->upValues);
-            return body;
+            if (cached != self->fieldCache.end() && cached->second->filled) {
+                // The frame is only needed for stack traces, the body is not evaluated.
+                stack.newCall(loc, simp, self, found_at, BindingFrame{});
+            } else {
+                stack.newCall(loc, simp, self, found_at, simp->upValues);
+            }
         } else {
             // If a HeapLeafObject is not HeapSimpleObject, it must be HeapComprehensionObject.
             auto *comp = static_cast<HeapComprehensionObject *>(found);
@@ -1798,8 +3991,29 @@ class Interpreter {
             BindingFrame binds = comp->upValues;
             binds[comp->id] = th;
             stack.newCall(loc, comp, self, found_at, binds);
-            return comp->value;
+            body = comp->value;
+        }
+        if (cached == self->fieldCache.end()) {
+            // Self is reachable from the new call frame.
+            auto *thunk = makeHeap<HeapThunk>(f, nullptr, 0, nullptr);
+            cached = self->fieldCache.emplace(key, thunk).first;
+        }
+        stack.top().fieldThunk = cached->second;
+        return body;
+    }
+
+    /** Evaluate the body of the field indexed by the call frame on top of the stack, unless
+     * its value is already cached.  The value is left in scratch and the frame is not popped.
+     */
+    void evaluateField(const AST *body)
+    {
+        HeapThunk *thunk = stack.top().fieldThunk;
+        if (thunk->filled) {
+            scratch = thunk->content;
+            return;
         }
+        evaluate(body, stack.size());
+        thunk->fill(scratch);
     }
 
     void runInvariants(const LocationRange &loc, HeapObject *self)
@@ -1823,6 +4037,16 @@ class Interpreter {
         evaluate(thunk->body, initial_stack_size);
     }
 
+    /** Evaluate a desugared file to a value, binding the standard library. */
+    void evaluateFile(const AST *ast)
+    {
+        unsigned initial_stack_size = stack.size();
+        stack.newFrame(FRAME_LOCAL, ast);
+        stack.top().bindings[idStd] = stdThunk;
+        evaluate(ast, initial_stack_size + 1);
+        stack.pop();
+    }
+
     /** Evaluate the given AST to a value.
      *
      * Rather than call itself recursively, this function maintains a separate stack of
@@ -1853,11 +4077,11 @@ class Interpreter {
                 unsigned offset;
                 stack.getSelfBinding(self, offset);
                 scratch = makeArray({});
-                auto &elements = static_cast<HeapArray *>(scratch.v.h)->elements;
+                auto *arr = static_cast<HeapArray *>(scratch.v.h);
                 for (const auto &el : ast.elements) {
                     auto *el_th = makeHeap<HeapThunk>(idArrayElement, self, offset, el.expr);
                     el_th->upValues = capture(el.expr->freeVariables);
-                    elements.push_back(el_th);
+                    arr->push_back(el_th);
                 }
             } break;
 
@@ -1869,14 +4093,9 @@ class Interpreter {
             } break;
 
             case AST_BUILTIN_FUNCTION: {
-                const auto &ast = *static_cast<const BuiltinFunction *>(ast_);
-                HeapClosure::Params params;
-                params.reserve(ast.params.size());
-                for (const auto &p : ast.params) {
-                    // None of the builtins have default args.
-                    params.emplace_back(p, nullptr);
-                }
-                scratch = makeBuiltin(ast.name, params);
+                HeapClosure *closure = builtinClosure(static_cast<const BuiltinFunction *>(ast_));
+                scratch.t = Value::FUNCTION;
+                scratch.v.h = closure;
             } break;
 
             case AST_CONDITIONAL: {
@@ -2062,22 +4281,27 @@ class Interpreter {
                     }
                     auto *func = static_cast<HeapClosure *>(scratch.v.h);
 
-                    std::set<const Identifier *> params_needed;
-                    for (const auto &param : func->params) {
-                        params_needed.insert(param.id);
-                    }
-
-                    // Create thunks for arguments.
-                    std::vector<HeapThunk *> positional_args;
-                    BindingFrame args;
+                    // Create thunks for arguments, indexed by the position of the parameter they
+                    // bind.
+                    std::vector<HeapThunk *> args(func->params.size(), nullptr);
                     bool got_named = false;
                     for (unsigned i = 0; i < ast.args.size(); ++i) {
                         const auto &arg = ast.args[i];
 
                         const Identifier *name;
+                        unsigned slot;
                         if (arg.id != nullptr) {
                             got_named = true;
                             name = arg.id;
+                            // Functions of the standard library have identifiers from another
+                            // allocator, so match the parameter by name.
+                            for (slot = 0; slot < func->params.size(); ++slot) {
+                                const auto &param = func->params[slot];
+                                if (param.id == arg.id || param.id->name == arg.id->name) {
+                                    name = param.id;
+                                    break;
+                                }
+                            }
                         } else {
                             if (got_named) {
                                 std::stringstream ss;
@@ -2092,6 +4316,7 @@ class Interpreter {
                                 throw makeError(ast.location, ss.str());
                             }
                             name = func->params[i].id;
+                            slot = i;
                         }
                         // Special case for builtin functions -- leave identifier blank for
                         // them in the thunk.  This removes the thunk frame from the stacktrace.
@@ -2104,17 +4329,17 @@ class Interpreter {
                         // While making the thunks, keep them in a frame to avoid premature garbage
                         // collection.
                         f.thunks.push_back(thunk);
-                        if (args.find(name) != args.end()) {
+                        if (slot < args.size() && args[slot] != nullptr) {
                             std::stringstream ss;
                             ss << "binding parameter a second time: " << encode_utf8(name->name);
                             throw makeError(ast.location, ss.str());
                         }
-                        args[name] = thunk;
-                        if (params_needed.find(name) == params_needed.end()) {
+                        if (slot >= args.size()) {
                             std::stringstream ss;
                             ss << "function has no parameter " << encode_utf8(name->name);
                             throw makeError(ast.location, ss.str());
                         }
+                        args[slot] = thunk;
                     }
 
                     // For any func params for which there was no arg, create a thunk for those and
@@ -2124,8 +4349,9 @@ class Interpreter {
                     // Raise errors for unbound params, create thunks (but don't fill in upvalues).
                     // This is a subset of f.thunks, so will not get garbage collected.
                     std::vector<HeapThunk *> def_arg_thunks;
-                    for (const auto &param : func->params) {
-                        if (args.find(param.id) != args.end())
+                    for (unsigned slot = 0; slot < func->params.size(); ++slot) {
+                        const auto &param = func->params[slot];
+                        if (args[slot] != nullptr)
                             continue;
                         if (param.def == nullptr) {
                             std::stringstream ss;
@@ -2141,11 +4367,15 @@ class Interpreter {
                             makeHeap<HeapThunk>(name_, func->self, func->offset, param.def);
                         f.thunks.push_back(thunk);
                         def_arg_thunks.push_back(thunk);
-                        args[param.id] = thunk;
+                        args[slot] = thunk;
                     }
 
+                    // The free variables of a function do not include its parameters, so the
+                    // arguments can be appended without looking them up.
                     BindingFrame up_values = func->upValues;
-                    up_values.insert(args.begin(), args.end());
+                    up_values.reserve(up_values.size() + args.size());
+                    for (unsigned slot = 0; slot < args.size(); ++slot)
+                        up_values.bind(func->params[slot].id, args[slot]);
 
                     // Fill in upvalues
                     for (HeapThunk *thunk : def_arg_thunks) {
@@ -2162,8 +4392,10 @@ class Interpreter {
                         // Built-in function.
                         // Give nullptr for self because noone looking at this frame will
                         // attempt to bind to self (it's native code).
+                        // Builtins have no default arguments, so args holds the same thunks
+                        // as f.thunks, but in the order of the parameters.
                         stack.newFrame(FRAME_BUILTIN_FORCE_THUNKS, f_ast);
-                        stack.top().thunks = thunks_copy;
+                        stack.top().thunks = args;
                         stack.top().val = scratch;
                         goto replaceframe;
                     } else {
@@ -2254,7 +4486,7 @@ class Interpreter {
                             switch (rhs.t) {
                                 case Value::OBJECT: {
                                     auto *obj = static_cast<HeapObject *>(rhs.v.h);
-                                    auto *fid = alloc->makeIdentifier(field->value);
+                                    auto *fid = alloc->makeIdentifier(field->value());
                                     unsigned unused_found_at = 0;
                                     bool in = findObject(fid, obj, 0, unused_found_at);
                                     scratch = makeBoolean(in);
@@ -2285,12 +4517,15 @@ class Interpreter {
                             if (ast.op == BOP_PLUS) {
                                 auto *arr_l = static_cast<HeapArray *>(lhs.v.h);
                                 auto *arr_r = static_cast<HeapArray *>(rhs.v.h);
-                                std::vector<HeapThunk *> elements;
-                                for (auto *el : arr_l->elements)
-                                    elements.push_back(el);
-                                for (auto *el : arr_r->elements)
-                                    elements.push_back(el);
-                                scratch = makeArray(elements);
+                                HeapArray *arr = arr_l;
+                                if (arr_l->size() == 0) {
+                                    arr = arr_r;
+                                } else if (arr_r->size() > 0) {
+                                    // Both are reachable from the frame.
+                                    arr = makeHeap<HeapArray>(arr_l, arr_r);
+                                }
+                                scratch.t = Value::ARRAY;
+                                scratch.v.h = arr;
                             } else {
                                 throw makeError(ast.location,
                                                 "binary operator " + bop_string(ast.op) +
@@ -2408,10 +4643,14 @@ class Interpreter {
                         } break;
 
                         case Value::STRING: {
-                            const UString &lhs_str = static_cast<HeapString *>(lhs.v.h)->value;
-                            const UString &rhs_str = static_cast<HeapString *>(rhs.v.h)->value;
+                            if (ast.op == BOP_PLUS) {
+                                scratch = makeStringConcat(static_cast<HeapString *>(lhs.v.h),
+                                                           static_cast<HeapString *>(rhs.v.h));
+                                break;
+                            }
+                            const UString &lhs_str = static_cast<HeapString *>(lhs.v.h)->value();
+                            const UString &rhs_str = static_cast<HeapString *>(rhs.v.h)->value();
                             switch (ast.op) {
-                                case BOP_PLUS: scratch = makeString(lhs_str + rhs_str); break;
 
                                 case BOP_LESS_EQ: scratch = makeBoolean(lhs_str <= rhs_str); break;
 
@@ -2442,15 +4681,15 @@ class Interpreter {
                             "filter function must return boolean, got: " + type_str(scratch));
                     }
                     if (scratch.v.b)
-                        f.thunks.push_back(arr->elements[f.elementId]);
+                        f.thunks.push_back(arr->at(f.elementId));
                     f.elementId++;
                     // Iterate through arr, calling the function on each.
-                    if (f.elementId == arr->elements.size()) {
+                    if (f.elementId == arr->size()) {
                         scratch = makeArray(f.thunks);
                     } else {
-                        auto *thunk = arr->elements[f.elementId];
+                        auto *thunk = arr->at(f.elementId);
                         BindingFrame bindings = func->upValues;
-                        bindings[func->params[0].id] = thunk;
+                        bindings.bind(func->params[0].id, thunk);
                         stack.newCall(ast.location, func, func->self, func->offset, bindings);
                         ast_ = func->body;
                         goto recurse;
@@ -2464,60 +4703,41 @@ class Interpreter {
                         // All thunks forced, now the builtin implementations.
                         const LocationRange &loc = ast.location;
                         const std::string &builtin_name = func->builtinName;
+                        unsigned long builtin = func->builtin;
                         std::vector<Value> args;
                         for (auto *th : f.thunks) {
                             args.push_back(th->content);
                         }
-                        BuiltinMap::const_iterator bit = builtins.find(builtin_name);
-                        if (bit != builtins.end()) {
-                            const AST *new_ast = (this->*bit->second)(loc, args);
+                        if (builtin < builtins.size()) {
+                            BuiltinFunc bf = builtins[builtin];
+                            if (bf == nullptr) {
+                                throw makeError(ast.location,
+                                                "unrecognized builtin name: " + builtin_name);
+                            }
+                            const AST *new_ast = (this->*bf)(loc, args);
                             if (new_ast != nullptr) {
                                 ast_ = new_ast;
                                 goto recurse;
                             }
                             break;
                         }
-                        VmNativeCallbackMap::const_iterator nit =
-                            nativeCallbacks.find(builtin_name);
-                        // TODO(dcunnin): Support arrays.
-                        // TODO(dcunnin): Support objects.
-                        std::vector<JsonnetJsonValue> args2;
+                        const VmNativeCallback &cb = *natives[builtin - builtins.size()];
+                        // Arguments are manifested in full, which can trigger garbage
+                        // collection, but they remain reachable via f.thunks.  The reference f
+                        // is not valid afterwards since the stack may be reallocated.
+                        std::vector<std::unique_ptr<JsonnetJsonValue>> args2;
                         for (const Value &arg : args) {
-                            switch (arg.t) {
-                                case Value::STRING:
-                                    args2.emplace_back(
-                                        JsonnetJsonValue::STRING,
-                                        encode_utf8(static_cast<HeapString *>(arg.v.h)->value),
-                                        0);
-                                    break;
-
-                                case Value::BOOLEAN:
-                                    args2.emplace_back(
-                                        JsonnetJsonValue::BOOL, "", arg.v.b ? 1.0 : 0.0);
-                                    break;
-
-                                case Value::NUMBER:
-                                    args2.emplace_back(JsonnetJsonValue::NUMBER, "", arg.v.d);
-                                    break;
-
-                                case Value::NULL_TYPE:
-                                    args2.emplace_back(JsonnetJsonValue::NULL_KIND, "", 0);
-                                    break;
-
-                                default:
-                                    throw makeError(ast.location,
-                                                    "native extensions can only take primitives.");
+                            if (arg.t == Value::FUNCTION) {
+                                throw makeError(ast.location,
+                                                "native extensions cannot take functions.");
                             }
+                            scratch = arg;
+                            args2.push_back(manifestJsonValue(loc));
                         }
                         std::vector<const JsonnetJsonValue *> args3;
                         for (size_t i = 0; i < args2.size(); ++i) {
-                            args3.push_back(&args2[i]);
-                        }
-                        if (nit == nativeCallbacks.end()) {
-                            throw makeError(ast.location,
-                                            "unrecognized builtin name: " + builtin_name);
+                            args3.push_back(args2[i].get());
                         }
-                        const VmNativeCallback &cb = nit->second;
 
                         int succ;
                         std::unique_ptr<JsonnetJsonValue> r(cb.cb(cb.ctx, args3.data(), &succ));
@@ -2547,6 +4767,10 @@ class Interpreter {
                 } break;
 
                 case FRAME_CALL: {
+                    if (f.fieldThunk != nullptr) {
+                        // If we evaluated an object field, cache result.
+                        f.fieldThunk->fill(scratch);
+                    }
                     if (auto *thunk = dynamic_cast<HeapThunk *>(f.context)) {
                         // If we called a thunk, cache result.
                         thunk->fill(scratch);
@@ -2576,7 +4800,7 @@ class Interpreter {
                     const auto &ast = *static_cast<const Error *>(f.ast);
                     UString msg;
                     if (scratch.t == Value::STRING) {
-                        msg = static_cast<HeapString *>(scratch.v.h)->value;
+                        msg = static_cast<HeapString *>(scratch.v.h)->value();
                     } else {
                         msg = toString(ast.location);
                     }
@@ -2611,10 +4835,14 @@ class Interpreter {
                             "super index must be string, got " + type_str(scratch) + ".");
                     }
 
-                    const UString &index_name = static_cast<HeapString *>(scratch.v.h)->value;
+                    const UString &index_name = static_cast<HeapString *>(scratch.v.h)->value();
                     auto *fid = alloc->makeIdentifier(index_name);
                     stack.pop();
                     ast_ = objectIndex(ast.location, self, fid, offset);
+                    if (stack.top().fieldThunk->filled) {
+                        scratch = stack.top().fieldThunk->content;
+                        goto popframe;
+                    }
                     goto recurse;
                 } break;
 
@@ -2633,7 +4861,7 @@ class Interpreter {
                         // There is no super object.
                         scratch = makeBoolean(false);
                     } else {
-                        const UString &element_name = static_cast<HeapString *>(scratch.v.h)->value;
+                        const UString &element_name = static_cast<HeapString *>(scratch.v.h)->value();
                         auto *fid = alloc->makeIdentifier(element_name);
                         unsigned unused_found_at = 0;
                         bool in = findObject(fid, self, offset, unused_found_at);
@@ -2647,7 +4875,7 @@ class Interpreter {
                     if (target.t == Value::ARRAY) {
                         const auto *array = static_cast<HeapArray *>(target.v.h);
                         if (scratch.t == Value::STRING) {
-                            const UString &str = static_cast<HeapString *>(scratch.v.h)->value;
+                            const UString &str = static_cast<HeapString *>(scratch.v.h)->value();
                             throw makeError(
                                 ast.location,
                                 "attempted index an array with string \""
@@ -2659,7 +4887,7 @@ class Interpreter {
                                 "array index must be number, got " + type_str(scratch) + ".");
                         }
                         double index = ::floor(scratch.v.d);
-                        long sz = array->elements.size();
+                        long sz = array->size();
                         if (index < 0 || index >= sz) {
                             std::stringstream ss;
                             ss << "array bounds error: " << index << " not within [0, " << sz
@@ -2672,7 +4900,7 @@ class Interpreter {
                             throw makeError(ast.location, ss.str());
                         }
                         // index < sz <= SIZE_T_MAX
-                        auto *thunk = array->elements[size_t(index)];
+                        auto *thunk = array->at(size_t(index));
                         if (thunk->filled) {
                             scratch = thunk->content;
                         } else {
@@ -2690,10 +4918,14 @@ class Interpreter {
                                 ast.location,
                                 "object index must be string, got " + type_str(scratch) + ".");
                         }
-                        const UString &index_name = static_cast<HeapString *>(scratch.v.h)->value;
+                        const UString &index_name = static_cast<HeapString *>(scratch.v.h)->value();
                         auto *fid = alloc->makeIdentifier(index_name);
                         stack.pop();
                         ast_ = objectIndex(ast.location, obj, fid, 0);
+                        if (stack.top().fieldThunk->filled) {
+                            scratch = stack.top().fieldThunk->content;
+                            goto popframe;
+                        }
                         goto recurse;
                     } else if (target.t == Value::STRING) {
                         auto *obj = static_cast<HeapString *>(target.v.h);
@@ -2703,14 +4935,14 @@ class Interpreter {
                                 ast.location,
                                 "string index must be a number, got " + type_str(scratch) + ".");
                         }
-                        long sz = obj->value.length();
+                        long sz = obj->size();
                         long i = (long)scratch.v.d;
                         if (i < 0 || i >= sz) {
                             std::stringstream ss;
                             ss << "string bounds error: " << i << " not within [0, " << sz << ")";
                             throw makeError(ast.location, ss.str());
                         }
-                        char32_t ch[] = {obj->value[i], U'\0'};
+                        char32_t ch[] = {obj->value()[i], U'\0'};
                         scratch = makeString(ch);
                     } else {
                         std::cerr << "INTERNAL ERROR: not object / array / string." << std::endl;
@@ -2781,7 +5013,7 @@ class Interpreter {
                         if (scratch.t != Value::STRING) {
                             throw makeError(ast.location, "field name was not a string.");
                         }
-                        const auto &fname = static_cast<const HeapString *>(scratch.v.h)->value;
+                        const auto &fname = static_cast<const HeapString *>(scratch.v.h)->value();
                         const Identifier *fid = alloc->makeIdentifier(fname);
                         if (f.objectFields.find(fid) != f.objectFields.end()) {
                             std::string msg =
@@ -2809,14 +5041,15 @@ class Interpreter {
                                         "object comprehension needs array, got " + type_str(arr_v));
                     }
                     const auto *arr = static_cast<const HeapArray *>(arr_v.v.h);
-                    if (arr->elements.size() == 0) {
+                    if (arr->size() == 0) {
                         // Degenerate case.  Just create the object now.
                         scratch = makeObject<HeapComprehensionObject>(
-                            BindingFrame{}, ast.value, ast.id, BindingFrame{});
+                            BindingFrame{}, ast.value, ast.id,
+                            std::map<const Identifier *, HeapThunk *>{});
                     } else {
                         f.kind = FRAME_OBJECT_COMP_ELEMENT;
                         f.val = scratch;
-                        f.bindings[ast.id] = arr->elements[0];
+                        f.bindings[ast.id] = arr->at(0);
                         f.elementId = 0;
                         ast_ = ast.field;
                         goto recurse;
@@ -2832,22 +5065,22 @@ class Interpreter {
                             ss << "field must be string, got: " << type_str(scratch);
                             throw makeError(ast.location, ss.str());
                         }
-                        const auto &fname = static_cast<const HeapString *>(scratch.v.h)->value;
+                        const auto &fname = static_cast<const HeapString *>(scratch.v.h)->value();
                         const Identifier *fid = alloc->makeIdentifier(fname);
                         if (f.elements.find(fid) != f.elements.end()) {
                             throw makeError(ast.location,
                                             "duplicate field name: \"" + encode_utf8(fname) + "\"");
                         }
-                        f.elements[fid] = arr->elements[f.elementId];
+                        f.elements[fid] = arr->at(f.elementId);
                     }
                     f.elementId++;
 
-                    if (f.elementId == arr->elements.size()) {
+                    if (f.elementId == arr->size()) {
                         auto env = capture(ast.freeVariables);
                         scratch =
                             makeObject<HeapComprehensionObject>(env, ast.value, ast.id, f.elements);
                     } else {
-                        f.bindings[ast.id] = arr->elements[f.elementId];
+                        f.bindings[ast.id] = arr->at(f.elementId);
                         ast_ = ast.field;
                         goto recurse;
                     }
@@ -2855,22 +5088,20 @@ class Interpreter {
 
                 case FRAME_STRING_CONCAT: {
                     const auto &ast = *static_cast<const Binary *>(f.ast);
-                    const Value &lhs = stack.top().val;
-                    const Value &rhs = stack.top().val2;
-                    UString output;
-                    if (lhs.t == Value::STRING) {
-                        output.append(static_cast<const HeapString *>(lhs.v.h)->value);
-                    } else {
-                        scratch = lhs;
-                        output.append(toString(ast.left->location));
+                    // Convert the operands to strings in place, so that they stay reachable.
+                    // Manifesting can grow the stack, so do not hold references into it.
+                    if (stack.top().val.t != Value::STRING) {
+                        scratch = stack.top().val;
+                        UString str = toString(ast.left->location);
+                        stack.top().val = makeString(str);
                     }
-                    if (rhs.t == Value::STRING) {
-                        output.append(static_cast<const HeapString *>(rhs.v.h)->value);
-                    } else {
-                        scratch = rhs;
-                        output.append(toString(ast.right->location));
+                    if (stack.top().val2.t != Value::STRING) {
+                        scratch = stack.top().val2;
+                        UString str = toString(ast.right->location);
+                        stack.top().val2 = makeString(str);
                     }
-                    scratch = makeString(output);
+                    scratch = makeStringConcat(static_cast<HeapString *>(stack.top().val.v.h),
+                                               static_cast<HeapString *>(stack.top().val2.v.h));
                 } break;
 
                 case FRAME_UNARY: {
@@ -2938,6 +5169,63 @@ class Interpreter {
                     }
                 } break;
 
+                case FRAME_BUILTIN_SORT:
+                case FRAME_BUILTIN_UNIQ:
+                case FRAME_BUILTIN_SET: {
+                    f.values.push_back(scratch);
+                    auto *ast = sortElements();
+                    if (ast != nullptr) {
+                        ast_ = ast;
+                        goto recurse;
+                    }
+                } break;
+
+                case FRAME_BUILTIN_SET_MEMBER: {
+                    f.values.push_back(scratch);
+                    auto *ast = setMember();
+                    if (ast != nullptr) {
+                        ast_ = ast;
+                        goto recurse;
+                    }
+                } break;
+
+                case FRAME_BUILTIN_SET_UNION:
+                case FRAME_BUILTIN_SET_INTER:
+                case FRAME_BUILTIN_SET_DIFF: {
+                    f.values.push_back(scratch);
+                    auto *ast = setElements();
+                    if (ast != nullptr) {
+                        ast_ = ast;
+                        goto recurse;
+                    }
+                } break;
+
+                case FRAME_BUILTIN_FLAT_MAP: {
+                    auto *ast = flatMap(true);
+                    if (ast != nullptr) {
+                        ast_ = ast;
+                        goto recurse;
+                    }
+                } break;
+
+                case FRAME_BUILTIN_FLATTEN_ARRAYS: {
+                    auto *ast = flattenArrays();
+                    if (ast != nullptr) {
+                        ast_ = ast;
+                        goto recurse;
+                    }
+                } break;
+
+                case FRAME_BUILTIN_FOLDL:
+                case FRAME_BUILTIN_FOLDR: {
+                    f.elementId++;
+                    auto *ast = fold();
+                    if (ast != nullptr) {
+                        ast_ = ast;
+                        goto recurse;
+                    }
+                } break;
+
                 default:
                     std::cerr << "INTERNAL ERROR: Unknown FrameKind:  " << f.kind << std::endl;
                     std::abort();
@@ -2951,6 +5239,50 @@ class Interpreter {
         }
     }
 
+    /** Evaluate an element of the array in scratch into scratch, in a new call frame that keeps
+     * the array reachable until leaveElement is called.
+     *
+     * \returns The location to blame for errors in the element.
+     */
+    LocationRange enterElement(const LocationRange &loc, HeapThunk *thunk)
+    {
+        LocationRange tloc = thunk->body == nullptr ? loc : thunk->body->location;
+        if (thunk->filled) {
+            stack.newCall(loc, thunk, nullptr, 0, BindingFrame{});
+            // Keep arr alive when scratch is overwritten
+            stack.top().val = scratch;
+            scratch = thunk->content;
+        } else {
+            stack.newCall(loc, thunk, thunk->self, thunk->offset, thunk->upValues);
+            // Keep arr alive when scratch is overwritten
+            stack.top().val = scratch;
+            evaluate(thunk->body, stack.size());
+            thunk->fill(scratch);
+        }
+        return tloc;
+    }
+
+    /** Evaluate a field of an object into scratch, in a new call frame that keeps the object
+     * (as self) and the previous value of scratch reachable until leaveElement is called.
+     *
+     * \returns The location to blame for errors in the field.
+     */
+    LocationRange enterField(const LocationRange &loc, HeapObject *obj, const Identifier *f)
+    {
+        // pushes FRAME_CALL
+        const AST *body = objectIndex(loc, obj, f, 0);
+        stack.top().val = scratch;
+        evaluateField(body);
+        return body->location;
+    }
+
+    /** Restore scratch after enterElement or enterField. */
+    void leaveElement(void)
+    {
+        scratch = stack.top().val;
+        stack.pop();
+    }
+
     /** Manifest the scratch value by evaluating any remaining fields, and then convert to JSON.
      *
      * This can trigger a garbage collection cycle.  Be sure to stash any objects that aren't
@@ -2967,28 +5299,17 @@ class Interpreter {
         switch (scratch.t) {
             case Value::ARRAY: {
                 HeapArray *arr = static_cast<HeapArray *>(scratch.v.h);
-                if (arr->elements.size() == 0) {
+                if (arr->size() == 0) {
                     ss << U"[ ]";
                 } else {
                     const char32_t *prefix = multiline ? U"[\n" : U"[";
                     UString indent2 = multiline ? indent + U"   " : indent;
-                    for (auto *thunk : arr->elements) {
-                        LocationRange tloc = thunk->body == nullptr ? loc : thunk->body->location;
-                        if (thunk->filled) {
-                            stack.newCall(loc, thunk, nullptr, 0, BindingFrame{});
-                            // Keep arr alive when scratch is overwritten
-                            stack.top().val = scratch;
-                            scratch = thunk->content;
-                        } else {
-                            stack.newCall(loc, thunk, thunk->self, thunk->offset, thunk->upValues);
-                            // Keep arr alive when scratch is overwritten
-                            stack.top().val = scratch;
-                            evaluate(thunk->body, stack.size());
-                        }
+                    // Index rather than iterate, since evaluating an element can append to
+                    // the array's buffer.
+                    for (size_t i = 0; i < arr->size(); ++i) {
+                        LocationRange tloc = enterElement(loc, arr->at(i));
                         auto element = manifestJson(tloc, multiline, indent2);
-                        // Restore scratch
-                        scratch = stack.top().val;
-                        stack.pop();
+                        leaveElement();
                         ss << prefix << indent2 << element;
                         prefix = multiline ? U",\n" : U", ";
                     }
@@ -3008,28 +5329,17 @@ class Interpreter {
             case Value::OBJECT: {
                 auto *obj = static_cast<HeapObject *>(scratch.v.h);
                 runInvariants(loc, obj);
-                // Using std::map has the useful side-effect of ordering the fields
-                // alphabetically.
-                std::map<UString, const Identifier *> fields;
-                for (const auto &f : objectFields(obj, true)) {
-                    fields[f->name] = f;
-                }
+                auto fields = sortedFields(obj, false);
                 if (fields.size() == 0) {
                     ss << U"{ }";
                 } else {
                     UString indent2 = multiline ? indent + U"   " : indent;
                     const char32_t *prefix = multiline ? U"{\n" : U"{";
                     for (const auto &f : fields) {
-                        // pushes FRAME_CALL
-                        const AST *body = objectIndex(loc, obj, f.second, 0);
-                        stack.top().val = scratch;
-                        evaluate(body, stack.size());
-                        auto vstr = manifestJson(body->location, multiline, indent2);
-                        // Reset scratch so that the object we're manifesting doesn't
-                        // get GC'd.
-                        scratch = stack.top().val;
-                        stack.pop();
-                        ss << prefix << indent2 << jsonnet_string_unparse(f.first, false) << U": "
+                        LocationRange floc = enterField(loc, obj, f);
+                        auto vstr = manifestJson(floc, multiline, indent2);
+                        leaveElement();
+                        ss << prefix << indent2 << jsonnet_string_unparse(f->name, false) << U": "
                            << vstr;
                         prefix = multiline ? U",\n" : U", ";
                     }
@@ -3038,13 +5348,287 @@ class Interpreter {
             } break;
 
             case Value::STRING: {
-                const UString &str = static_cast<HeapString *>(scratch.v.h)->value;
+                const UString &str = static_cast<HeapString *>(scratch.v.h)->value();
                 ss << jsonnet_string_unparse(str, false);
             } break;
         }
         return ss.str();
     }
 
+    /** Render the path of a value being manifested, for error messages, like the Jsonnet array
+     * of its keys and indexes.
+     */
+    static std::string manifestPath(const std::vector<UString> &path)
+    {
+        if (path.size() == 0)
+            return "[ ]";
+        UString r = U"[";
+        const char32_t *prefix = U"";
+        for (const auto &p : path) {
+            r += prefix;
+            r += p;
+            prefix = U", ";
+        }
+        r += U"]";
+        return encode_utf8(r);
+    }
+
+    /** Manifest the scratch value like std.manifestJsonEx, appending to buf.
+     *
+     * This can trigger a garbage collection cycle, see manifestJson.
+     *
+     * \param indent The indentation added at each level.
+     * \param cindent The indentation of the current level.
+     * \param path The keys and indexes leading to the value, rendered for error messages.
+     */
+    void manifestJsonEx(const LocationRange &loc, const UString &indent, const UString &cindent,
+                        std::vector<UString> &path, UString &buf)
+    {
+        switch (scratch.t) {
+            case Value::ARRAY: {
+                HeapArray *arr = static_cast<HeapArray *>(scratch.v.h);
+                UString new_indent = cindent + indent;
+                buf += U"[\n";
+                for (size_t i = 0; i < arr->size(); ++i) {
+                    if (i > 0)
+                        buf += U",\n";
+                    buf += new_indent;
+                    path.push_back(decode_utf8(jsonnet_unparse_number(i)));
+                    LocationRange tloc = enterElement(loc, arr->at(i));
+                    manifestJsonEx(tloc, indent, new_indent, path, buf);
+                    leaveElement();
+                    path.pop_back();
+                }
+                buf += U"\n";
+                buf += cindent;
+                buf += U"]";
+            } break;
+
+            case Value::BOOLEAN: buf += scratch.v.b ? U"true" : U"false"; break;
+
+            case Value::NUMBER: buf += decode_utf8(jsonnet_unparse_number(scratch.v.d)); break;
+
+            case Value::FUNCTION:
+                throw makeError(loc, "Tried to manifest function at " + manifestPath(path));
+
+            case Value::NULL_TYPE: buf += U"null"; break;
+
+            case Value::OBJECT: {
+                auto *obj = static_cast<HeapObject *>(scratch.v.h);
+                auto fields = sortedFields(obj, false);
+                // Like std.manifestJsonEx, only check the invariants when indexing a field.
+                if (fields.size() > 0)
+                    runInvariants(loc, obj);
+                UString new_indent = cindent + indent;
+                buf += U"{\n";
+                const char32_t *prefix = U"";
+                for (const auto &f : fields) {
+                    buf += prefix;
+                    buf += new_indent;
+                    buf += jsonnet_string_unparse(f->name, false);
+                    buf += U": ";
+                    path.push_back(jsonnet_string_unparse(f->name, false));
+                    LocationRange floc = enterField(loc, obj, f);
+                    manifestJsonEx(floc, indent, new_indent, path, buf);
+                    leaveElement();
+                    path.pop_back();
+                    prefix = U",\n";
+                }
+                buf += U"\n";
+                buf += cindent;
+                buf += U"}";
+            } break;
+
+            case Value::STRING:
+                buf += jsonnet_string_unparse(static_cast<HeapString *>(scratch.v.h)->value(),
+                                              false);
+                break;
+        }
+    }
+
+    /** Whether the scratch value is a non-empty array or object, which std.manifestYamlDoc
+     * starts on a new line or after a dash.
+     */
+    bool yamlNested(void)
+    {
+        switch (scratch.t) {
+            case Value::ARRAY: return static_cast<HeapArray *>(scratch.v.h)->size() > 0;
+            case Value::OBJECT:
+                return sortedFields(static_cast<HeapObject *>(scratch.v.h), false).size() > 0;
+            default: return false;
+        }
+    }
+
+    /** Manifest the scratch value like std.manifestYamlDoc, appending to buf.
+     *
+     * This can trigger a garbage collection cycle, see manifestJson.
+     *
+     * \param indent_array_in_object Whether arrays are indented relative to their field.
+     * \param cindent The indentation of the current level.
+     * \param path The keys and indexes leading to the value, rendered for error messages.
+     */
+    void manifestYaml(const LocationRange &loc, bool indent_array_in_object,
+                      const UString &cindent, std::vector<UString> &path, UString &buf)
+    {
+        switch (scratch.t) {
+            case Value::ARRAY: {
+                HeapArray *arr = static_cast<HeapArray *>(scratch.v.h);
+                if (arr->size() == 0) {
+                    buf += U"[]";
+                    break;
+                }
+                for (size_t i = 0; i < arr->size(); ++i) {
+                    if (i > 0) {
+                        buf += U"\n";
+                        buf += cindent;
+                    }
+                    path.push_back(decode_utf8(jsonnet_unparse_number(i)));
+                    LocationRange tloc = enterElement(loc, arr->at(i));
+                    // Nested arrays start on a new line, as "- - - 1" is hard to read, but
+                    // objects can start after the dash since their indentation matches up.
+                    UString new_indent = cindent;
+                    buf += U"-";
+                    if (scratch.t == Value::ARRAY && yamlNested()) {
+                        new_indent += U"  ";
+                        buf += U"\n";
+                        buf += new_indent;
+                    } else {
+                        if (scratch.t == Value::OBJECT && yamlNested())
+                            new_indent += U"  ";
+                        buf += U" ";
+                    }
+                    manifestYaml(tloc, indent_array_in_object, new_indent, path, buf);
+                    leaveElement();
+                    path.pop_back();
+                }
+            } break;
+
+            case Value::BOOLEAN: buf += scratch.v.b ? U"true" : U"false"; break;
+
+            case Value::NUMBER: buf += decode_utf8(jsonnet_unparse_number(scratch.v.d)); break;
+
+            case Value::FUNCTION:
+                throw makeError(loc, "Tried to manifest function at " + manifestPath(path));
+
+            case Value::NULL_TYPE: buf += U"null"; break;
+
+            case Value::OBJECT: {
+                auto *obj = static_cast<HeapObject *>(scratch.v.h);
+                auto fields = sortedFields(obj, false);
+                if (fields.size() == 0) {
+                    buf += U"{}";
+                    break;
+                }
+                runInvariants(loc, obj);
+                bool first = true;
+                for (const auto &f : fields) {
+                    if (!first) {
+                        buf += U"\n";
+                        buf += cindent;
+                    }
+                    first = false;
+                    buf += jsonnet_string_unparse(f->name, false);
+                    buf += U":";
+                    path.push_back(jsonnet_string_unparse(f->name, false));
+                    LocationRange floc = enterField(loc, obj, f);
+                    // Arrays are not indented by default, which allows e.g. "ports:\n- 80".
+                    UString new_indent = cindent;
+                    if (yamlNested()) {
+                        if (scratch.t == Value::OBJECT || indent_array_in_object)
+                            new_indent += U"  ";
+                        buf += U"\n";
+                        buf += new_indent;
+                    } else {
+                        buf += U" ";
+                    }
+                    manifestYaml(floc, indent_array_in_object, new_indent, path, buf);
+                    leaveElement();
+                    path.pop_back();
+                }
+            } break;
+
+            case Value::STRING: {
+                const UString &str = static_cast<HeapString *>(scratch.v.h)->value();
+                if (str.size() == 0) {
+                    buf += U"\"\"";
+                } else if (str.back() == U'\n') {
+                    // A block scalar, with one indented line per line of the string.
+                    buf += U"|";
+                    size_t start = 0;
+                    for (size_t i = 0; i < str.size(); ++i) {
+                        if (str[i] != U'\n')
+                            continue;
+                        buf += U"\n";
+                        buf += cindent;
+                        buf += U"  ";
+                        buf.append(str, start, i - start);
+                        start = i + 1;
+                    }
+                } else {
+                    buf += jsonnet_string_unparse(str, false);
+                }
+            } break;
+        }
+    }
+
+    /** Manifest the scratch value by evaluating any remaining fields, and then convert to a tree
+     * of JsonnetJsonValue, as would be obtained by parsing the output of manifestJson.
+     *
+     * This can trigger a garbage collection cycle.  Be sure to stash any objects that aren't
+     * reachable via the stack or heap.
+     */
+    std::unique_ptr<JsonnetJsonValue> manifestJsonValue(const LocationRange &loc)
+    {
+        std::unique_ptr<JsonnetJsonValue> r(new JsonnetJsonValue());
+        r->number = 0;
+        switch (scratch.t) {
+            case Value::ARRAY: {
+                r->kind = JsonnetJsonValue::ARRAY;
+                HeapArray *arr = static_cast<HeapArray *>(scratch.v.h);
+                r->elements.reserve(arr->size());
+                for (size_t i = 0; i < arr->size(); ++i) {
+                    LocationRange tloc = enterElement(loc, arr->at(i));
+                    r->elements.push_back(manifestJsonValue(tloc));
+                    leaveElement();
+                }
+            } break;
+
+            case Value::BOOLEAN:
+                r->kind = JsonnetJsonValue::BOOL;
+                r->number = scratch.v.b ? 1.0 : 0.0;
+                break;
+
+            case Value::NUMBER:
+                r->kind = JsonnetJsonValue::NUMBER;
+                r->number = scratch.v.d;
+                break;
+
+            case Value::FUNCTION:
+                throw makeError(loc, "couldn't manifest function in JSON output.");
+
+            case Value::NULL_TYPE: r->kind = JsonnetJsonValue::NULL_KIND; break;
+
+            case Value::OBJECT: {
+                r->kind = JsonnetJsonValue::OBJECT;
+                auto *obj = static_cast<HeapObject *>(scratch.v.h);
+                runInvariants(loc, obj);
+                for (const auto &f : sortedFields(obj, false)) {
+                    LocationRange floc = enterField(loc, obj, f);
+                    auto v = manifestJsonValue(floc);
+                    leaveElement();
+                    // The fields are visited in order, so always append at the end.
+                    r->fields.emplace_hint(r->fields.end(), encode_utf8(f->name), std::move(v));
+                }
+            } break;
+
+            case Value::STRING: {
+                r->kind = JsonnetJsonValue::STRING;
+                r->string = encode_utf8(static_cast<HeapString *>(scratch.v.h)->value());
+            } break;
+        }
+        return r;
+    }
+
     UString manifestString(const LocationRange &loc)
     {
         if (scratch.t != Value::STRING) {
@@ -3052,13 +5636,13 @@ class Interpreter {
             ss << "expected string result, got: " << type_str(scratch.t);
             throw makeError(loc, ss.str());
         }
-        return static_cast<HeapString *>(scratch.v.h)->value;
+        return static_cast<HeapString *>(scratch.v.h)->value();
     }
 
     StrMap manifestMulti(bool string)
     {
         StrMap r;
-        LocationRange loc("During manifestation");
+        LocationRange loc(alloc->makeFileName("During manifestation"));
         if (scratch.t != Value::OBJECT) {
             std::stringstream ss;
             ss << "multi mode: top-level object was a " << type_str(scratch.t) << ", "
@@ -3068,30 +5652,19 @@ class Interpreter {
         }
         auto *obj = static_cast<HeapObject *>(scratch.v.h);
         runInvariants(loc, obj);
-        std::map<UString, const Identifier *> fields;
-        for (const auto &f : objectFields(obj, true)) {
-            fields[f->name] = f;
-        }
-        for (const auto &f : fields) {
-            // pushes FRAME_CALL
-            const AST *body = objectIndex(loc, obj, f.second, 0);
-            stack.top().val = scratch;
-            evaluate(body, stack.size());
-            auto vstr =
-                string ? manifestString(body->location) : manifestJson(body->location, true, U"");
-            // Reset scratch so that the object we're manifesting doesn't
-            // get GC'd.
-            scratch = stack.top().val;
-            stack.pop();
-            r[encode_utf8(f.first)] = encode_utf8(vstr);
+        for (const auto &f : sortedFields(obj, false)) {
+            LocationRange floc = enterField(loc, obj, f);
+            auto vstr = string ? manifestString(floc) : manifestJson(floc, true, U"");
+            leaveElement();
+            r[encode_utf8(f->name)] = encode_utf8(vstr);
         }
         return r;
     }
 
-    std::vector<std::string> manifestStream(void)
+    std::vector<std::string> manifestStream(bool string)
     {
         std::vector<std::string> r;
-        LocationRange loc("During manifestation");
+        LocationRange loc(alloc->makeFileName("During manifestation"));
         if (scratch.t != Value::ARRAY) {
             std::stringstream ss;
             ss << "stream mode: top-level object was a " << type_str(scratch.t) << ", "
@@ -3100,22 +5673,10 @@ class Interpreter {
             throw makeError(loc, ss.str());
         }
         auto *arr = static_cast<HeapArray *>(scratch.v.h);
-        for (auto *thunk : arr->elements) {
-            LocationRange tloc = thunk->body == nullptr ? loc : thunk->body->location;
-            if (thunk->filled) {
-                stack.newCall(loc, thunk, nullptr, 0, BindingFrame{});
-                // Keep arr alive when scratch is overwritten
-                stack.top().val = scratch;
-                scratch = thunk->content;
-            } else {
-                stack.newCall(loc, thunk, thunk->self, thunk->offset, thunk->upValues);
-                // Keep arr alive when scratch is overwritten
-                stack.top().val = scratch;
-                evaluate(thunk->body, stack.size());
-            }
-            UString element = manifestJson(tloc, true, U"");
-            scratch = stack.top().val;
-            stack.pop();
+        for (size_t i = 0; i < arr->size(); ++i) {
+            LocationRange tloc = enterElement(loc, arr->at(i));
+            UString element = string ? manifestString(tloc) : manifestJson(tloc, true, U"");
+            leaveElement();
             r.push_back(encode_utf8(element));
         }
         return r;
@@ -3124,11 +5685,88 @@ class Interpreter {
 
 }  // namespace
 
+void VmAstCache::evict(unsigned size)
+{
+    while (entries.size() > size) {
+        index.erase(entries.back().first);
+        entries.pop_back();
+    }
+}
+
+void VmAstCache::setCapacity(unsigned v)
+{
+    capacity = v;
+    evict(capacity);
+}
+
+std::shared_ptr<const VmCachedAst> VmAstCache::get(const std::string &path,
+                                                   const std::string &content)
+{
+    auto it = index.find(Key(path, md5(content)));
+    if (it == index.end())
+        return nullptr;
+    entries.splice(entries.begin(), entries, it->second);
+    return it->second->second;
+}
+
+void VmAstCache::put(const std::string &path, const std::string &content,
+                     const std::shared_ptr<const VmCachedAst> &ast)
+{
+    if (capacity == 0)
+        return;
+    Key key(path, md5(content));
+    auto it = index.find(key);
+    if (it != index.end())
+        entries.erase(it->second);
+    evict(capacity - 1);
+    entries.emplace_front(key, ast);
+    index[key] = entries.begin();
+}
+
+void VmAstCache::invalidate(const std::string &path)
+{
+    auto it = index.lower_bound(Key(path, ""));
+    while (it != index.end() && it->first.first == path) {
+        entries.erase(it->second);
+        it = index.erase(it);
+    }
+}
+
+void VmAstCache::clear(void)
+{
+    entries.clear();
+    index.clear();
+}
+
 std::string jsonnet_vm_execute(Allocator *alloc, const AST *ast, const ExtMap &ext_vars,
                                unsigned max_stack, double gc_min_objects, double gc_growth_trigger,
                                const VmNativeCallbackMap &natives,
                                JsonnetImportCallback *import_callback, void *ctx,
-                               bool string_output)
+                               bool string_output, VmAstCache *import_cache)
+{
+    Interpreter vm(alloc,
+                   ext_vars,
+                   max_stack,
+                   gc_min_objects,
+                   gc_growth_trigger,
+                   natives,
+                   import_callback,
+                   ctx,
+                   import_cache);
+    vm.evaluateFile(ast);
+    LocationRange loc(alloc->makeFileName("During manifestation"));
+    if (string_output) {
+        return encode_utf8(vm.manifestString(loc));
+    } else {
+        return encode_utf8(vm.manifestJson(loc, true, U""));
+    }
+}
+
+std::unique_ptr<JsonnetJsonValue> jsonnet_vm_execute_json(
+    Allocator *alloc, const AST *ast, const ExtMap &ext_vars, unsigned max_stack,
+    double gc_min_objects, double gc_growth_trigger, const VmNativeCallbackMap &natives,
+    JsonnetImportCallback *import_callback, void *ctx, bool string_output,
+    VmAstCache *import_cache)
 {
     Interpreter vm(alloc,
                    ext_vars,
@@ -3137,12 +5775,16 @@ std::string jsonnet_vm_execute(Allocator *alloc, const AST *ast, const ExtMap &e
                    gc_growth_trigger,
                    natives,
                    import_callback,
-                   ctx);
-    vm.evaluate(ast, 0);
+                   ctx,
+                   import_cache);
+    vm.evaluateFile(ast);
+    LocationRange loc(alloc->makeFileName("During manifestation"));
     if (string_output) {
-        return encode_utf8(vm.manifestString(LocationRange("During manifestation")));
+        std::unique_ptr<JsonnetJsonValue> r(new JsonnetJsonValue(
+            JsonnetJsonValue::STRING, encode_utf8(vm.manifestString(loc)), 0));
+        return r;
     } else {
-        return encode_utf8(vm.manifestJson(LocationRange("During manifestation"), true, U""));
+        return vm.manifestJsonValue(loc);
     }
 }
 
@@ -3150,7 +5792,7 @@ StrMap jsonnet_vm_execute_multi(Allocator *alloc, const AST *ast, const ExtMap &
                                 unsigned max_stack, double gc_min_objects, double gc_growth_trigger,
                                 const VmNativeCallbackMap &natives,
                                 JsonnetImportCallback *import_callback, void *ctx,
-                                bool string_output)
+                                bool string_output, VmAstCache *import_cache)
 {
     Interpreter vm(alloc,
                    ext_vars,
@@ -3159,8 +5801,9 @@ StrMap jsonnet_vm_execute_multi(Allocator *alloc, const AST *ast, const ExtMap &
                    gc_growth_trigger,
                    natives,
                    import_callback,
-                   ctx);
-    vm.evaluate(ast, 0);
+                   ctx,
+                   import_cache);
+    vm.evaluateFile(ast);
     return vm.manifestMulti(string_output);
 }
 
@@ -3169,7 +5812,8 @@ std::vector<std::string> jsonnet_vm_execute_stream(Allocator *alloc, const AST *
                                                    double gc_min_objects, double gc_growth_trigger,
                                                    const VmNativeCallbackMap &natives,
                                                    JsonnetImportCallback *import_callback,
-                                                   void *ctx)
+                                                   void *ctx, bool string_output,
+                                                   VmAstCache *import_cache)
 {
     Interpreter vm(alloc,
                    ext_vars,
@@ -3178,7 +5822,8 @@ std::vector<std::string> jsonnet_vm_execute_stream(Allocator *alloc, const AST *
                    gc_growth_trigger,
                    natives,
                    import_callback,
-                   ctx);
-    vm.evaluate(ast, 0);
-    return vm.manifestStream();
+                   ctx,
+                   import_cache);
+    vm.evaluateFile(ast);
+    return vm.manifestStream(string_output);
 }
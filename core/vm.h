@@ -17,6 +17,9 @@ limitations under the License.
 #ifndef JSONNET_VM_H
 #define JSONNET_VM_H
 
+#include <list>
+#include <memory>
+
 #include <libjsonnet.h>
 
 #include "ast.h"
@@ -24,7 +27,7 @@ limitations under the License.
 /** A single line of a stack trace from a runtime error.
  */
 struct TraceFrame {
-    LocationRange location;
+    ErrorLocation location;
     std::string name;
     TraceFrame(const LocationRange &location, const std::string &name = "")
         : location(location), name(name)
@@ -61,6 +64,54 @@ struct VmExt {
     VmExt(const std::string &data, bool is_code) : data(data), isCode(is_code) {}
 };
 
+/** A file that has been lexed, parsed, desugared and statically analysed. */
+struct VmCachedAst {
+    Allocator alloc;
+    AST *ast;
+};
+
+/** Parsed imports that are kept by a JsonnetVm from one execution to the next.
+ *
+ * Entries are keyed by the path the file was found at and the md5 of its content, so a file
+ * that has changed is simply parsed again.  When full, the least recently used entry is dropped.
+ * Executions hold a reference to each entry they use, so it stays valid even if evicted.
+ */
+class VmAstCache {
+    typedef std::pair<std::string, std::string> Key;
+    typedef std::list<std::pair<Key, std::shared_ptr<const VmCachedAst>>> Entries;
+
+    /** Maximum number of entries, 0 to disable the cache. */
+    unsigned capacity;
+
+    /** Most recently used first. */
+    Entries entries;
+
+    std::map<Key, Entries::iterator> index;
+
+    void evict(unsigned size);
+
+   public:
+    VmAstCache(void) : capacity(0) {}
+
+    unsigned getCapacity(void) const
+    {
+        return capacity;
+    }
+
+    void setCapacity(unsigned v);
+
+    /** Returns the entry for the file, or nullptr. */
+    std::shared_ptr<const VmCachedAst> get(const std::string &path, const std::string &content);
+
+    void put(const std::string &path, const std::string &content,
+             const std::shared_ptr<const VmCachedAst> &ast);
+
+    /** Drop every entry for the given path. */
+    void invalidate(const std::string &path);
+
+    void clear(void);
+};
+
 /** Execute the program and return the value as a JSON string.
  *
  * \param alloc The allocator used to create the ast.
@@ -72,6 +123,7 @@ struct VmExt {
  * \param import_callback A callback to handle imports
  * \param import_callback_ctx Context param for the import callback.
  * \param output_string Whether to expect a string and output it without JSON encoding
+ * \param import_cache Parsed imports kept between executions, or nullptr.
  * \throws RuntimeError reports runtime errors in the program.
  * \returns The JSON result in string form.
  */
@@ -80,7 +132,31 @@ std::string jsonnet_vm_execute(Allocator *alloc, const AST *ast,
                                double gc_min_objects, double gc_growth_trigger,
                                const VmNativeCallbackMap &natives,
                                JsonnetImportCallback *import_callback, void *import_callback_ctx,
-                               bool string_output);
+                               bool string_output, VmAstCache *import_cache);
+
+/** Execute the program and return the value as a tree of JSON values.
+ *
+ * This is equivalent to parsing the output of jsonnet_vm_execute, but without going through a
+ * string.
+ *
+ * \param alloc The allocator used to create the ast.
+ * \param ast The program to execute.
+ * \param ext The external vars / code.
+ * \param max_stack Recursion beyond this level gives an error.
+ * \param gc_min_objects The garbage collector does not run when the heap is this small.
+ * \param gc_growth_trigger Growth since last garbage collection cycle to trigger a new cycle.
+ * \param import_callback A callback to handle imports
+ * \param import_callback_ctx Context param for the import callback.
+ * \param output_string Whether to expect a string and output it as a string value
+ * \param import_cache Parsed imports kept between executions, or nullptr.
+ * \throws RuntimeError reports runtime errors in the program.
+ * \returns The JSON result.
+ */
+std::unique_ptr<JsonnetJsonValue> jsonnet_vm_execute_json(
+    Allocator *alloc, const AST *ast, const std::map<std::string, VmExt> &ext, unsigned max_stack,
+    double gc_min_objects, double gc_growth_trigger, const VmNativeCallbackMap &natives,
+    JsonnetImportCallback *import_callback, void *import_callback_ctx, bool string_output,
+    VmAstCache *import_cache);
 
 /** Execute the program and return the value as a number of named JSON files.
  *
@@ -96,13 +172,15 @@ std::string jsonnet_vm_execute(Allocator *alloc, const AST *ast,
  * \param import_callback A callback to handle imports
  * \param import_callback_ctx Context param for the import callback.
  * \param output_string Whether to expect a string and output it without JSON encoding
+ * \param import_cache Parsed imports kept between executions, or nullptr.
  * \throws RuntimeError reports runtime errors in the program.
  * \returns A mapping from filename to the JSON strings for that file.
  */
 std::map<std::string, std::string> jsonnet_vm_execute_multi(
     Allocator *alloc, const AST *ast, const std::map<std::string, VmExt> &ext, unsigned max_stack,
     double gc_min_objects, double gc_growth_trigger, const VmNativeCallbackMap &natives,
-    JsonnetImportCallback *import_callback, void *import_callback_ctx, bool string_output);
+    JsonnetImportCallback *import_callback, void *import_callback_ctx, bool string_output,
+    VmAstCache *import_cache);
 
 /** Execute the program and return the value as a stream of JSON files.
  *
@@ -119,12 +197,14 @@ std::map<std::string, std::string> jsonnet_vm_execute_multi(
  * \param import_callback A callback to handle imports
  * \param import_callback_ctx Context param for the import callback.
  * \param output_string Whether to expect a string and output it without JSON encoding
+ * \param import_cache Parsed imports kept between executions, or nullptr.
  * \throws RuntimeError reports runtime errors in the program.
  * \returns A mapping from filename to the JSON strings for that file.
  */
 std::vector<std::string> jsonnet_vm_execute_stream(
     Allocator *alloc, const AST *ast, const std::map<std::string, VmExt> &ext, unsigned max_stack,
     double gc_min_objects, double gc_growth_trigger, const VmNativeCallbackMap &natives,
-    JsonnetImportCallback *import_callback, void *import_callback_ctx);
+    JsonnetImportCallback *import_callback, void *import_callback_ctx, bool string_output,
+    VmAstCache *import_cache);
 
 #endif
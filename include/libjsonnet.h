@@ -95,6 +95,32 @@ int jsonnet_json_extract_bool(struct JsonnetVm *vm, const struct JsonnetJsonValu
  */
 int jsonnet_json_extract_null(struct JsonnetVm *vm, const struct JsonnetJsonValue *v);
 
+/** If the value is an array, return 1 and store the number of elements in out, otherwise return 0.
+ */
+int jsonnet_json_extract_array(struct JsonnetVm *vm, const struct JsonnetJsonValue *v,
+                               size_t *out);
+
+/** Return the element of the array at index i, or NULL if the value is not an array or i is out
+ * of bounds.
+ */
+const struct JsonnetJsonValue *jsonnet_json_array_element(struct JsonnetVm *vm,
+                                                          const struct JsonnetJsonValue *arr,
+                                                          size_t i);
+
+/** If the value is an object, return 1 and store the number of fields in out, otherwise return 0.
+ */
+int jsonnet_json_extract_object(struct JsonnetVm *vm, const struct JsonnetJsonValue *v,
+                                size_t *out);
+
+/** Return the name of the field of the object at index i, and store its value in *v.
+ *
+ * Fields are ordered by name.  Visiting them in order, from 0, takes linear time overall.
+ *
+ * \returns The field name as UTF8, or NULL if the value is not an object or i is out of bounds.
+ */
+const char *jsonnet_json_object_field(struct JsonnetVm *vm, const struct JsonnetJsonValue *obj,
+                                      size_t i, const struct JsonnetJsonValue **v);
+
 /** Convert the given UTF8 string to a JsonnetJsonValue.
  */
 struct JsonnetJsonValue *jsonnet_json_make_string(struct JsonnetVm *vm, const char *v);
@@ -124,7 +150,7 @@ void jsonnet_json_array_append(struct JsonnetVm *vm, struct JsonnetJsonValue *ar
 
 /** Make a JsonnetJsonValue representing an object with the given number of fields.
  *
- * Every index of the array must have a unique value assigned with jsonnet_json_array_element.
+ * Assign fields with jsonnet_json_object_append.
  */
 struct JsonnetJsonValue *jsonnet_json_make_object(struct JsonnetVm *vm);
 
@@ -147,6 +173,8 @@ void jsonnet_json_destroy(struct JsonnetVm *vm, struct JsonnetJsonValue *v);
  * along with the objects rooted at argv by libjsonnet when no-longer needed.  Return a string upon
  * failure, which will appear in Jsonnet as an error.  The argv pointer is an array whose size
  * matches the array of parameters supplied when the native callback was originally registered.
+ * Arguments may be any JSON value, including arrays and objects, which are fully manifested
+ * (hidden fields are omitted) before the callback is called.
  *
  * \param ctx User pointer, given in jsonnet_native_callback.
  * \param argv Array of arguments from Jsonnet code.
@@ -210,6 +238,33 @@ void jsonnet_tla_var(struct JsonnetVm *vm, const char *key, const char *val);
  */
 void jsonnet_tla_code(struct JsonnetVm *vm, const char *key, const char *val);
 
+/** Unbind all external vars, so the VM can be reused with a different set.
+ */
+void jsonnet_ext_clear(struct JsonnetVm *vm);
+
+/** Unbind all top-level arguments, so the VM can be reused with a different set.
+ */
+void jsonnet_tla_clear(struct JsonnetVm *vm);
+
+/** Set the maximum number of imported files kept parsed by the VM between evaluations.
+ *
+ * Imported files are still read on every evaluation, but one whose path and content match a kept
+ * file is not lexed, parsed and desugared again.  When full, the least recently used file is
+ * dropped.  The default, 0, disables the cache.
+ *
+ * Memory used for the file names and ASTs of an evaluation is released when it finishes, except
+ * for the files kept in this cache, which are released when they are dropped or the VM is
+ * destroyed.  Evaluating many differently named snippets or files with one VM therefore does
+ * not accumulate memory beyond the cache.
+ */
+void jsonnet_import_cache_size(struct JsonnetVm *vm, unsigned v);
+
+/** Drop the given path from the import cache, or every file if path is NULL.
+ *
+ * The path is the one the file was found at, as given to the import callback's found_here.
+ */
+void jsonnet_import_cache_invalidate(struct JsonnetVm *vm, const char *path);
+
 /** Set the number of lines of stack trace to display (0 for all of them). */
 void jsonnet_max_trace(struct JsonnetVm *vm, unsigned v);
 
@@ -241,6 +296,33 @@ char *jsonnet_evaluate_file(struct JsonnetVm *vm, const char *filename, int *err
 char *jsonnet_evaluate_snippet(struct JsonnetVm *vm, const char *filename, const char *snippet,
                                int *error);
 
+/** Evaluate a file containing Jsonnet code, return the JSON value without encoding it as a
+ * string.
+ *
+ * The returned value should be cleaned up with jsonnet_json_destroy.  If jsonnet_string_output
+ * is set, the value is the top-level string.
+ *
+ * \param filename Path to a file containing Jsonnet code.
+ * \param error Return by reference whether or not there was an error.
+ * \returns Either the JSON value or a string value holding the error message.
+ */
+struct JsonnetJsonValue *jsonnet_evaluate_file_json(struct JsonnetVm *vm, const char *filename,
+                                                    int *error);
+
+/** Evaluate a string containing Jsonnet code, return the JSON value without encoding it as a
+ * string.
+ *
+ * The returned value should be cleaned up with jsonnet_json_destroy.  If jsonnet_string_output
+ * is set, the value is the top-level string.
+ *
+ * \param filename Path to a file (used in error messages).
+ * \param snippet Jsonnet code to execute.
+ * \param error Return by reference whether or not there was an error.
+ * \returns Either the JSON value or a string value holding the error message.
+ */
+struct JsonnetJsonValue *jsonnet_evaluate_snippet_json(struct JsonnetVm *vm, const char *filename,
+                                                       const char *snippet, int *error);
+
 /** Evaluate a file containing Jsonnet code, return a number of named JSON files.
  *
  * The returned character buffer contains an even number of strings, the filename and JSON for each
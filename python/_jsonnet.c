@@ -40,6 +40,84 @@ static const char *exc_to_str(void)
 #endif
 }
 
+/* Take the GIL from within a callback.
+ *
+ * Evaluations started from a Python thread release the GIL with PyEval_SaveThread and leave the
+ * thread state in *py_thread.  Evaluations running on our own native threads have no thread state
+ * to restore, which is signalled by py_thread being NULL, so they use the GILState API instead.
+ */
+static PyGILState_STATE callback_enter(PyThreadState **py_thread)
+{
+    if (py_thread == NULL) return PyGILState_Ensure();
+    PyEval_RestoreThread(*py_thread);
+    return PyGILState_UNLOCKED;
+}
+
+/* Release the GIL taken with callback_enter. */
+static void callback_leave(PyThreadState **py_thread, PyGILState_STATE gil)
+{
+    if (py_thread == NULL) {
+        PyGILState_Release(gil);
+    } else {
+        *py_thread = PyEval_SaveThread();
+    }
+}
+
+/** Convert a JSON value from the Jsonnet VM into the equivalent Python value.
+ *
+ * \returns A new reference, or NULL with exception set upon failure.
+ */
+static PyObject *jsonnet_json_to_python(struct JsonnetVm *vm, const struct JsonnetJsonValue *v)
+{
+    double d;
+    size_t num, i;
+    int b;
+    const char *str = jsonnet_json_extract_string(vm, v);
+
+    if (str != NULL) {
+#if PY_MAJOR_VERSION >= 3
+        return PyUnicode_FromString(str);
+#else
+        return PyString_FromString(str);
+#endif
+    } else if (jsonnet_json_extract_null(vm, v)) {
+        Py_RETURN_NONE;
+    } else if ((b = jsonnet_json_extract_bool(vm, v)) != 2) {
+        return PyBool_FromLong(b);
+    } else if (jsonnet_json_extract_number(vm, v, &d)) {
+        return PyFloat_FromDouble(d);
+    } else if (jsonnet_json_extract_array(vm, v, &num)) {
+        PyObject *list = PyList_New(num);
+        if (list == NULL) return NULL;
+        for (i = 0; i < num; ++i) {
+            PyObject *el = jsonnet_json_to_python(vm, jsonnet_json_array_element(vm, v, i));
+            if (el == NULL) {
+                Py_DECREF(list);
+                return NULL;
+            }
+            PyList_SET_ITEM(list, i, el);
+        }
+        return list;
+    } else if (jsonnet_json_extract_object(vm, v, &num)) {
+        PyObject *dict = PyDict_New();
+        if (dict == NULL) return NULL;
+        for (i = 0; i < num; ++i) {
+            const struct JsonnetJsonValue *field_value;
+            const char *field = jsonnet_json_object_field(vm, v, i, &field_value);
+            PyObject *val = jsonnet_json_to_python(vm, field_value);
+            if (val == NULL || PyDict_SetItemString(dict, field, val) < 0) {
+                Py_XDECREF(val);
+                Py_DECREF(dict);
+                return NULL;
+            }
+            Py_DECREF(val);
+        }
+        return dict;
+    }
+    PyErr_SetString(PyExc_RuntimeError, "Unrecognized JSON value from Jsonnet.");
+    return NULL;
+}
+
 struct NativeCtx {
     struct JsonnetVm *vm;
     PyThreadState **py_thread;
@@ -138,41 +216,24 @@ static struct JsonnetJsonValue *cpython_native_callback(
     void *ctx_, const struct JsonnetJsonValue * const *argv, int *succ)
 {
     const struct NativeCtx *ctx = ctx_;
-    int i;
+    size_t i;
 
-    PyEval_RestoreThread(*ctx->py_thread);
+    PyGILState_STATE gil = callback_enter(ctx->py_thread);
 
-    PyObject *arglist;  // Will hold a tuple of strings.
+    PyObject *arglist;  // Will hold a tuple of JSON values.
     PyObject *result;  // Will hold a string.
 
     // Populate python function args.
     arglist = PyTuple_New(ctx->argc);
     for (i = 0; i < ctx->argc; ++i) {
-        double d;
-        const char *param_str = jsonnet_json_extract_string(ctx->vm, argv[i]);
-        int param_null = jsonnet_json_extract_null(ctx->vm, argv[i]);
-        int param_bool = jsonnet_json_extract_bool(ctx->vm, argv[i]);
-        int param_num = jsonnet_json_extract_number(ctx->vm, argv[i], &d);
-        PyObject *pyobj;
-        if (param_str != NULL) {
-#if PY_MAJOR_VERSION >= 3
-            pyobj = PyUnicode_FromString(param_str);
-#else
-            pyobj = PyString_FromString(param_str);
-#endif
-        } else if (param_null) {
-            pyobj = Py_None;
-        } else if (param_bool != 2) {
-            pyobj = PyBool_FromLong(param_bool);
-        } else if (param_num) {
-            pyobj = PyFloat_FromDouble(d);
-        } else {
-            // TODO(dcunnin): Support arrays (to tuples).
-            // TODO(dcunnin): Support objects (to dicts).
+        PyObject *pyobj = jsonnet_json_to_python(ctx->vm, argv[i]);
+        if (pyobj == NULL) {
+            struct JsonnetJsonValue *r = jsonnet_json_make_string(ctx->vm, exc_to_str());
             Py_DECREF(arglist);
             *succ = 0;
-            *ctx->py_thread = PyEval_SaveThread();
-            return jsonnet_json_make_string(ctx->vm, "Non-primitive param.");
+            PyErr_Clear();
+            callback_leave(ctx->py_thread, gil);
+            return r;
         }
         PyTuple_SetItem(arglist, i, pyobj);
     }
@@ -186,19 +247,20 @@ static struct JsonnetJsonValue *cpython_native_callback(
         struct JsonnetJsonValue *r = jsonnet_json_make_string(ctx->vm, exc_to_str());
         *succ = 0;
         PyErr_Clear();
-        *ctx->py_thread = PyEval_SaveThread();
+        callback_leave(ctx->py_thread, gil);
         return r;
     }
 
     const char *err_msg;
     struct JsonnetJsonValue *r = python_to_jsonnet_json(ctx->vm, result, &err_msg);
+    Py_DECREF(result);
     if (r != NULL) {
         *succ = 1;
     } else {
         *succ = 0;
         r = jsonnet_json_make_string(ctx->vm, err_msg);
     }
-    *ctx->py_thread = PyEval_SaveThread();
+    callback_leave(ctx->py_thread, gil);
     return r;
 }
 
@@ -216,7 +278,7 @@ static char *cpython_import_callback(void *ctx_, const char *base, const char *r
     PyObject *arglist, *result;
     char *out;
 
-    PyEval_RestoreThread(*ctx->py_thread);
+    PyGILState_STATE gil = callback_enter(ctx->py_thread);
     arglist = Py_BuildValue("(s, s)", base, rel);
     result = PyEval_CallObject(ctx->callback, arglist);
     Py_DECREF(arglist);
@@ -226,7 +288,7 @@ static char *cpython_import_callback(void *ctx_, const char *base, const char *r
         char *out = jsonnet_str(ctx->vm, exc_to_str());
         *success = 0;
         PyErr_Clear();
-        *ctx->py_thread = PyEval_SaveThread();
+        callback_leave(ctx->py_thread, gil);
         return out;
     }
 
@@ -261,7 +323,7 @@ static char *cpython_import_callback(void *ctx_, const char *base, const char *r
     }
 
     Py_DECREF(result);
-    *ctx->py_thread = PyEval_SaveThread();
+    callback_leave(ctx->py_thread, gil);
 
     return out;
 }
@@ -271,7 +333,6 @@ static PyObject *handle_result(struct JsonnetVm *vm, char *out, int error)
     if (error) {
         PyErr_SetString(PyExc_RuntimeError, out);
         jsonnet_realloc(vm, out, 0);
-        jsonnet_destroy(vm);
         return NULL;
     } else {
 #if PY_MAJOR_VERSION >= 3
@@ -280,11 +341,130 @@ static PyObject *handle_result(struct JsonnetVm *vm, char *out, int error)
         PyObject *ret = PyString_FromString(out);
 #endif
         jsonnet_realloc(vm, out, 0);
-        jsonnet_destroy(vm);
         return ret;
     }
 }
 
+static PyObject *handle_json_result(struct JsonnetVm *vm, struct JsonnetJsonValue *v, int error)
+{
+    PyObject *ret;
+    if (error) {
+        PyErr_SetString(PyExc_RuntimeError, jsonnet_json_extract_string(vm, v));
+        ret = NULL;
+    } else {
+        ret = jsonnet_json_to_python(vm, v);
+    }
+    jsonnet_json_destroy(vm, v);
+    return ret;
+}
+
+static PyObject *handle_multi_result(struct JsonnetVm *vm, char *out, int error)
+{
+    PyObject *ret;
+    const char *p = out;
+
+    if (error) return handle_result(vm, out, error);
+
+    /* The buffer holds pairs of filename and JSON strings, each terminated by \0, followed by
+     * a final \0. */
+    ret = PyDict_New();
+    while (ret != NULL && *p != '\0') {
+        const char *filename = p;
+        const char *json = filename + strlen(filename) + 1;
+        size_t json_len = strlen(json);
+#if PY_MAJOR_VERSION >= 3
+        PyObject *val = PyUnicode_FromStringAndSize(json, json_len);
+#else
+        PyObject *val = PyString_FromStringAndSize(json, json_len);
+#endif
+        if (val == NULL || PyDict_SetItemString(ret, filename, val) < 0) {
+            Py_CLEAR(ret);
+        }
+        Py_XDECREF(val);
+        p = json + json_len + 1;
+    }
+    jsonnet_realloc(vm, out, 0);
+    return ret;
+}
+
+static PyObject *handle_stream_result(struct JsonnetVm *vm, char *out, int error)
+{
+    PyObject *ret;
+    const char *p = out;
+
+    if (error) return handle_result(vm, out, error);
+
+    /* The buffer holds documents, each terminated by \0, followed by a final \0. */
+    ret = PyList_New(0);
+    while (ret != NULL && *p != '\0') {
+        size_t len = strlen(p);
+#if PY_MAJOR_VERSION >= 3
+        PyObject *doc = PyUnicode_FromStringAndSize(p, len);
+#else
+        PyObject *doc = PyString_FromStringAndSize(p, len);
+#endif
+        if (doc == NULL || PyList_Append(ret, doc) < 0) {
+            Py_CLEAR(ret);
+        }
+        Py_XDECREF(doc);
+        p += len + 1;
+    }
+    jsonnet_realloc(vm, out, 0);
+    return ret;
+}
+
+/* What an evaluation produces, which determines the jsonnet_evaluate_* function used. */
+enum EvalKind {
+    /* A JSON string. */
+    EVAL_JSON,
+    /* The Python equivalent of the JSON value. */
+    EVAL_PYTHON,
+    /* A dict from filename to JSON string. */
+    EVAL_MULTI,
+    /* A list of JSON strings. */
+    EVAL_STREAM
+};
+
+/** Evaluate a file (if src is NULL) or snippet with the GIL released.
+ *
+ * \returns The result according to kind, or NULL with exception set upon failure.
+ */
+static PyObject *do_evaluate(struct JsonnetVm *vm, PyThreadState **py_thread,
+                             const char *filename, const char *src, enum EvalKind kind)
+{
+    char *out = NULL;
+    struct JsonnetJsonValue *json = NULL;
+    int error;
+
+    *py_thread = PyEval_SaveThread();
+    switch (kind) {
+        case EVAL_JSON:
+            out = src == NULL ? jsonnet_evaluate_file(vm, filename, &error)
+                              : jsonnet_evaluate_snippet(vm, filename, src, &error);
+            break;
+        case EVAL_PYTHON:
+            json = src == NULL ? jsonnet_evaluate_file_json(vm, filename, &error)
+                               : jsonnet_evaluate_snippet_json(vm, filename, src, &error);
+            break;
+        case EVAL_MULTI:
+            out = src == NULL ? jsonnet_evaluate_file_multi(vm, filename, &error)
+                              : jsonnet_evaluate_snippet_multi(vm, filename, src, &error);
+            break;
+        case EVAL_STREAM:
+            out = src == NULL ? jsonnet_evaluate_file_stream(vm, filename, &error)
+                              : jsonnet_evaluate_snippet_stream(vm, filename, src, &error);
+            break;
+    }
+    PyEval_RestoreThread(*py_thread);
+
+    switch (kind) {
+        case EVAL_PYTHON: return handle_json_result(vm, json, error);
+        case EVAL_MULTI: return handle_multi_result(vm, out, error);
+        case EVAL_STREAM: return handle_stream_result(vm, out, error);
+        default: return handle_result(vm, out, error);
+    }
+}
+
 int handle_vars(struct JsonnetVm *vm, PyObject *map, int code, int tla)
 {
     if (map == NULL) return 1;
@@ -299,7 +479,6 @@ int handle_vars(struct JsonnetVm *vm, PyObject *map, int code, int tla)
         const char *key_ = PyString_AsString(key);
 #endif
         if (key_ == NULL) {
-            jsonnet_destroy(vm);
             return 0;
         }
 #if PY_MAJOR_VERSION >= 3
@@ -308,7 +487,6 @@ int handle_vars(struct JsonnetVm *vm, PyObject *map, int code, int tla)
         const char *val_ = PyString_AsString(val);
 #endif
         if (val_ == NULL) {
-            jsonnet_destroy(vm);
             return 0;
         }
         if (!tla && !code) {
@@ -330,7 +508,6 @@ int handle_import_callback(struct ImportCtx *ctx, PyObject *import_callback)
     if (import_callback == NULL) return 1;
 
     if (!PyCallable_Check(import_callback)) {
-        jsonnet_destroy(ctx->vm);
         PyErr_SetString(PyExc_TypeError, "import_callback must be callable");
         return 0;
     }
@@ -372,19 +549,19 @@ static int handle_native_callbacks(struct JsonnetVm *vm, PyObject *native_callba
 #endif
         if (key_ == NULL) {
             PyErr_SetString(PyExc_TypeError, "native callback dict keys must be string");
-            goto bad;
+            return 0;
         }
         if (!PyTuple_Check(val)) {
             PyErr_SetString(PyExc_TypeError, "native callback dict values must be tuples");
-            goto bad;
+            return 0;
         } else if (PyTuple_Size(val) != 2) {
             PyErr_SetString(PyExc_TypeError, "native callback tuples must have size 2");
-            goto bad;
+            return 0;
         }
         params = PyTuple_GetItem(val, 0);
         if (!PyTuple_Check(params)) {
             PyErr_SetString(PyExc_TypeError, "native callback params must be a tuple");
-            goto bad;
+            return 0;
         }
         /* Check the params are all strings */
         num_params = PyTuple_Size(params);
@@ -396,20 +573,15 @@ static int handle_native_callbacks(struct JsonnetVm *vm, PyObject *native_callba
             if (!PyString_Check(param)) {
 #endif
                 PyErr_SetString(PyExc_TypeError, "native callback param must be string");
-                goto bad;
+                return 0;
             }
         }
         if (!PyCallable_Check(PyTuple_GetItem(val, 1))) {
             PyErr_SetString(PyExc_TypeError, "native callback must be callable");
-            goto bad;
+            return 0;
         }
 
         num_natives++;
-        continue;
-
-        bad:
-        jsonnet_destroy(vm);
-        return 0;
     }
 
     if (num_natives == 0) {
@@ -456,190 +628,1168 @@ static int handle_native_callbacks(struct JsonnetVm *vm, PyObject *native_callba
 }
 
 
-static PyObject* evaluate_file(PyObject* self, PyObject* args, PyObject *keywds)
-{
-    const char *filename;
-    char *out;
-    const char *jpath_str;
-    unsigned max_stack = 500, gc_min_objects = 1000, max_trace = 20;
-    double gc_growth_trigger = 2;
-    int error;
-    Py_ssize_t num_jpathdir, i;
-    PyObject *jpathdir = NULL;
-    PyObject *ext_vars = NULL, *ext_codes = NULL;
-    PyObject *tla_vars = NULL, *tla_codes = NULL;
-    PyObject *import_callback = NULL;
-    PyObject *native_callbacks = NULL;
-    struct JsonnetVm *vm;
-    static char *kwlist[] = {
-        "filename", "jpathdir",
-        "max_stack", "gc_min_objects", "gc_growth_trigger", "ext_vars",
-        "ext_codes", "tla_vars", "tla_codes", "max_trace", "import_callback",
-        "native_callbacks",
-        NULL
-    };
+/* The keyword arguments shared by every entry point that configures a Jsonnet VM. */
+struct VmConfig {
+    PyObject *jpathdir;
+    unsigned max_stack, gc_min_objects;
+    double gc_growth_trigger;
+    PyObject *ext_vars, *ext_codes;
+    PyObject *tla_vars, *tla_codes;
+    unsigned max_trace;
+    PyObject *import_callback;
+    PyObject *native_callbacks;
+    int string_output;
+    unsigned import_cache_size;
+};
 
-    (void) self;
+#define VM_CONFIG_DEFAULT { NULL, 500, 1000, 2, NULL, NULL, NULL, NULL, 20, NULL, NULL, 0, 0 }
 
-    if (!PyArg_ParseTupleAndKeywords(
-        args, keywds, "s|OIIdOOOOIOO", kwlist,
-        &filename, &jpathdir,
-        &max_stack, &gc_min_objects, &gc_growth_trigger, &ext_vars,
-        &ext_codes, &tla_vars, &tla_codes, &max_trace, &import_callback,
-        &native_callbacks)) {
-        return NULL;
-    }
+/* The keywords, PyArg_ParseTupleAndKeywords format and targets for a struct VmConfig. */
+#define VM_CONFIG_KWLIST \
+    "jpathdir", "max_stack", "gc_min_objects", "gc_growth_trigger", "ext_vars", "ext_codes", \
+    "tla_vars", "tla_codes", "max_trace", "import_callback", "native_callbacks", "string_output", \
+    "import_cache_size"
+#define VM_CONFIG_FORMAT "OIIdOOOOIOOiI"
+#define VM_CONFIG_ARGS(c) \
+    &(c).jpathdir, &(c).max_stack, &(c).gc_min_objects, &(c).gc_growth_trigger, &(c).ext_vars, \
+    &(c).ext_codes, &(c).tla_vars, &(c).tla_codes, &(c).max_trace, &(c).import_callback, \
+    &(c).native_callbacks, &(c).string_output, &(c).import_cache_size
 
-    PyThreadState *py_thread;
+static void handle_jpathdir(struct JsonnetVm *vm, PyObject *jpathdir)
+{
+    const char *jpath_str;
+    Py_ssize_t num_jpathdir, i;
 
-    vm = jsonnet_make();
-    jsonnet_max_stack(vm, max_stack);
-    jsonnet_gc_min_objects(vm, gc_min_objects);
-    jsonnet_max_trace(vm, max_trace);
-    jsonnet_gc_growth_trigger(vm, gc_growth_trigger);
+    if (jpathdir == NULL) return;
 
-    if (jpathdir != NULL) {
-        // Support string for backward compatibility with <= 0.15.0
+    // Support string for backward compatibility with <= 0.15.0
 #if PY_MAJOR_VERSION >= 3
-        if (PyUnicode_Check(jpathdir)) {
-            jpath_str = PyUnicode_AsUTF8(jpathdir);
+    if (PyUnicode_Check(jpathdir)) {
+        jpath_str = PyUnicode_AsUTF8(jpathdir);
 #else
-        if (PyString_Check(jpathdir)) {
-            jpath_str = PyString_AsString(jpathdir);
+    if (PyString_Check(jpathdir)) {
+        jpath_str = PyString_AsString(jpathdir);
 #endif
-            jsonnet_jpath_add(vm, jpath_str);
-        } else if (PyList_Check(jpathdir)) {
-            num_jpathdir = PyList_Size(jpathdir);
-            for (i = 0; i < num_jpathdir ; ++i) {
-                PyObject *jpath = PyList_GetItem(jpathdir, i);
+        jsonnet_jpath_add(vm, jpath_str);
+    } else if (PyList_Check(jpathdir)) {
+        num_jpathdir = PyList_Size(jpathdir);
+        for (i = 0; i < num_jpathdir ; ++i) {
+            PyObject *jpath = PyList_GetItem(jpathdir, i);
 #if PY_MAJOR_VERSION >= 3
-                if (PyUnicode_Check(jpath)) {
-                    jpath_str = PyUnicode_AsUTF8(jpath);
+            if (PyUnicode_Check(jpath)) {
+                jpath_str = PyUnicode_AsUTF8(jpath);
 #else
-                if (PyString_Check(jpath)) {
-                    jpath_str = PyString_AsString(jpath);
+            if (PyString_Check(jpath)) {
+                jpath_str = PyString_AsString(jpath);
 #endif
-                    jsonnet_jpath_add(vm, jpath_str);
-                }
+                jsonnet_jpath_add(vm, jpath_str);
             }
         }
     }
+}
 
-    if (!handle_vars(vm, ext_vars, 0, 0)) return NULL;
-    if (!handle_vars(vm, ext_codes, 1, 0)) return NULL;
-    if (!handle_vars(vm, tla_vars, 0, 1)) return NULL;
-    if (!handle_vars(vm, tla_codes, 1, 1)) return NULL;
+/** Apply the given configuration to a freshly made Jsonnet VM.
+ *
+ * The import_ctx must outlive the VM.  May set *ctxs, in which case it should be free()'d by
+ * caller after the VM is destroyed.
+ *
+ * \returns 1 on success, 0 with exception set upon failure.
+ */
+static int handle_config(struct JsonnetVm *vm, const struct VmConfig *config,
+                         struct ImportCtx *import_ctx, struct NativeCtx **ctxs,
+                         PyThreadState **py_thread)
+{
+    jsonnet_max_stack(vm, config->max_stack);
+    jsonnet_gc_min_objects(vm, config->gc_min_objects);
+    jsonnet_max_trace(vm, config->max_trace);
+    jsonnet_gc_growth_trigger(vm, config->gc_growth_trigger);
+    jsonnet_string_output(vm, config->string_output);
+    jsonnet_import_cache_size(vm, config->import_cache_size);
 
-    struct ImportCtx ctx = { vm, &py_thread, import_callback };
-    if (!handle_import_callback(&ctx, import_callback)) {
-        return NULL;
+    handle_jpathdir(vm, config->jpathdir);
+
+    if (!handle_vars(vm, config->ext_vars, 0, 0)) return 0;
+    if (!handle_vars(vm, config->ext_codes, 1, 0)) return 0;
+    if (!handle_vars(vm, config->tla_vars, 0, 1)) return 0;
+    if (!handle_vars(vm, config->tla_codes, 1, 1)) return 0;
+
+    import_ctx->vm = vm;
+    import_ctx->py_thread = py_thread;
+    import_ctx->callback = config->import_callback;
+    if (!handle_import_callback(import_ctx, config->import_callback)) return 0;
+
+    return handle_native_callbacks(vm, config->native_callbacks, ctxs, py_thread);
+}
+
+
+/** Parse the arguments of a module-level evaluation function.
+ *
+ * Where kind is EVAL_JSON, the python_output keyword may select EVAL_PYTHON instead.
+ *
+ * \returns 1 on success, 0 with exception set upon failure.
+ */
+static int evaluate_args(PyObject *args, PyObject *keywds, int snippet, enum EvalKind *kind,
+                         const char **filename, const char **src, struct VmConfig *config)
+{
+    int python_output = 0;
+    int ok;
+    static char *file_kwlist[] = {"filename", VM_CONFIG_KWLIST, NULL};
+    static char *file_python_kwlist[] = {"filename", VM_CONFIG_KWLIST, "python_output", NULL};
+    static char *snippet_kwlist[] = {"filename", "src", VM_CONFIG_KWLIST, NULL};
+    static char *snippet_python_kwlist[] = {
+        "filename", "src", VM_CONFIG_KWLIST, "python_output", NULL
+    };
+
+    *src = NULL;
+    if (snippet && *kind == EVAL_JSON) {
+        ok = PyArg_ParseTupleAndKeywords(args, keywds, "ss|" VM_CONFIG_FORMAT "i",
+                                         snippet_python_kwlist, filename, src,
+                                         VM_CONFIG_ARGS(*config), &python_output);
+    } else if (snippet) {
+        ok = PyArg_ParseTupleAndKeywords(args, keywds, "ss|" VM_CONFIG_FORMAT, snippet_kwlist,
+                                         filename, src, VM_CONFIG_ARGS(*config));
+    } else if (*kind == EVAL_JSON) {
+        ok = PyArg_ParseTupleAndKeywords(args, keywds, "s|" VM_CONFIG_FORMAT "i",
+                                         file_python_kwlist, filename, VM_CONFIG_ARGS(*config),
+                                         &python_output);
+    } else {
+        ok = PyArg_ParseTupleAndKeywords(args, keywds, "s|" VM_CONFIG_FORMAT, file_kwlist,
+                                         filename, VM_CONFIG_ARGS(*config));
     }
+    if (!ok) return 0;
+    if (python_output) *kind = EVAL_PYTHON;
+    return 1;
+}
+
+/* Parse the arguments of a module-level evaluation function, and run it with a fresh VM. */
+static PyObject *evaluate_aux(PyObject *args, PyObject *keywds, int snippet, enum EvalKind kind)
+{
+    const char *filename, *src;
+    struct VmConfig config = VM_CONFIG_DEFAULT;
+    struct JsonnetVm *vm;
+    PyObject *ret;
+
+    if (!evaluate_args(args, keywds, snippet, &kind, &filename, &src, &config)) return NULL;
+
+    PyThreadState *py_thread;
+    struct ImportCtx ctx;
     struct NativeCtx *ctxs = NULL;
-    if (!handle_native_callbacks(vm, native_callbacks, &ctxs, &py_thread)) {
+
+    vm = jsonnet_make();
+    if (!handle_config(vm, &config, &ctx, &ctxs, &py_thread)) {
+        jsonnet_destroy(vm);
         free(ctxs);
         return NULL;
     }
-    py_thread = PyEval_SaveThread();
-    out = jsonnet_evaluate_file(vm, filename, &error);
-    PyEval_RestoreThread(py_thread);
+    ret = do_evaluate(vm, &py_thread, filename, src, kind);
+    jsonnet_destroy(vm);
     free(ctxs);
-    return handle_result(vm, out, error);
+    return ret;
+}
+
+static PyObject* evaluate_file(PyObject* self, PyObject* args, PyObject *keywds)
+{
+    (void) self;
+    return evaluate_aux(args, keywds, 0, EVAL_JSON);
 }
 
 static PyObject* evaluate_snippet(PyObject* self, PyObject* args, PyObject *keywds)
 {
-    const char *filename, *src;
+    (void) self;
+    return evaluate_aux(args, keywds, 1, EVAL_JSON);
+}
+
+static PyObject* evaluate_file_multi(PyObject* self, PyObject* args, PyObject *keywds)
+{
+    (void) self;
+    return evaluate_aux(args, keywds, 0, EVAL_MULTI);
+}
+
+static PyObject* evaluate_snippet_multi(PyObject* self, PyObject* args, PyObject *keywds)
+{
+    (void) self;
+    return evaluate_aux(args, keywds, 1, EVAL_MULTI);
+}
+
+static PyObject* evaluate_file_stream(PyObject* self, PyObject* args, PyObject *keywds)
+{
+    (void) self;
+    return evaluate_aux(args, keywds, 0, EVAL_STREAM);
+}
+
+static PyObject* evaluate_snippet_stream(PyObject* self, PyObject* args, PyObject *keywds)
+{
+    (void) self;
+    return evaluate_aux(args, keywds, 1, EVAL_STREAM);
+}
+
+
+static char *copy_str(const char *str)
+{
+    char *out = malloc(strlen(str) + 1);
+    memcpy(out, str, strlen(str) + 1);
+    return out;
+}
+
+/* Return the UTF8 content of a Python string, or NULL if it is not a string. */
+static const char *py_str(PyObject *v)
+{
+#if PY_MAJOR_VERSION >= 3
+    return PyUnicode_Check(v) ? PyUnicode_AsUTF8(v) : NULL;
+#else
+    return PyString_Check(v) ? PyString_AsString(v) : NULL;
+#endif
+}
+
+/* An external var or top-level argument, copied out of Python so it can be used without the GIL. */
+struct BatchVar {
+    char *key, *val;
+    int code, tla;
+};
+
+/* One job of evaluate_many, and its result. */
+struct BatchJob {
+    char *filename;
+    /* NULL to evaluate the file. */
+    char *src;
+    struct BatchVar *vars;
+    size_t num_vars;
+
+    /* The VM that ran the job, and the result it gave. */
+    struct JsonnetVm *vm;
     char *out;
-    const char *jpath_str;
-    unsigned max_stack = 500, gc_min_objects = 1000, max_trace = 20;
-    double gc_growth_trigger = 2;
+    struct JsonnetJsonValue *json;
     int error;
-    Py_ssize_t num_jpathdir, i;
-    PyObject *jpathdir = NULL;
-    PyObject *ext_vars = NULL, *ext_codes = NULL;
-    PyObject *tla_vars = NULL, *tla_codes = NULL;
-    PyObject *import_callback = NULL;
-    PyObject *native_callbacks = NULL;
+};
+
+/* The state shared by the threads of one evaluate_many call. */
+struct Batch {
+    struct BatchJob *jobs;
+    size_t num_jobs;
+    /* Vars applied to every job, before its own. */
+    struct BatchVar *vars;
+    size_t num_vars;
+    int python_output;
+
+    /* Protects next and running. */
+    PyThread_type_lock mutex;
+    /* Index of the next job to run. */
+    size_t next;
+    /* Number of workers that have not yet finished. */
+    size_t running;
+    /* Held by the calling thread until the last worker finishes. */
+    PyThread_type_lock done;
+};
+
+/* A worker thread of evaluate_many, with its own VM. */
+struct BatchWorker {
+    struct Batch *batch;
     struct JsonnetVm *vm;
-    static char *kwlist[] = {
-        "filename", "src", "jpathdir",
-        "max_stack", "gc_min_objects", "gc_growth_trigger", "ext_vars",
-        "ext_codes", "tla_vars", "tla_codes", "max_trace", "import_callback",
-        "native_callbacks",
-        NULL
-    };
+    struct ImportCtx import_ctx;
+    struct NativeCtx *native_ctxs;
+};
+
+/** Append copies of the entries of map, which may be NULL or None, to *vars.
+ *
+ * \returns 1 on success, 0 with exception set upon failure.
+ */
+static int batch_vars(PyObject *map, int code, int tla, struct BatchVar **vars,
+                      size_t *num_vars)
+{
+    PyObject *key, *val;
+    Py_ssize_t pos = 0;
+
+    if (map == NULL || map == Py_None) return 1;
+    if (!PyDict_Check(map)) {
+        PyErr_SetString(PyExc_TypeError, "ext and tla vars must be dicts");
+        return 0;
+    }
+    *vars = realloc(*vars, sizeof(struct BatchVar) * (*num_vars + PyDict_Size(map)));
+    while (PyDict_Next(map, &pos, &key, &val)) {
+        const char *key_ = py_str(key), *val_ = py_str(val);
+        struct BatchVar *var;
+        if (key_ == NULL || val_ == NULL) {
+            if (!PyErr_Occurred())
+                PyErr_SetString(PyExc_TypeError, "ext and tla vars must map strings to strings");
+            return 0;
+        }
+        var = &(*vars)[(*num_vars)++];
+        var->key = copy_str(key_);
+        var->val = copy_str(val_);
+        var->code = code;
+        var->tla = tla;
+    }
+    return 1;
+}
+
+static void batch_vars_free(struct BatchVar *vars, size_t num_vars)
+{
+    size_t i;
+    for (i = 0; i < num_vars; ++i) {
+        free(vars[i].key);
+        free(vars[i].val);
+    }
+    free(vars);
+}
+
+static void batch_vars_apply(struct JsonnetVm *vm, const struct BatchVar *vars, size_t num_vars)
+{
+    size_t i;
+    for (i = 0; i < num_vars; ++i) {
+        const struct BatchVar *var = &vars[i];
+        if (!var->tla && !var->code) {
+            jsonnet_ext_var(vm, var->key, var->val);
+        } else if (!var->tla && var->code) {
+            jsonnet_ext_code(vm, var->key, var->val);
+        } else if (var->tla && !var->code) {
+            jsonnet_tla_var(vm, var->key, var->val);
+        } else {
+            jsonnet_tla_code(vm, var->key, var->val);
+        }
+    }
+}
+
+/** Copy a job of the form (filename or (filename, src), ext_vars, tla_vars) out of Python.
+ *
+ * A job can also be just the filename or (filename, src) pair.
+ *
+ * \returns 1 on success, 0 with exception set upon failure.
+ */
+static int batch_job(PyObject *job, struct BatchJob *j)
+{
+    PyObject *source = job, *ext_vars = NULL, *tla_vars = NULL;
+    const char *filename = NULL, *src = NULL;
+
+    if (PyTuple_Check(job) && PyTuple_Size(job) == 2 && py_str(PyTuple_GetItem(job, 1)) != NULL) {
+        /* Just a (filename, src) pair. */
+    } else if (PyTuple_Check(job) && PyTuple_Size(job) >= 1 && PyTuple_Size(job) <= 3) {
+        source = PyTuple_GetItem(job, 0);
+        if (PyTuple_Size(job) >= 2) ext_vars = PyTuple_GetItem(job, 1);
+        if (PyTuple_Size(job) >= 3) tla_vars = PyTuple_GetItem(job, 2);
+    }
+    if (PyTuple_Check(source) && PyTuple_Size(source) == 2) {
+        filename = py_str(PyTuple_GetItem(source, 0));
+        src = py_str(PyTuple_GetItem(source, 1));
+        if (src == NULL) filename = NULL;
+    } else {
+        filename = py_str(source);
+    }
+    if (filename == NULL) {
+        if (!PyErr_Occurred())
+            PyErr_SetString(PyExc_TypeError,
+                            "evaluate_many jobs must be (filename or (filename, src), "
+                            "ext_vars, tla_vars)");
+        return 0;
+    }
+    j->filename = copy_str(filename);
+    j->src = src == NULL ? NULL : copy_str(src);
+    if (!batch_vars(ext_vars, 0, 0, &j->vars, &j->num_vars)) return 0;
+    return batch_vars(tla_vars, 0, 1, &j->vars, &j->num_vars);
+}
+
+static void batch_worker(void *worker_)
+{
+    struct BatchWorker *worker = worker_;
+    struct Batch *batch = worker->batch;
+    struct JsonnetVm *vm = worker->vm;
+    int last;
+
+    for (;;) {
+        struct BatchJob *job;
+        PyThread_acquire_lock(batch->mutex, WAIT_LOCK);
+        job = batch->next < batch->num_jobs ? &batch->jobs[batch->next++] : NULL;
+        PyThread_release_lock(batch->mutex);
+        if (job == NULL) break;
+
+        jsonnet_ext_clear(vm);
+        jsonnet_tla_clear(vm);
+        batch_vars_apply(vm, batch->vars, batch->num_vars);
+        batch_vars_apply(vm, job->vars, job->num_vars);
+        job->vm = vm;
+        if (batch->python_output) {
+            job->json = job->src == NULL
+                ? jsonnet_evaluate_file_json(vm, job->filename, &job->error)
+                : jsonnet_evaluate_snippet_json(vm, job->filename, job->src, &job->error);
+        } else {
+            job->out = job->src == NULL
+                ? jsonnet_evaluate_file(vm, job->filename, &job->error)
+                : jsonnet_evaluate_snippet(vm, job->filename, job->src, &job->error);
+        }
+    }
+
+    PyThread_acquire_lock(batch->mutex, WAIT_LOCK);
+    last = --batch->running == 0;
+    PyThread_release_lock(batch->mutex);
+    if (last) PyThread_release_lock(batch->done);
+}
+
+/* Turn the result of a job into a Python value, or a RuntimeError instance if it failed. */
+static PyObject *batch_result(struct BatchJob *job)
+{
+    PyObject *ret;
+    if (job->json != NULL) {
+        if (job->error) {
+            ret = PyObject_CallFunction(PyExc_RuntimeError, "s",
+                                        jsonnet_json_extract_string(job->vm, job->json));
+        } else {
+            ret = jsonnet_json_to_python(job->vm, job->json);
+        }
+    } else if (job->error) {
+        ret = PyObject_CallFunction(PyExc_RuntimeError, "s", job->out);
+    } else {
+#if PY_MAJOR_VERSION >= 3
+        ret = PyUnicode_FromString(job->out);
+#else
+        ret = PyString_FromString(job->out);
+#endif
+    }
+    return ret;
+}
+
+static unsigned cpu_count(void)
+{
+    long n = 1;
+    PyObject *result = NULL;
+    PyObject *module = PyImport_ImportModule("multiprocessing");
+    if (module != NULL) {
+        result = PyObject_CallMethod(module, "cpu_count", NULL);
+    }
+    if (result != NULL) {
+        n = PyLong_AsLong(result);
+    }
+    Py_XDECREF(result);
+    Py_XDECREF(module);
+    PyErr_Clear();
+    return n < 1 ? 1 : (unsigned)n;
+}
+
+static PyObject* evaluate_many(PyObject* self, PyObject* args, PyObject *keywds)
+{
+    PyObject *jobs, *fast = NULL, *ret = NULL;
+    unsigned workers = 0, i;
+    int python_output = 0;
+    size_t j;
+    struct VmConfig config = VM_CONFIG_DEFAULT;
+    struct Batch batch;
+    struct BatchWorker *ws = NULL;
+    static char *kwlist[] = {"jobs", "workers", VM_CONFIG_KWLIST, "python_output", NULL};
 
     (void) self;
 
-    if (!PyArg_ParseTupleAndKeywords(
-        args, keywds, "ss|OIIdOOOOIOO", kwlist,
-        &filename, &src, &jpathdir,
-        &max_stack, &gc_min_objects, &gc_growth_trigger, &ext_vars,
-        &ext_codes, &tla_vars, &tla_codes, &max_trace, &import_callback,
-        &native_callbacks)) {
+    if (!PyArg_ParseTupleAndKeywords(args, keywds, "O|I" VM_CONFIG_FORMAT "i", kwlist, &jobs,
+                                     &workers, VM_CONFIG_ARGS(config), &python_output)) {
         return NULL;
     }
 
-    PyThreadState *py_thread;
+    memset(&batch, 0, sizeof(batch));
+    batch.python_output = python_output;
 
-    vm = jsonnet_make();
-    jsonnet_max_stack(vm, max_stack);
-    jsonnet_gc_min_objects(vm, gc_min_objects);
-    jsonnet_max_trace(vm, max_trace);
-    jsonnet_gc_growth_trigger(vm, gc_growth_trigger);
+    fast = PySequence_Fast(jobs, "evaluate_many jobs must be a sequence");
+    if (fast == NULL) return NULL;
+    batch.num_jobs = PySequence_Fast_GET_SIZE(fast);
+    batch.jobs = calloc(batch.num_jobs + 1, sizeof(struct BatchJob));
+    for (j = 0; j < batch.num_jobs; ++j) {
+        if (!batch_job(PySequence_Fast_GET_ITEM(fast, j), &batch.jobs[j])) goto cleanup;
+    }
+
+    /* The vars are applied afresh for every job, rather than once per VM. */
+    if (!batch_vars(config.ext_vars, 0, 0, &batch.vars, &batch.num_vars)) goto cleanup;
+    if (!batch_vars(config.ext_codes, 1, 0, &batch.vars, &batch.num_vars)) goto cleanup;
+    if (!batch_vars(config.tla_vars, 0, 1, &batch.vars, &batch.num_vars)) goto cleanup;
+    if (!batch_vars(config.tla_codes, 1, 1, &batch.vars, &batch.num_vars)) goto cleanup;
+    config.ext_vars = config.ext_codes = config.tla_vars = config.tla_codes = NULL;
+
+    if (workers == 0) workers = cpu_count();
+    if (workers > batch.num_jobs) workers = batch.num_jobs;
+
+    /* Callbacks from the workers find no saved thread state, so they use the GILState API. */
+    ws = calloc(workers + 1, sizeof(struct BatchWorker));
+    for (i = 0; i < workers; ++i) {
+        ws[i].batch = &batch;
+        ws[i].vm = jsonnet_make();
+        if (!handle_config(ws[i].vm, &config, &ws[i].import_ctx, &ws[i].native_ctxs, NULL))
+            goto cleanup;
+    }
+
+    if (workers > 0) {
+#if PY_VERSION_HEX < 0x03070000
+        PyEval_InitThreads();
+#endif
+        batch.mutex = PyThread_allocate_lock();
+        batch.done = PyThread_allocate_lock();
+        if (batch.mutex == NULL || batch.done == NULL) {
+            PyErr_NoMemory();
+            goto cleanup;
+        }
+        PyThread_acquire_lock(batch.done, WAIT_LOCK);
+        batch.running = workers;
+
+        Py_BEGIN_ALLOW_THREADS
+        /* This thread is the first worker. */
+        for (i = 1; i < workers; ++i) {
+            if (PyThread_start_new_thread(batch_worker, &ws[i]) == (unsigned long)-1) {
+                PyThread_acquire_lock(batch.mutex, WAIT_LOCK);
+                batch.running--;
+                PyThread_release_lock(batch.mutex);
+            }
+        }
+        batch_worker(&ws[0]);
+        PyThread_acquire_lock(batch.done, WAIT_LOCK);
+        PyThread_release_lock(batch.done);
+        Py_END_ALLOW_THREADS
+    }
+
+    ret = PyList_New(batch.num_jobs);
+    for (j = 0; ret != NULL && j < batch.num_jobs; ++j) {
+        PyObject *item = batch_result(&batch.jobs[j]);
+        if (item == NULL) {
+            Py_CLEAR(ret);
+        } else {
+            PyList_SET_ITEM(ret, j, item);
+        }
+    }
+
+cleanup:
+    for (j = 0; j < batch.num_jobs; ++j) {
+        struct BatchJob *job = &batch.jobs[j];
+        free(job->filename);
+        free(job->src);
+        batch_vars_free(job->vars, job->num_vars);
+        if (job->out != NULL) jsonnet_realloc(job->vm, job->out, 0);
+        if (job->json != NULL) jsonnet_json_destroy(job->vm, job->json);
+    }
+    free(batch.jobs);
+    batch_vars_free(batch.vars, batch.num_vars);
+    for (i = 0; ws != NULL && i < workers; ++i) {
+        if (ws[i].vm != NULL) jsonnet_destroy(ws[i].vm);
+        free(ws[i].native_ctxs);
+    }
+    free(ws);
+    if (batch.mutex != NULL) PyThread_free_lock(batch.mutex);
+    if (batch.done != NULL) PyThread_free_lock(batch.done);
+    Py_DECREF(fast);
+    return ret;
+}
+
+
+/* An evaluation started by evaluate_file_async or evaluate_snippet_async. */
+struct AsyncJob {
+    struct AsyncJob *next;
+    struct JsonnetVm *vm;
+    struct ImportCtx import_ctx;
+    struct NativeCtx *native_ctxs;
+    /* Our own references to the callbacks registered with the VM. */
+    PyObject *import_callback;
+    PyObject *native_callbacks;
+    /* The event loop, and the future to complete on it. */
+    PyObject *loop;
+    PyObject *future;
+    char *filename, *src;
+    int python_output;
+};
+
+/* The native threads that run asynchronous evaluations, started on first use and stopped when
+ * the interpreter exits. */
+static struct {
+    /* Protects the queue, running and stopping. */
+    PyThread_type_lock mutex;
+    /* Released when jobs are queued, and acquired by a worker looking for one. */
+    PyThread_type_lock wakeup;
+    /* Released by the last worker to stop. */
+    PyThread_type_lock stopped;
+    struct AsyncJob *head, *tail;
+    /* The number of workers that have not stopped yet. */
+    unsigned running;
+    int stopping;
+} async_pool;
+
+/* Called on the event loop's thread to complete the future of a finished job. */
+static PyObject *async_complete(PyObject *self, PyObject *args)
+{
+    PyObject *future, *value, *done;
+    int ok, is_done;
+
+    (void) self;
+
+    if (!PyArg_ParseTuple(args, "OiO", &future, &ok, &value)) return NULL;
 
-    if (jpathdir != NULL) {
-        // Support string for backward compatibility with <= 0.15.0
+    /* The future may have been cancelled while the evaluation was running. */
+    done = PyObject_CallMethod(future, "done", NULL);
+    if (done == NULL) return NULL;
+    is_done = PyObject_IsTrue(done);
+    Py_DECREF(done);
+    if (is_done < 0) return NULL;
+    if (is_done) Py_RETURN_NONE;
+    return PyObject_CallMethod(future, ok ? "set_result" : "set_exception", "O", value);
+}
+
+static PyMethodDef async_complete_def = {
+    "_async_complete", (PyCFunction)async_complete, METH_VARARGS, NULL
+};
+static PyObject *async_complete_fn;
+
+/* Must be called with the GIL held. */
+static void async_job_free(struct AsyncJob *job)
+{
+    if (job->vm != NULL) jsonnet_destroy(job->vm);
+    free(job->native_ctxs);
+    Py_XDECREF(job->import_callback);
+    Py_XDECREF(job->native_callbacks);
+    Py_XDECREF(job->loop);
+    Py_XDECREF(job->future);
+    free(job->filename);
+    free(job->src);
+    free(job);
+}
+
+/* Hand the result of a job over to its event loop.  Must be called with the GIL held. */
+static void async_job_finish(struct AsyncJob *job, char *out, struct JsonnetJsonValue *json,
+                             int error)
+{
+    PyObject *value, *r;
+    int ok = !error;
+
+    if (json != NULL) {
+        value = error ? PyObject_CallFunction(PyExc_RuntimeError, "s",
+                                              jsonnet_json_extract_string(job->vm, json))
+                      : jsonnet_json_to_python(job->vm, json);
+        jsonnet_json_destroy(job->vm, json);
+    } else {
 #if PY_MAJOR_VERSION >= 3
-        if (PyUnicode_Check(jpathdir)) {
-            jpath_str = PyUnicode_AsUTF8(jpathdir);
+        value = error ? PyObject_CallFunction(PyExc_RuntimeError, "s", out)
+                      : PyUnicode_FromString(out);
 #else
-        if (PyString_Check(jpathdir)) {
-            jpath_str = PyString_AsString(jpathdir);
+        value = error ? PyObject_CallFunction(PyExc_RuntimeError, "s", out)
+                      : PyString_FromString(out);
 #endif
-            jsonnet_jpath_add(vm, jpath_str);
-        } else if (PyList_Check(jpathdir)) {
-            num_jpathdir = PyList_Size(jpathdir);
-            for (i = 0; i < num_jpathdir ; ++i) {
-                PyObject *jpath = PyList_GetItem(jpathdir, i);
-#if PY_MAJOR_VERSION >= 3
-                if (PyUnicode_Check(jpath)) {
-                    jpath_str = PyUnicode_AsUTF8(jpath);
+        jsonnet_realloc(job->vm, out, 0);
+    }
+    if (value == NULL) {
+        /* Deliver the failed conversion to the awaiting coroutine instead. */
+        PyObject *type, *traceback;
+        PyErr_Fetch(&type, &value, &traceback);
+        PyErr_NormalizeException(&type, &value, &traceback);
+        Py_XDECREF(type);
+        Py_XDECREF(traceback);
+        ok = 0;
+    }
+
+    r = PyObject_CallMethod(job->loop, "call_soon_threadsafe", "OOiO", async_complete_fn,
+                            job->future, ok, value);
+    if (r == NULL) {
+        /* The loop has been closed, so nobody is waiting for the result. */
+        PyErr_Clear();
+    }
+    Py_XDECREF(r);
+    Py_XDECREF(value);
+}
+
+static void async_worker(void *unused)
+{
+    (void) unused;
+
+    for (;;) {
+        struct AsyncJob *job;
+        char *out = NULL;
+        struct JsonnetJsonValue *json = NULL;
+        int error, more;
+        PyGILState_STATE gil;
+
+        PyThread_acquire_lock(async_pool.wakeup, WAIT_LOCK);
+        PyThread_acquire_lock(async_pool.mutex, WAIT_LOCK);
+        if (async_pool.stopping) {
+            int last = --async_pool.running == 0;
+            PyThread_release_lock(async_pool.mutex);
+            /* Pass the wakeup on to the other workers, so that they stop too. */
+            PyThread_release_lock(async_pool.wakeup);
+            if (last) PyThread_release_lock(async_pool.stopped);
+            return;
+        }
+        job = async_pool.head;
+        if (job != NULL) {
+            async_pool.head = job->next;
+            if (async_pool.head == NULL) async_pool.tail = NULL;
+        }
+        more = async_pool.head != NULL;
+        PyThread_release_lock(async_pool.mutex);
+        /* Pass the wakeup on, so that another worker picks up the rest of the queue. */
+        if (more) PyThread_release_lock(async_pool.wakeup);
+        if (job == NULL) continue;
+
+        if (job->python_output) {
+            json = job->src == NULL
+                ? jsonnet_evaluate_file_json(job->vm, job->filename, &error)
+                : jsonnet_evaluate_snippet_json(job->vm, job->filename, job->src, &error);
+        } else {
+            out = job->src == NULL
+                ? jsonnet_evaluate_file(job->vm, job->filename, &error)
+                : jsonnet_evaluate_snippet(job->vm, job->filename, job->src, &error);
+        }
+
+        gil = PyGILState_Ensure();
+        async_job_finish(job, out, json, error);
+        async_job_free(job);
+        PyGILState_Release(gil);
+    }
+}
+
+/* Registered with atexit: wait for the running evaluations, drop the queued ones, and stop the
+ * workers, so that none of them calls into the interpreter after it has been finalized. */
+static PyObject *async_shutdown(PyObject *self, PyObject *unused)
+{
+    struct AsyncJob *queued;
+
+    (void) self;
+    (void) unused;
+
+    PyThread_acquire_lock(async_pool.mutex, WAIT_LOCK);
+    async_pool.stopping = 1;
+    queued = async_pool.head;
+    async_pool.head = async_pool.tail = NULL;
+    PyThread_release_lock(async_pool.mutex);
+
+    /* Nobody can await these any more. */
+    while (queued != NULL) {
+        struct AsyncJob *next = queued->next;
+        async_job_free(queued);
+        queued = next;
+    }
+
+    /* Workers finishing an evaluation need the GIL to hand over its result. */
+    Py_BEGIN_ALLOW_THREADS
+    PyThread_release_lock(async_pool.wakeup);
+    PyThread_acquire_lock(async_pool.stopped, WAIT_LOCK);
+    Py_END_ALLOW_THREADS
+    Py_RETURN_NONE;
+}
+
+static PyMethodDef async_shutdown_def = {
+    "_async_shutdown", (PyCFunction)async_shutdown, METH_NOARGS, NULL
+};
+
+/** Start the workers of the pool, and register their shutdown.  Must be called with the GIL held.
+ *
+ * \returns 1 on success, 0 with exception set upon failure.
+ */
+static int async_start(void)
+{
+    unsigned workers = cpu_count(), i;
+    PyObject *atexit, *shutdown = NULL, *r;
+
+#if PY_VERSION_HEX < 0x03070000
+    PyEval_InitThreads();
+#endif
+    if (async_complete_fn == NULL) {
+        async_complete_fn = PyCFunction_New(&async_complete_def, NULL);
+        if (async_complete_fn == NULL) return 0;
+    }
+    atexit = PyImport_ImportModule("atexit");
+    if (atexit == NULL) return 0;
+    shutdown = PyCFunction_New(&async_shutdown_def, NULL);
+    if (shutdown == NULL) goto error;
+
+    async_pool.mutex = PyThread_allocate_lock();
+    async_pool.wakeup = PyThread_allocate_lock();
+    async_pool.stopped = PyThread_allocate_lock();
+    if (async_pool.mutex == NULL || async_pool.wakeup == NULL || async_pool.stopped == NULL) {
+        PyErr_NoMemory();
+        goto error;
+    }
+    PyThread_acquire_lock(async_pool.wakeup, WAIT_LOCK);
+    PyThread_acquire_lock(async_pool.stopped, WAIT_LOCK);
+    for (i = 0; i < workers; ++i) {
+        /* Count the worker first, as it may see stopping as soon as it starts. */
+        PyThread_acquire_lock(async_pool.mutex, WAIT_LOCK);
+        async_pool.running++;
+        PyThread_release_lock(async_pool.mutex);
+        if (PyThread_start_new_thread(async_worker, NULL) == (unsigned long)-1) {
+            PyThread_acquire_lock(async_pool.mutex, WAIT_LOCK);
+            async_pool.running--;
+            PyThread_release_lock(async_pool.mutex);
+        }
+    }
+    if (async_pool.running == 0) {
+        PyErr_SetString(PyExc_RuntimeError, "could not start Jsonnet worker threads");
+        goto error;
+    }
+
+    r = PyObject_CallMethod(atexit, "register", "O", shutdown);
+    if (r == NULL) {
+        /* Without the hook the workers cannot be stopped safely, so stop them now. */
+        PyObject *type, *value, *traceback;
+        PyErr_Fetch(&type, &value, &traceback);
+        Py_XDECREF(async_shutdown(NULL, NULL));
+        PyErr_Restore(type, value, traceback);
+    }
+    Py_XDECREF(r);
+    Py_DECREF(atexit);
+    Py_DECREF(shutdown);
+    return r != NULL;
+
+error:
+    if (async_pool.mutex != NULL) PyThread_free_lock(async_pool.mutex);
+    if (async_pool.wakeup != NULL) PyThread_free_lock(async_pool.wakeup);
+    if (async_pool.stopped != NULL) PyThread_free_lock(async_pool.stopped);
+    async_pool.mutex = async_pool.wakeup = async_pool.stopped = NULL;
+    Py_DECREF(atexit);
+    Py_XDECREF(shutdown);
+    return 0;
+}
+
+/** Queue a job on the pool, starting the pool if necessary.  Must be called with the GIL held.
+ *
+ * \returns 1 on success, 0 with exception set upon failure.
+ */
+static int async_submit(struct AsyncJob *job)
+{
+    if (async_pool.mutex == NULL && !async_start()) return 0;
+
+    PyThread_acquire_lock(async_pool.mutex, WAIT_LOCK);
+    if (async_pool.stopping) {
+        PyThread_release_lock(async_pool.mutex);
+        PyErr_SetString(PyExc_RuntimeError,
+                        "cannot start a Jsonnet evaluation after interpreter shutdown");
+        return 0;
+    }
+    if (async_pool.tail == NULL) {
+        async_pool.head = job;
+    } else {
+        async_pool.tail->next = job;
+    }
+    async_pool.tail = job;
+    PyThread_release_lock(async_pool.mutex);
+    PyThread_release_lock(async_pool.wakeup);
+    return 1;
+}
+
+/* Parse the arguments of an asynchronous evaluation function, and queue it on the pool. */
+static PyObject *evaluate_async(PyObject *args, PyObject *keywds, int snippet)
+{
+    enum EvalKind kind = EVAL_JSON;
+    const char *filename, *src;
+    struct VmConfig config = VM_CONFIG_DEFAULT;
+    struct AsyncJob *job;
+    PyObject *asyncio, *future;
+
+    if (!evaluate_args(args, keywds, snippet, &kind, &filename, &src, &config)) return NULL;
+
+    job = calloc(1, sizeof(struct AsyncJob));
+    job->filename = copy_str(filename);
+    job->src = src == NULL ? NULL : copy_str(src);
+    job->python_output = kind == EVAL_PYTHON;
+
+    asyncio = PyImport_ImportModule("asyncio");
+    if (asyncio == NULL) goto error;
+#if PY_VERSION_HEX >= 0x03070000
+    job->loop = PyObject_CallMethod(asyncio, "get_running_loop", NULL);
 #else
-                if (PyString_Check(jpath)) {
-                    jpath_str = PyString_AsString(jpath);
+    job->loop = PyObject_CallMethod(asyncio, "get_event_loop", NULL);
 #endif
-                    jsonnet_jpath_add(vm, jpath_str);
-                }
-            }
+    Py_DECREF(asyncio);
+    if (job->loop == NULL) goto error;
+    job->future = PyObject_CallMethod(job->loop, "create_future", NULL);
+    if (job->future == NULL) goto error;
+
+    /* As with a Vm, keep our own references to the callbacks for as long as the job lives. */
+    if (config.native_callbacks != NULL) {
+        if (!PyDict_Check(config.native_callbacks)) {
+            PyErr_SetString(PyExc_TypeError, "native_callbacks must be a dict");
+            goto error;
         }
+        config.native_callbacks = PyDict_Copy(config.native_callbacks);
+        if (config.native_callbacks == NULL) goto error;
+        job->native_callbacks = config.native_callbacks;
     }
+    Py_XINCREF(config.import_callback);
+    job->import_callback = config.import_callback;
 
-    if (!handle_vars(vm, ext_vars, 0, 0)) return NULL;
-    if (!handle_vars(vm, ext_codes, 1, 0)) return NULL;
-    if (!handle_vars(vm, tla_vars, 0, 1)) return NULL;
-    if (!handle_vars(vm, tla_codes, 1, 1)) return NULL;
-    struct ImportCtx ctx = { vm, &py_thread, import_callback };
-    if (!handle_import_callback(&ctx, import_callback)) {
-        return NULL;
+    /* Callbacks from the pool find no saved thread state, so they use the GILState API. */
+    job->vm = jsonnet_make();
+    if (!handle_config(job->vm, &config, &job->import_ctx, &job->native_ctxs, NULL))
+        goto error;
+
+    future = job->future;
+    Py_INCREF(future);
+    if (!async_submit(job)) {
+        Py_DECREF(future);
+        goto error;
     }
-    struct NativeCtx *ctxs = NULL;
-    if (!handle_native_callbacks(vm, native_callbacks, &ctxs, &py_thread)) {
-        free(ctxs);
-        return NULL;
+    return future;
+
+error:
+    async_job_free(job);
+    return NULL;
+}
+
+static PyObject* evaluate_file_async(PyObject* self, PyObject* args, PyObject *keywds)
+{
+    (void) self;
+    return evaluate_async(args, keywds, 0);
+}
+
+static PyObject* evaluate_snippet_async(PyObject* self, PyObject* args, PyObject *keywds)
+{
+    (void) self;
+    return evaluate_async(args, keywds, 1);
+}
+
+
+/* A Jsonnet VM that is configured once and then used for many evaluations.
+ *
+ * The VM keeps references to the callbacks it was given, and owns the contexts they are
+ * registered with, for as long as it lives.
+ */
+typedef struct {
+    PyObject_HEAD
+    struct JsonnetVm *vm;
+    PyThreadState *py_thread;
+    struct ImportCtx import_ctx;
+    struct NativeCtx *native_ctxs;
+    PyObject *import_callback;
+    PyObject *native_callbacks;
+    /* Set while an evaluation is running, since the GIL is released at that point. */
+    int busy;
+} VmObject;
+
+static int Vm_clear(VmObject *self)
+{
+    if (self->vm != NULL) {
+        jsonnet_destroy(self->vm);
+        self->vm = NULL;
     }
-    py_thread = PyEval_SaveThread();
-    out = jsonnet_evaluate_snippet(vm, filename, src, &error);
-    PyEval_RestoreThread(py_thread);
-    free(ctxs);
-    return handle_result(vm, out, error);
+    free(self->native_ctxs);
+    self->native_ctxs = NULL;
+    Py_CLEAR(self->import_callback);
+    Py_CLEAR(self->native_callbacks);
+    return 0;
+}
+
+static int Vm_traverse(VmObject *self, visitproc visit, void *arg)
+{
+    Py_VISIT(self->import_callback);
+    Py_VISIT(self->native_callbacks);
+    return 0;
+}
+
+static void Vm_dealloc(VmObject *self)
+{
+    PyObject_GC_UnTrack(self);
+    Vm_clear(self);
+    Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static int Vm_init(VmObject *self, PyObject *args, PyObject *keywds)
+{
+    struct VmConfig config = VM_CONFIG_DEFAULT;
+    static char *kwlist[] = {VM_CONFIG_KWLIST, NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, keywds, "|" VM_CONFIG_FORMAT, kwlist,
+                                     VM_CONFIG_ARGS(config))) {
+        return -1;
+    }
+
+    if (self->busy) {
+        PyErr_SetString(PyExc_RuntimeError, "Vm cannot be re-initialized while evaluating");
+        return -1;
+    }
+    Vm_clear(self);
+
+    /* Take our own copy of the callbacks dict, so the registered callbacks stay alive even if
+     * the caller later mutates the one it passed in. */
+    if (config.native_callbacks != NULL) {
+        if (!PyDict_Check(config.native_callbacks)) {
+            PyErr_SetString(PyExc_TypeError, "native_callbacks must be a dict");
+            return -1;
+        }
+        config.native_callbacks = PyDict_Copy(config.native_callbacks);
+        if (config.native_callbacks == NULL) return -1;
+        self->native_callbacks = config.native_callbacks;
+    }
+    Py_XINCREF(config.import_callback);
+    self->import_callback = config.import_callback;
+
+    self->vm = jsonnet_make();
+    if (!handle_config(self->vm, &config, &self->import_ctx, &self->native_ctxs,
+                       &self->py_thread)) {
+        Vm_clear(self);
+        return -1;
+    }
+    return 0;
+}
+
+static int Vm_check_ready(VmObject *self)
+{
+    if (self->vm == NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "Vm is not initialized");
+        return 0;
+    }
+    if (self->busy) {
+        PyErr_SetString(PyExc_RuntimeError, "Vm is already evaluating");
+        return 0;
+    }
+    return 1;
+}
+
+/** Parse the arguments of a Vm evaluation method, and run it.
+ *
+ * Where kind is EVAL_JSON, the python_output keyword selects EVAL_PYTHON instead.
+ */
+static PyObject *Vm_evaluate_aux(VmObject *self, PyObject *args, PyObject *keywds, int snippet,
+                                 enum EvalKind kind)
+{
+    const char *filename, *src = NULL;
+    int python_output = 0;
+    PyObject *ret;
+    int ok;
+    static char *file_kwlist[] = {"filename", NULL};
+    static char *file_python_kwlist[] = {"filename", "python_output", NULL};
+    static char *snippet_kwlist[] = {"filename", "src", NULL};
+    static char *snippet_python_kwlist[] = {"filename", "src", "python_output", NULL};
+
+    if (snippet && kind == EVAL_JSON) {
+        ok = PyArg_ParseTupleAndKeywords(args, keywds, "ss|i", snippet_python_kwlist, &filename,
+                                         &src, &python_output);
+    } else if (snippet) {
+        ok = PyArg_ParseTupleAndKeywords(args, keywds, "ss", snippet_kwlist, &filename, &src);
+    } else if (kind == EVAL_JSON) {
+        ok = PyArg_ParseTupleAndKeywords(args, keywds, "s|i", file_python_kwlist, &filename,
+                                         &python_output);
+    } else {
+        ok = PyArg_ParseTupleAndKeywords(args, keywds, "s", file_kwlist, &filename);
+    }
+    if (!ok) return NULL;
+    if (python_output) kind = EVAL_PYTHON;
+    if (!Vm_check_ready(self)) return NULL;
+
+    self->busy = 1;
+    ret = do_evaluate(self->vm, &self->py_thread, filename, src, kind);
+    self->busy = 0;
+    return ret;
 }
 
+static PyObject *Vm_evaluate_file(VmObject *self, PyObject *args, PyObject *keywds)
+{
+    return Vm_evaluate_aux(self, args, keywds, 0, EVAL_JSON);
+}
+
+static PyObject *Vm_evaluate_snippet(VmObject *self, PyObject *args, PyObject *keywds)
+{
+    return Vm_evaluate_aux(self, args, keywds, 1, EVAL_JSON);
+}
+
+static PyObject *Vm_evaluate_file_multi(VmObject *self, PyObject *args, PyObject *keywds)
+{
+    return Vm_evaluate_aux(self, args, keywds, 0, EVAL_MULTI);
+}
+
+static PyObject *Vm_evaluate_snippet_multi(VmObject *self, PyObject *args, PyObject *keywds)
+{
+    return Vm_evaluate_aux(self, args, keywds, 1, EVAL_MULTI);
+}
+
+static PyObject *Vm_evaluate_file_stream(VmObject *self, PyObject *args, PyObject *keywds)
+{
+    return Vm_evaluate_aux(self, args, keywds, 0, EVAL_STREAM);
+}
+
+static PyObject *Vm_evaluate_snippet_stream(VmObject *self, PyObject *args, PyObject *keywds)
+{
+    return Vm_evaluate_aux(self, args, keywds, 1, EVAL_STREAM);
+}
+
+static PyObject *Vm_invalidate_import_cache(VmObject *self, PyObject *args, PyObject *keywds)
+{
+    const char *path = NULL;
+    static char *kwlist[] = {"path", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, keywds, "|z", kwlist, &path)) return NULL;
+    if (!Vm_check_ready(self)) return NULL;
+    jsonnet_import_cache_invalidate(self->vm, path);
+    Py_RETURN_NONE;
+}
+
+static PyMethodDef Vm_methods[] = {
+    {"evaluate_file", (PyCFunction)Vm_evaluate_file, METH_VARARGS | METH_KEYWORDS,
+     "Interpret the given Jsonnet file."},
+    {"evaluate_snippet", (PyCFunction)Vm_evaluate_snippet, METH_VARARGS | METH_KEYWORDS,
+     "Interpret the given Jsonnet code."},
+    {"evaluate_file_multi", (PyCFunction)Vm_evaluate_file_multi, METH_VARARGS | METH_KEYWORDS,
+     "Interpret the given Jsonnet file, yielding a dict of named JSON files."},
+    {"evaluate_snippet_multi", (PyCFunction)Vm_evaluate_snippet_multi,
+     METH_VARARGS | METH_KEYWORDS,
+     "Interpret the given Jsonnet code, yielding a dict of named JSON files."},
+    {"evaluate_file_stream", (PyCFunction)Vm_evaluate_file_stream, METH_VARARGS | METH_KEYWORDS,
+     "Interpret the given Jsonnet file, yielding a list of JSON documents."},
+    {"evaluate_snippet_stream", (PyCFunction)Vm_evaluate_snippet_stream,
+     METH_VARARGS | METH_KEYWORDS,
+     "Interpret the given Jsonnet code, yielding a list of JSON documents."},
+    {"invalidate_import_cache", (PyCFunction)Vm_invalidate_import_cache,
+     METH_VARARGS | METH_KEYWORDS,
+     "Drop the given path, or every file if None, from the parsed imports kept by the Vm."},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyTypeObject VmType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "_jsonnet.Vm",                                  /* tp_name */
+    sizeof(VmObject),                               /* tp_basicsize */
+    0,                                              /* tp_itemsize */
+    (destructor)Vm_dealloc,                         /* tp_dealloc */
+    0,                                              /* tp_print */
+    0,                                              /* tp_getattr */
+    0,                                              /* tp_setattr */
+    0,                                              /* tp_compare */
+    0,                                              /* tp_repr */
+    0,                                              /* tp_as_number */
+    0,                                              /* tp_as_sequence */
+    0,                                              /* tp_as_mapping */
+    0,                                              /* tp_hash */
+    0,                                              /* tp_call */
+    0,                                              /* tp_str */
+    0,                                              /* tp_getattro */
+    0,                                              /* tp_setattro */
+    0,                                              /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC,  /* tp_flags */
+    "A Jsonnet VM, configured once and reusable for many evaluations.",  /* tp_doc */
+    (traverseproc)Vm_traverse,                      /* tp_traverse */
+    (inquiry)Vm_clear,                              /* tp_clear */
+    0,                                              /* tp_richcompare */
+    0,                                              /* tp_weaklistoffset */
+    0,                                              /* tp_iter */
+    0,                                              /* tp_iternext */
+    Vm_methods,                                     /* tp_methods */
+    0,                                              /* tp_members */
+    0,                                              /* tp_getset */
+    0,                                              /* tp_base */
+    0,                                              /* tp_dict */
+    0,                                              /* tp_descr_get */
+    0,                                              /* tp_descr_set */
+    0,                                              /* tp_dictoffset */
+    (initproc)Vm_init,                              /* tp_init */
+    0,                                              /* tp_alloc */
+    PyType_GenericNew,                              /* tp_new */
+};
+
 static PyMethodDef module_methods[] = {
     {"evaluate_file", (PyCFunction)evaluate_file, METH_VARARGS | METH_KEYWORDS,
      "Interpret the given Jsonnet file."},
     {"evaluate_snippet", (PyCFunction)evaluate_snippet, METH_VARARGS | METH_KEYWORDS,
      "Interpret the given Jsonnet code."},
+    {"evaluate_file_multi", (PyCFunction)evaluate_file_multi, METH_VARARGS | METH_KEYWORDS,
+     "Interpret the given Jsonnet file, yielding a dict of named JSON files."},
+    {"evaluate_snippet_multi", (PyCFunction)evaluate_snippet_multi, METH_VARARGS | METH_KEYWORDS,
+     "Interpret the given Jsonnet code, yielding a dict of named JSON files."},
+    {"evaluate_file_stream", (PyCFunction)evaluate_file_stream, METH_VARARGS | METH_KEYWORDS,
+     "Interpret the given Jsonnet file, yielding a list of JSON documents."},
+    {"evaluate_snippet_stream", (PyCFunction)evaluate_snippet_stream,
+     METH_VARARGS | METH_KEYWORDS,
+     "Interpret the given Jsonnet code, yielding a list of JSON documents."},
+    {"evaluate_many", (PyCFunction)evaluate_many, METH_VARARGS | METH_KEYWORDS,
+     "Interpret a list of Jsonnet files or snippets on a pool of native threads."},
+    {"evaluate_file_async", (PyCFunction)evaluate_file_async, METH_VARARGS | METH_KEYWORDS,
+     "Interpret the given Jsonnet file on a native thread, returning an asyncio future."},
+    {"evaluate_snippet_async", (PyCFunction)evaluate_snippet_async, METH_VARARGS | METH_KEYWORDS,
+     "Interpret the given Jsonnet code on a native thread, returning an asyncio future."},
     {NULL, NULL, 0, NULL}
 };
 
@@ -655,11 +1805,22 @@ static struct PyModuleDef _jsonnet =
 
 PyMODINIT_FUNC PyInit__jsonnet(void)
 {
-    return PyModule_Create(&_jsonnet);
+    PyObject *module;
+    if (PyType_Ready(&VmType) < 0) return NULL;
+    module = PyModule_Create(&_jsonnet);
+    if (module == NULL) return NULL;
+    Py_INCREF(&VmType);
+    PyModule_AddObject(module, "Vm", (PyObject *)&VmType);
+    return module;
 }
 #else
 PyMODINIT_FUNC init_jsonnet(void)
 {
-    Py_InitModule3("_jsonnet", module_methods, "A Python interface to Jsonnet.");
+    PyObject *module;
+    if (PyType_Ready(&VmType) < 0) return;
+    module = Py_InitModule3("_jsonnet", module_methods, "A Python interface to Jsonnet.");
+    if (module == NULL) return;
+    Py_INCREF(&VmType);
+    PyModule_AddObject(module, "Vm", (PyObject *)&VmType);
 }
 #endif
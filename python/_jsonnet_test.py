@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import os
+import sys
 import unittest
 
 import _jsonnet
@@ -93,5 +94,231 @@ class JsonnetTests(unittest.TestCase):
         )
         self.assertEqual(json_str, self.expected_str)
 
+    def test_vm(self):
+        vm = _jsonnet.Vm(
+            import_callback=import_callback,
+            native_callbacks=native_callbacks,
+        )
+        for _ in range(3):
+            self.assertEqual(vm.evaluate_file(self.input_filename), self.expected_str)
+            self.assertEqual(
+                vm.evaluate_snippet("snippet", self.input_snippet), self.expected_str)
+
+    def test_vm_config(self):
+        vm = _jsonnet.Vm(ext_vars={'x': 'foo'}, tla_codes={'y': '[1]'})
+        self.assertEqual(
+            vm.evaluate_snippet("snippet", "function(y) [std.extVar('x')] + y"),
+            '[\n   "foo",\n   1\n]\n')
+
+    def test_vm_import_cache(self):
+        files = {'lib.libsonnet': '{ x: std.length(x=[1, 2]) }'}
+
+        def callback(dir, rel):
+            return rel, files[rel]
+
+        vm = _jsonnet.Vm(import_callback=callback, import_cache_size=4)
+        for _ in range(3):
+            self.assertEqual(
+                vm.evaluate_snippet("snippet", "(import 'lib.libsonnet').x"), "2\n")
+        files['lib.libsonnet'] = '{ x: 3 }'
+        self.assertEqual(vm.evaluate_snippet("snippet", "(import 'lib.libsonnet').x"), "3\n")
+        vm.invalidate_import_cache('lib.libsonnet')
+        vm.invalidate_import_cache()
+        self.assertEqual(vm.evaluate_snippet("snippet", "(import 'lib.libsonnet').x"), "3\n")
+
+    def test_vm_error(self):
+        vm = _jsonnet.Vm()
+        with self.assertRaises(RuntimeError):
+            vm.evaluate_snippet("snippet", "error 'foo'")
+        self.assertEqual(vm.evaluate_snippet("snippet", "1 + 1"), "2\n")
+
+    def test_python_output(self):
+        value = _jsonnet.evaluate_snippet(
+            "snippet",
+            "{ b: [1, 'two', true, null, { c: false }], a: 1.5, h:: 'hidden' }",
+            python_output=True,
+        )
+        self.assertEqual(value, {
+            'a': 1.5,
+            'b': [1.0, 'two', True, None, {'c': False}],
+        })
+        self.assertIsInstance(value['b'][0], float)
+
+    def test_python_output_file(self):
+        value = _jsonnet.evaluate_file(
+            self.input_filename,
+            import_callback=import_callback,
+            native_callbacks=native_callbacks,
+            python_output=True,
+        )
+        self.assertIs(value, True)
+
+    def test_python_output_error(self):
+        with self.assertRaises(RuntimeError):
+            _jsonnet.evaluate_snippet("snippet", "{ f: function() 1 }", python_output=True)
+        vm = _jsonnet.Vm()
+        self.assertEqual(vm.evaluate_snippet("snippet", "[]", python_output=True), [])
+
+    def test_multi(self):
+        files = _jsonnet.evaluate_snippet_multi(
+            "snippet", "{ 'a.json': { x: 1 }, 'b.json': [] }")
+        self.assertEqual(files, {
+            'a.json': '{\n   "x": 1\n}\n',
+            'b.json': '[ ]\n',
+        })
+        self.assertEqual(
+            _jsonnet.evaluate_snippet_multi(
+                "snippet", "{ 'a.txt': 'foo' }", string_output=True),
+            {'a.txt': 'foo\n'})
+        with self.assertRaises(RuntimeError):
+            _jsonnet.evaluate_snippet_multi("snippet", "[]")
+
+    def test_stream(self):
+        docs = _jsonnet.evaluate_snippet_stream("snippet", "[{ x: 1 }, 'two', []]")
+        self.assertEqual(docs, ['{\n   "x": 1\n}\n', '"two"\n', '[ ]\n'])
+        self.assertEqual(
+            _jsonnet.evaluate_snippet_stream(
+                "snippet", "['a', 'b']", string_output=True),
+            ['a\n', 'b\n'])
+        self.assertEqual(_jsonnet.evaluate_snippet_stream("snippet", "[]"), [])
+        with self.assertRaises(RuntimeError):
+            _jsonnet.evaluate_snippet_stream("snippet", "{}")
+
+    def test_vm_multi_stream(self):
+        vm = _jsonnet.Vm(string_output=True)
+        self.assertEqual(vm.evaluate_snippet("snippet", "'foo'"), 'foo\n')
+        self.assertEqual(
+            vm.evaluate_snippet_multi("snippet", "{ a: 'x' }"), {'a': 'x\n'})
+        self.assertEqual(vm.evaluate_snippet_stream("snippet", "['y']"), ['y\n'])
+
+    def test_native_structured_args(self):
+        received = []
+
+        def record(x, y):
+            received.append((x, y))
+            return len(x) + len(y['b'])
+
+        json_str = _jsonnet.evaluate_snippet(
+            "snippet",
+            "std.native('record')([1, 'a', [null]], { b: [true], h:: 'hidden' })",
+            native_callbacks={'record': (('x', 'y'), record)},
+        )
+        self.assertEqual(json_str, "4\n")
+        self.assertEqual(received, [([1.0, 'a', [None]], {'b': [True]})])
+
+    def test_native_function_arg(self):
+        with self.assertRaises(RuntimeError):
+            _jsonnet.evaluate_snippet(
+                "snippet",
+                "std.native('concat')(function() 1, 'b')",
+                native_callbacks=native_callbacks,
+            )
+
+    def test_evaluate_many(self):
+        jobs = [
+            self.input_filename,
+            (("snippet", "std.extVar('x')"), {'x': 'foo'}),
+            (("snippet", "function(y) y + '!'"), None, {'y': 'hi'}),
+            ("snippet", "error 'bar'"),
+            (self.input_filename, {'unused': 'yes'}),
+        ]
+        results = _jsonnet.evaluate_many(
+            jobs * 5,
+            workers=4,
+            tla_codes={'y': '41'},
+            import_callback=import_callback,
+            native_callbacks=native_callbacks,
+        )
+        self.assertEqual(len(results), 25)
+        for i in range(0, 25, 5):
+            self.assertEqual(results[i], self.expected_str)
+            self.assertEqual(results[i + 1], '"foo"\n')
+            self.assertEqual(results[i + 2], '"hi!"\n')
+            self.assertIsInstance(results[i + 3], RuntimeError)
+            self.assertIn('bar', str(results[i + 3]))
+            self.assertEqual(results[i + 4], self.expected_str)
+
+    def test_evaluate_many_python_output(self):
+        results = _jsonnet.evaluate_many(
+            [("snippet", "[%d]" % i) for i in range(10)], python_output=True)
+        self.assertEqual(results, [[float(i)] for i in range(10)])
+        self.assertEqual(_jsonnet.evaluate_many([]), [])
+        with self.assertRaises(TypeError):
+            _jsonnet.evaluate_many([1])
+
+    def run_async(self, *awaitables):
+        import asyncio
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            # The evaluations must be started from the running loop.
+            started = loop.create_future()
+
+            def start():
+                try:
+                    started.set_result(asyncio.gather(*[a() for a in awaitables]))
+                except Exception as e:
+                    started.set_exception(e)
+
+            loop.call_soon(start)
+            return loop.run_until_complete(loop.run_until_complete(started))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def test_async(self):
+        results = self.run_async(
+            lambda: _jsonnet.evaluate_file_async(
+                self.input_filename,
+                import_callback=import_callback,
+                native_callbacks=native_callbacks,
+            ),
+            lambda: _jsonnet.evaluate_snippet_async(
+                "snippet",
+                self.input_snippet,
+                import_callback=import_callback,
+                native_callbacks=native_callbacks,
+            ),
+            lambda: _jsonnet.evaluate_snippet_async(
+                "snippet", "{x: std.extVar('x')}", ext_vars={'x': 'y'}, python_output=True),
+            *[lambda i=i: _jsonnet.evaluate_snippet_async("snippet", str(i)) for i in range(20)]
+        )
+        self.assertEqual(results[0], self.expected_str)
+        self.assertEqual(results[1], self.expected_str)
+        self.assertEqual(results[2], {'x': 'y'})
+        self.assertEqual(results[3:], ['%d\n' % i for i in range(20)])
+
+    def test_async_error(self):
+        with self.assertRaises(RuntimeError) as cm:
+            self.run_async(lambda: _jsonnet.evaluate_snippet_async("snippet", "error 'foo'"))
+        self.assertIn('foo', str(cm.exception))
+
+    def test_async_no_running_loop(self):
+        with self.assertRaises(RuntimeError):
+            _jsonnet.evaluate_snippet_async("snippet", "1")
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'needs asyncio.run')
+    def test_async_exit(self):
+        # Exiting while an evaluation is running waits for it, instead of letting its worker
+        # call into the finalized interpreter.
+        import subprocess
+        script = (
+            "import asyncio, sys, _jsonnet\n"
+            "def mark(x):\n"
+            "    sys.stdout.write('evaluated\\n')\n"
+            "    return x\n"
+            "async def main():\n"
+            "    _jsonnet.evaluate_snippet_async(\n"
+            "        'snippet', \"std.native('mark')(std.length(std.range(1, 3000000)))\",\n"
+            "        native_callbacks={'mark': (('x',), mark)})\n"
+            "    await asyncio.sleep(0.1)\n"
+            "asyncio.run(main())\n"
+            "print('done')\n"
+        )
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        out = subprocess.check_output([sys.executable, '-c', script], env=env)
+        self.assertEqual(sorted(out.split()), [b'done', b'evaluated'])
+
 if __name__ == '__main__':
     unittest.main()
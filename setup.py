@@ -24,6 +24,7 @@ LIB_OBJECTS = [
     'core/formatter.o',
     'core/libjsonnet.o',
     'core/lexer.o',
+    'core/optimizer.o',
     'core/parser.o',
     'core/pass.o',
     'core/static_analysis.o',
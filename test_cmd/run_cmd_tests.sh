@@ -46,9 +46,9 @@ if do_test "exec_out" 0 -e "{ a: 1, b: 2, c: 3 }" -o "out/exec_out/custom_output
     check_file "exec_out" "out/exec_out/custom_output" "exec_out.golden.custom_output"
 fi
 do_test "double_dash" 0 -e -- -1
-do_test "max_stack1" 1 -s 1 -e 'local x = 1; x'
-do_test "max_stack2" 1 --max-stack 1 -e 'local x = 1; x'
-do_test "max_stack3" 0 --max-stack 2 -e 'local x = 1; x'
+do_test "max_stack1" 1 -s 1 -e 'local x = {}; x'
+do_test "max_stack2" 1 --max-stack 1 -e 'local x = {}; x'
+do_test "max_stack3" 0 --max-stack 2 -e 'local x = {}; x'
 do_test "max_stack4" 0 --max-stack 7 -e 'local f(n, c=0) = if n == 0 then c else f(n - 1, c + n) tailstrict; f(100)'
 do_test "max_stack5" 1 --max-stack 0 -e 'true'
 do_test "max_stack6" 1 --max-stack -1 -e 'true'
@@ -67,6 +67,8 @@ do_test "ext4" 0 --ext-code x=1+1 -e 'std.extVar("x")'
 do_test "ext5" 0 --ext-str-file "x=test.txt" -e 'std.extVar("x")'
 do_test "ext6" 0 --ext-code-file "x=test.jsonnet" -e 'std.extVar("x")'
 do_test "ext7" 0 --ext-code-file "x=lib1/lib3_test.jsonnet" -e 'std.extVar("x")'
+do_test "ext8" 0 --ext-code 'x=[std.thisFile, std.length(x=[1])]' -e 'local f(y) = std.extVar("x"); f(1)'
+do_test "ext9" 0 --ext-code 'x=std.trace("once", 1)' -e '[std.extVar("x") for i in [1, 2]]'
 do_test "tla1" 0 --tla-str x=1 -e 'function(x) x'
 do_test "tla2" 0 -A x=1 -e 'function(x) x'
 do_test "tla3" 1 -A y=1 -e 'function(x) x'
@@ -103,6 +105,8 @@ if do_test "yaml3" 0 -y -o "out/yaml3/stream" -e '[1,2,3]'; then
 fi
 do_test "string1" 0 -S -e '"A long\nparagraph."'
 do_test "string2" 1 -S -e 'null'
+do_test "string_yaml1" 0 -S -y -e '["A long\nparagraph.", "Another"]'
+do_test "string_yaml2" 1 -S -y -e '["A", 1]'
 
 export JSONNET_PATH=lib1:lib2
 do_test "jsonnet_path1" 0 -e 'importstr "shared.txt"'